@@ -1,11 +1,36 @@
+import io
 import os
+import fcntl
+import re
+import json
+import math
+import mmap
+import signal
+import asyncio
+import hashlib
 import logging
-from typing import Dict, Any, Optional
+import tempfile
+import threading
+import time
+import uuid
+import resource
+import contextvars
+import multiprocessing
+import zipfile
+import zlib
+from collections import Counter, OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from multiprocessing import reduction
+from multiprocessing.connection import Connection
+from typing import Callable, Dict, Any, List, Optional, Sequence, Tuple, Union
 from urllib.parse import urlsplit, urlunsplit, quote, quote_plus
 
-import requests
-from fastapi import FastAPI, UploadFile, File, HTTPException
+import httpx
+import numpy as np
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel  # HttpUrl verwijderd
 
 app = FastAPI(title="STEP Analyzer", version="1.3.1")
@@ -26,6 +51,15 @@ class AnalyzeUrlRequest(BaseModel):
     file_url: str                       # was HttpUrl -> str
     material: Optional[str] = "steel"
     density_kg_m3: Optional[float] = None
+    materials: Optional[List[str]] = None           # extra gewichten, bijv. ["steel", "stainless", "aluminum"]
+    densities_kg_m3: Optional[List[float]] = None   # idem, met eigen dichtheden
+    obb: Optional[str] = None           # off | fast | optimal
+    precision: Optional[str] = None     # fast | standard | exact
+    timeout_s: Optional[float] = None   # tijdsbudget voor de analyse (max STEP_JOB_TIMEOUT_S)
+
+
+class AnalyzeUrlJobRequest(AnalyzeUrlRequest):
+    callback_url: Optional[str] = None  # krijgt een POST met het job-record als hij klaar is
 
 
 @app.get("/")
@@ -33,7 +67,8 @@ def root():
     return {
         "name": "STEP Analyzer",
         "version": app.version if hasattr(app, "version") else "n/a",
-        "endpoints": ["/healthz", "/analyze (multipart upload)", "/analyze-url (json)"],
+        "endpoints": ["/healthz", "/analyze (multipart upload)", "/analyze-url (json)", "/analyze-batch (multipart)", "/preflight", "/preflight-url", "/estimate", "/estimate-url", "/materials", "/metadata", "/metadata-url", "/jobs/analyze", "/jobs/analyze-url", "/jobs/{id}", "/jobs/{id}/events (SSE)", "/analyze-stream (SSE)", "/analyze-url-stream (SSE)", "/cache/stats", "/metrics"],
+        "backend": {"flavor": _OCC["flavor"] if _OCC else None, **_BACKEND_TIMINGS},
     }
 
 
@@ -42,8 +77,220 @@ def healthz():
     return {"status": "ok"}
 
 
+# ===== Metrics (Prometheus tekstformaat) =====
+# Eigen kleine registry: alleen counters en histogrammen, geen extra dependency.
+# Stage-timings uit de workers gaan met het resultaat mee terug en worden hier
+# in de API-proces-registry opgenomen.
+_STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+_METRIC_HELP = {
+    "step_analyzer_stage_seconds": ("histogram", "Duur per verwerkingsstap."),
+    "step_analyzer_requests_total": ("counter", "HTTP-requests per endpoint en status."),
+    "step_analyzer_bytes_total": ("counter", "Verwerkte STEP-bytes per bron."),
+    "step_analyzer_compressed_bytes_total": ("counter", "Ontvangen gecomprimeerde bytes per formaat."),
+    "step_analyzer_volume_fallback_total": ("counter", "Volumes geschat als 80% van de bbox."),
+    "step_analyzer_cache_events_total": ("counter", "Geometrie-cache hits/misses/evicties."),
+    "step_analyzer_shape_cache_hits_total": ("counter", "Shapes uit de BRep-cache geladen (geen STEP-vertaling)."),
+    "step_analyzer_shape_cache_misses_total": ("counter", "Shapes vertaald uit STEP en in de BRep-cache gezet."),
+    "step_analyzer_shape_cache_evictions_total": ("counter", "Uit de BRep-cache verwijderde shapes."),
+    "step_analyzer_backend_info": ("gauge", "Gebruikte CAD-backend."),
+    "step_analyzer_worker_restarts_total": ("counter", "Vervangen workers per reden (crash, jobs, rss, cancelled, timeout)."),
+    "step_analyzer_cancelled_total": ("counter", "Afgebroken jobs per reden (client, timeout)."),
+    "step_analyzer_coalesced_total": ("counter", "Requests die meeliftten op een gelijke lopende analyse (process, host)."),
+    "step_analyzer_url_revalidations_total": ("counter", "Downloads in /analyze-url per uitkomst (not_modified, modified, uncached)."),
+    "step_analyzer_memory_reserved_bytes": ("gauge", "Som van de voorspelde geheugenpieken van lopende jobs."),
+    "step_analyzer_memory_capacity_bytes": ("gauge", "Geheugenbudget voor jobs (deel van de cgroup-limiet)."),
+    "step_analyzer_memory_calibration": ("gauge", "Correctiefactor gemeten/voorspelde geheugenpiek."),
+    "step_analyzer_memory_rejected_total": ("counter", "Jobs geweigerd door het geheugenbudget (too_large, timeout)."),
+}
+
+
+def _label_str(labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class _Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values: Dict[Any, float] = {}
+        self._hists: Dict[Any, List[Any]] = {}
+
+    def inc(self, name: str, value: float = 1.0, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self._values[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._hists.get(key)
+            if hist is None:
+                hist = self._hists[key] = [[0] * len(_STAGE_BUCKETS), 0.0, 0]
+            for i, bound in enumerate(_STAGE_BUCKETS):
+                if value <= bound:
+                    hist[0][i] += 1
+            hist[1] += value
+            hist[2] += 1
+
+    def render(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            names = sorted({k[0] for k in self._values} | {k[0] for k in self._hists})
+            for name in names:
+                kind, help_text = _METRIC_HELP.get(name, ("untyped", ""))
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for (n, labels), value in sorted(self._values.items()):
+                    if n == name:
+                        lines.append(f"{name}{_label_str(labels)} {value:g}")
+                for (n, labels), (buckets, total, count) in sorted(self._hists.items()):
+                    if n != name:
+                        continue
+                    for bound, hits in zip(_STAGE_BUCKETS, buckets):
+                        lines.append(f"{name}_bucket{_label_str(labels + (('le', f'{bound:g}'),))} {hits}")
+                    lines.append(f"{name}_bucket{_label_str(labels + (('le', '+Inf'),))} {count}")
+                    lines.append(f"{name}_sum{_label_str(labels)} {total:g}")
+                    lines.append(f"{name}_count{_label_str(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+_METRICS = _Metrics()
+
+# In een worker verzamelt een job zijn stages/tellers hier (zie _collected);
+# in het API-proces is dit None en gaat alles direct naar _METRICS.
+_JOB_STATS: Optional[Dict[str, Dict[str, float]]] = None
+
+
+@contextmanager
+def _stage(name: str):
+    _check_cancel()
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - t0
+        if _JOB_STATS is not None:
+            stages = _JOB_STATS["stages"]
+            stages[name] = stages.get(name, 0.0) + elapsed
+        else:
+            _METRICS.observe("step_analyzer_stage_seconds", elapsed, stage=name)
+
+
+def _count(name: str, value: float = 1.0) -> None:
+    if _JOB_STATS is not None:
+        counters = _JOB_STATS["counters"]
+        counters[name] = counters.get(name, 0.0) + value
+    else:
+        _METRICS.inc(name, value)
+
+
+def _collected(fn, *args):
+    """Draait in een worker: voert fn uit en geeft (resultaat, stats) terug."""
+    global _JOB_STATS
+    _JOB_STATS = {"stages": {}, "counters": {}}
+    try:
+        return fn(*args), _JOB_STATS
+    finally:
+        _JOB_STATS = None
+
+
+def _record_job_stats(stats: Dict[str, Dict[str, float]]) -> None:
+    for name, seconds in stats["stages"].items():
+        _METRICS.observe("step_analyzer_stage_seconds", seconds, stage=name)
+    for name, value in stats["counters"].items():
+        _METRICS.inc(name, value)
+
+
+# ===== Annuleren en tijdsbudget van de lopende job (alleen in een worker) =====
+# De parent zet de deadline mee in het job-bericht en stuurt SIGUSR1 als de
+# aanvrager weg is. Elke stage begint met een controle; tijdens TransferRoots
+# vraagt OCCT het zelf via de progress-indicator (zie _progress_range).
+_JOB_DEADLINE: Optional[float] = None  # time.monotonic()
+_JOB_CANCELLED = False
+
+
+def _on_cancel_signal(signum, frame) -> None:
+    global _JOB_CANCELLED
+    _JOB_CANCELLED = True
+
+
+def _should_stop() -> bool:
+    return _JOB_CANCELLED or (_JOB_DEADLINE is not None and time.monotonic() > _JOB_DEADLINE)
+
+
+def _check_cancel() -> None:
+    if _JOB_CANCELLED:
+        raise HTTPException(status_code=499, detail="Analyse geannuleerd.")
+    if _JOB_DEADLINE is not None and time.monotonic() > _JOB_DEADLINE:
+        raise HTTPException(status_code=504, detail="Analyse duurde langer dan het tijdsbudget (timeout_s/STEP_JOB_TIMEOUT_S).")
+
+
+# ===== Voortgang voor wie meeleest (SSE, zie /jobs/{id}/events) =====
+# In een worker gaan events over de pipe naar de parent, maar alleen als die
+# erom vroeg; in het API-proces naar het event-log van de lopende job.
+_JOB_CONN: Optional[Connection] = None
+_PROGRESS: "contextvars.ContextVar[Optional[_EventLog]]" = contextvars.ContextVar("progress", default=None)
+
+
+def _progress(stage: str, **data) -> None:
+    if _JOB_CONN is not None:
+        _JOB_CONN.send(("progress", stage, data))
+        return
+    events = _PROGRESS.get()
+    if events is not None:
+        events.emit(stage, data)
+
+
+def _progress_count(stage: str, done: int, total: int) -> None:
+    """Event per procent, niet per stuk: een assembly kan duizenden solids hebben."""
+    if done == total or done * 100 // total != (done - 1) * 100 // total:
+        _progress(stage, done=done, total=total, percent=done * 100 // total)
+
+
+@app.middleware("http")
+async def _count_requests(request: Request, call_next):
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        path = getattr(route, "path", None) or "unmatched"
+        _METRICS.inc("step_analyzer_requests_total", endpoint=path, method=request.method, status=str(status))
+
+
+@app.get("/metrics")
+def metrics():
+    if _OCC is not None:
+        _METRICS.set("step_analyzer_backend_info", 1, flavor=_OCC["flavor"])
+    for event, value in _GEOMETRY_CACHE.stats.items():
+        _METRICS.set("step_analyzer_cache_events_total", value, event=event)
+    return PlainTextResponse(_METRICS.render(), media_type="text/plain; version=0.0.4")
+
+
 # ===== Dynamische OCC/OCP import =====
+# De symbolentabel wordt één keer per proces opgelost en daarna hergebruikt;
+# geforkte workers erven hem van de parent.
+_OCC: Optional[Dict[str, Any]] = None
+_BACKEND_TIMINGS: Dict[str, float] = {}
+
+
 def _need_occ() -> Dict[str, Any]:
+    global _OCC
+    if _OCC is None:
+        t0 = time.perf_counter()
+        _OCC = _resolve_occ()
+        _BACKEND_TIMINGS["resolve_s"] = round(time.perf_counter() - t0, 4)
+    return _OCC
+
+
+def _resolve_occ() -> Dict[str, Any]:
     """
     Probeer eerst OCP (nieuwe naam), val daarna automatisch terug op OCC.Core (pythonocc-core).
     Geeft een dict met de gebruikte symbolen terug.
@@ -52,16 +299,38 @@ def _need_occ() -> Dict[str, Any]:
     try:
         from OCP.STEPControl import STEPControl_Reader
         from OCP.IFSelect import IFSelect_RetDone
-        from OCP.Bnd import Bnd_Box
-        from OCP.BRepBndLib import BRepBndLib_Add
+        from OCP.Bnd import Bnd_Box, Bnd_OBB
+        from OCP.BRepBndLib import BRepBndLib
         from OCP.TopExp import TopExp_Explorer
-        from OCP.TopAbs import TopAbs_FACE, TopAbs_EDGE
-        from OCP.Message import Message_ProgressRange
+        from OCP.TopAbs import TopAbs_FACE, TopAbs_EDGE, TopAbs_SOLID
+        from OCP.TopoDS import TopoDS_Shape
+        from OCP.BinTools import BinTools
+        from OCP.Message import Message_ProgressRange, Message_ProgressIndicator
         from OCP.GProp import GProp_GProps
         from OCP.BRepGProp import BRepGProp
 
-        def VolumeProperties(shape, props):
-            return BRepGProp.VolumeProperties(shape, props)
+        # Statische methodes heten in OCP <naam>_s
+        _volume_properties = getattr(BRepGProp, "VolumeProperties_s", None) or BRepGProp.VolumeProperties
+
+        def VolumeProperties(shape, props, eps=None):
+            if eps is None:
+                return _volume_properties(shape, props)
+            return _volume_properties(shape, props, eps)
+
+        def BRepBndLib_Add(shape, box, use_triangulation=True):
+            return BRepBndLib.Add_s(shape, box, use_triangulation)
+
+        def BRepBndLib_AddOptimal(shape, box, use_triangulation, use_tolerance):
+            return BRepBndLib.AddOptimal_s(shape, box, use_triangulation, use_tolerance)
+
+        def BRepBndLib_AddOBB(shape, obb, use_triangulation, optimal, use_tolerance):
+            return BRepBndLib.AddOBB_s(shape, obb, use_triangulation, optimal, use_tolerance)
+
+        def BinTools_Write(shape, path):
+            return BinTools.Write_s(shape, path)
+
+        def BinTools_Read(shape, path):
+            return BinTools.Read_s(shape, path)
 
         return {
             "flavor": "OCP",
@@ -69,10 +338,18 @@ def _need_occ() -> Dict[str, Any]:
             "IFSelect_RetDone": IFSelect_RetDone,
             "Bnd_Box": Bnd_Box,
             "BRepBndLib_Add": BRepBndLib_Add,
+            "BRepBndLib_AddOptimal": BRepBndLib_AddOptimal,
+            "Bnd_OBB": Bnd_OBB,
+            "BRepBndLib_AddOBB": BRepBndLib_AddOBB,
             "TopExp_Explorer": TopExp_Explorer,
             "TopAbs_FACE": TopAbs_FACE,
             "TopAbs_EDGE": TopAbs_EDGE,
+            "TopAbs_SOLID": TopAbs_SOLID,
+            "TopoDS_Shape": TopoDS_Shape,
+            "BinTools_Write": BinTools_Write,
+            "BinTools_Read": BinTools_Read,
             "Message_ProgressRange": Message_ProgressRange,
+            "Message_ProgressIndicator": Message_ProgressIndicator,
             "GProp_GProps": GProp_GProps,
             "VolumeProperties": VolumeProperties,
         }
@@ -83,19 +360,35 @@ def _need_occ() -> Dict[str, Any]:
     try:
         from OCC.Core.STEPControl import STEPControl_Reader
         from OCC.Core.IFSelect import IFSelect_RetDone
-        from OCC.Core.Bnd import Bnd_Box
-        from OCC.Core.BRepBndLib import brepbndlib_Add
+        from OCC.Core.Bnd import Bnd_Box, Bnd_OBB
+        from OCC.Core.BRepBndLib import brepbndlib_Add, brepbndlib_AddOBB, brepbndlib_AddOptimal
         from OCC.Core.TopExp import TopExp_Explorer
-        from OCC.Core.TopAbs import TopAbs_FACE, TopAbs_EDGE
-        from OCC.Core.Message import Message_ProgressRange
+        from OCC.Core.TopAbs import TopAbs_FACE, TopAbs_EDGE, TopAbs_SOLID
+        from OCC.Core.TopoDS import TopoDS_Shape
+        from OCC.Core.BinTools import bintools_Read, bintools_Write
+        from OCC.Core.Message import Message_ProgressRange, Message_ProgressIndicator
         from OCC.Core.GProp import GProp_GProps
         from OCC.Core.BRepGProp import brepgprop_VolumeProperties
 
         def BRepBndLib_Add(shape, box, use_triangulation=True):
             return brepbndlib_Add(shape, box, use_triangulation)
 
-        def VolumeProperties(shape, props):
-            return brepgprop_VolumeProperties(shape, props)
+        def VolumeProperties(shape, props, eps=None):
+            if eps is None:
+                return brepgprop_VolumeProperties(shape, props)
+            return brepgprop_VolumeProperties(shape, props, eps)
+
+        def BRepBndLib_AddOptimal(shape, box, use_triangulation, use_tolerance):
+            return brepbndlib_AddOptimal(shape, box, use_triangulation, use_tolerance)
+
+        def BRepBndLib_AddOBB(shape, obb, use_triangulation, optimal, use_tolerance):
+            return brepbndlib_AddOBB(shape, obb, use_triangulation, optimal, use_tolerance)
+
+        def BinTools_Write(shape, path):
+            return bintools_Write(shape, path)
+
+        def BinTools_Read(shape, path):
+            return bintools_Read(shape, path)
 
         return {
             "flavor": "OCC",
@@ -103,10 +396,18 @@ def _need_occ() -> Dict[str, Any]:
             "IFSelect_RetDone": IFSelect_RetDone,
             "Bnd_Box": Bnd_Box,
             "BRepBndLib_Add": BRepBndLib_Add,
+            "BRepBndLib_AddOptimal": BRepBndLib_AddOptimal,
+            "Bnd_OBB": Bnd_OBB,
+            "BRepBndLib_AddOBB": BRepBndLib_AddOBB,
             "TopExp_Explorer": TopExp_Explorer,
             "TopAbs_FACE": TopAbs_FACE,
             "TopAbs_EDGE": TopAbs_EDGE,
+            "TopAbs_SOLID": TopAbs_SOLID,
+            "TopoDS_Shape": TopoDS_Shape,
+            "BinTools_Write": BinTools_Write,
+            "BinTools_Read": BinTools_Read,
             "Message_ProgressRange": Message_ProgressRange,
+            "Message_ProgressIndicator": Message_ProgressIndicator,
             "GProp_GProps": GProp_GProps,
             "VolumeProperties": VolumeProperties,
         }
@@ -121,82 +422,983 @@ def _need_occ() -> Dict[str, Any]:
         )
 
 
+# ===== Preflight: STEP-tekst scannen zonder OCCT =====
+# Eén streaming pass over de bytes: header (FILE_SCHEMA), eenheden, aantal
+# entiteiten per type en producten. Kost milliseconden per MB en vertelt of
+# een file überhaupt STEP is en hoe zwaar de OCCT-transfer gaat worden.
+_SCHEMAS = (
+    (b"AP242", "AP242"),
+    (b"AP203", "AP203"),
+    (b"CONFIG_CONTROL_DESIGN", "AP203"),
+    (b"AUTOMOTIVE_DESIGN", "AP214"),
+    (b"AP214", "AP214"),
+)
+_HEAVY_TYPES = (
+    "B_SPLINE_SURFACE_WITH_KNOTS",
+    "B_SPLINE_SURFACE",
+    "ADVANCED_FACE",
+    "MANIFOLD_SOLID_BREP",
+    "BREP_WITH_VOIDS",
+)
+_SI_PREFIX_TO_MM = {None: 1000.0, "KILO": 1e6, "CENTI": 10.0, "MILLI": 1.0, "MICRO": 1e-3, "NANO": 1e-6}
+_CONVERSION_TO_MM = {"INCH": 25.4, "FOOT": 304.8, "MILLIMETRE": 1.0, "CENTIMETRE": 10.0, "METRE": 1000.0}
+
+_ENTITY_RE = re.compile(rb"#(\d+)\s*=\s*([A-Z0-9_]*)\s*\(")
+_PRODUCT_RE = re.compile(rb"#\d+\s*=\s*PRODUCT\s*\(\s*'((?:[^']|'')*)'")
+_LENGTH_UNIT_RE = re.compile(rb"#\d+\s*=\s*\(([^;]*?LENGTH_UNIT[^;]*)\)\s*;")
+_SI_UNIT_RE = re.compile(rb"SI_UNIT\s*\(\s*(?:\.([A-Z]+)\.|\$)\s*,\s*\.([A-Z]+)\.")
+_CONVERSION_RE = re.compile(rb"CONVERSION_BASED_UNIT\s*\(\s*'([^']*)'")
+_RATIONAL_BSPLINE_RE = re.compile(rb"RATIONAL_B_SPLINE_SURFACE\s*\(")
+
+
+class _StepPreflight:
+    """Incrementele scanner: feed() met willekeurige chunks, daarna result()."""
+
+    def __init__(self):
+        self.bytes = 0
+        self._tail = b""
+        self._header = b""
+        self._in_data = False
+        self.types: "Counter[str]" = Counter()
+        self.complex_entities = 0
+        self.rational_bspline_surfaces = 0
+        self.products: List[str] = []
+        self.product_count = 0
+        self.length_units: List[Dict[str, Any]] = []
+
+    def feed(self, chunk: bytes) -> None:
+        self.bytes += len(chunk)
+        buf = self._tail + chunk
+        # Alleen complete statements verwerken; de rest wacht op de volgende chunk
+        cut = buf.rfind(b";") + 1
+        self._tail = buf[cut:]
+        block = buf[:cut]
+        if not block:
+            return
+        if not self._in_data:
+            idx = block.find(b"DATA;")
+            if idx < 0:
+                self._header = (self._header + block)[-65536:]
+                return
+            self._header = (self._header + block[:idx])[-65536:]
+            self._in_data = True
+            block = block[idx + 5:]
+        self._scan(block)
+
+    def _scan(self, block: bytes) -> None:
+        for _, name in _ENTITY_RE.findall(block):
+            if name:
+                self.types[name.decode("ascii")] += 1
+            else:
+                self.complex_entities += 1
+        self.rational_bspline_surfaces += len(_RATIONAL_BSPLINE_RE.findall(block))
+        if b"PRODUCT" in block:
+            for raw in _PRODUCT_RE.findall(block):
+                self.product_count += 1
+                if len(self.products) < 100:
+                    self.products.append(raw.replace(b"''", b"'").decode("utf-8", "replace"))
+        if b"LENGTH_UNIT" in block:
+            for body in _LENGTH_UNIT_RE.findall(block):
+                self.length_units.append(_parse_length_unit(body))
+
+    def result(self) -> Dict[str, Any]:
+        if self._tail.strip():
+            # Laatste statement zonder ';' (afgekapte file): toch meetellen
+            tail, self._tail = self._tail, b""
+            self._scan(tail)
+        header = self._header
+        schema_raw = re.search(rb"FILE_SCHEMA\s*\(\s*\(\s*'([^']*)'", header)
+        schema_name = schema_raw.group(1).decode("ascii", "replace") if schema_raw else None
+        ap = None
+        if schema_raw:
+            upper = schema_raw.group(1).upper()
+            ap = next((label for marker, label in _SCHEMAS if marker in upper), None)
+
+        entities = sum(self.types.values()) + self.complex_entities
+        heavy = {t: self.types.get(t, 0) for t in _HEAVY_TYPES}
+        heavy["RATIONAL_B_SPLINE_SURFACE"] = self.rational_bspline_surfaces
+        bspline = heavy["B_SPLINE_SURFACE_WITH_KNOTS"] + heavy["B_SPLINE_SURFACE"] + self.rational_bspline_surfaces
+        # Ruwe kostenmaat voor de OCCT-transfer: B-spline-vlakken domineren
+        cost_score = entities + 20 * bspline + 5 * heavy["ADVANCED_FACE"]
+        cost_class = "light" if cost_score < 50_000 else ("medium" if cost_score < 1_000_000 else "heavy")
+
+        problems, warnings = [], []
+        if not header.lstrip().startswith(b"ISO-10303-21"):
+            problems.append("Geen ISO-10303-21 header aan het begin van de file.")
+        if not self._in_data:
+            problems.append("Geen DATA-sectie gevonden.")
+        elif not entities:
+            problems.append("Geen entiteiten gevonden in de DATA-sectie.")
+        elif not (heavy["MANIFOLD_SOLID_BREP"] or heavy["BREP_WITH_VOIDS"] or heavy["ADVANCED_FACE"]):
+            warnings.append("Geen B-rep geometrie (solids/faces) gevonden.")
+
+        return {
+            "ok": not problems,
+            "problems": problems,
+            "warnings": warnings,
+            "bytes": self.bytes,
+            "schema": schema_name,
+            "application_protocol": ap,
+            "length_unit": self.length_units[0] if self.length_units else None,
+            "entities": entities,
+            "complex_entities": self.complex_entities,
+            "heavy_entities": heavy,
+            "top_entity_types": dict(self.types.most_common(15)),
+            "products": self.product_count,
+            "product_names": self.products,
+            "cost": {"score": cost_score, "class": cost_class},
+        }
+
+
+def _parse_length_unit(body: bytes) -> Dict[str, Any]:
+    conversion = _CONVERSION_RE.search(body)
+    if conversion:
+        name = conversion.group(1).decode("ascii", "replace").upper()
+        return {"name": name.lower(), "to_mm": _CONVERSION_TO_MM.get(name)}
+    si = _SI_UNIT_RE.search(body)
+    if si:
+        prefix = si.group(1).decode("ascii") if si.group(1) else None
+        name = (prefix or "").lower() + si.group(2).decode("ascii").lower()
+        return {"name": name, "to_mm": _SI_PREFIX_TO_MM.get(prefix)}
+    return {"name": None, "to_mm": None}
+
+
+# ===== Snelle bbox-schatting uit CARTESIAN_POINT-entiteiten =====
+# Voor de live quote-preview: geen OCCT, alleen de punten uit de STEP-tekst.
+# Als het kan beperken we ons tot punten die echt geometrie dragen (vertices en
+# B-spline-controlepunten) plus de extent van cirkels; plaatsingspunten van
+# assen en vlakken liggen vaak buiten het model en tellen dan niet mee.
+_FLOAT = rb"\s*([-+0-9.Ee]+)\s*"
+_NAME = rb"\s*'(?:[^']|'')*'\s*"
+_POINT3_RE = re.compile(rb"#(\d+)\s*=\s*CARTESIAN_POINT\s*\(" + _NAME + rb",\s*\(" + _FLOAT + b"," + _FLOAT + b"," + _FLOAT + rb"\)")
+_DIRECTION3_RE = re.compile(rb"#(\d+)\s*=\s*DIRECTION\s*\(" + _NAME + rb",\s*\(" + _FLOAT + b"," + _FLOAT + b"," + _FLOAT + rb"\)")
+_VERTEX_RE = re.compile(rb"VERTEX_POINT\s*\(" + _NAME + rb",\s*#(\d+)")
+_BSPLINE_RE = re.compile(rb"#\d+\s*=\s*\(?\s*B_SPLINE_(?:CURVE|SURFACE)[^;]*;")
+_PLACEMENT_RE = re.compile(rb"#(\d+)\s*=\s*AXIS2_PLACEMENT_3D\s*\(" + _NAME + rb",\s*#(\d+)\s*,\s*#(\d+)")
+_CIRCLE_RE = re.compile(rb"(?:CIRCLE|ELLIPSE)\s*\(" + _NAME + rb",\s*#(\d+)\s*," + _FLOAT + rb"[,)]")
+_REF_RE = re.compile(rb"#(\d+)")
+
+
+class _PointCollector:
+    """Incrementeel, net als _StepPreflight: feed() met chunks, daarna result(to_mm)."""
+
+    def __init__(self):
+        self._tail = b""
+        self._ids: List[Any] = []
+        self._xyz: List[Any] = []
+        self._referenced: List[int] = []
+        self._directions: Dict[int, Any] = {}
+        self._placements: Dict[int, Any] = {}
+        self._circles: List[Any] = []
+
+    def feed(self, chunk: bytes) -> None:
+        buf = self._tail + chunk
+        cut = buf.rfind(b";") + 1
+        self._tail = buf[cut:]
+        if cut:
+            self._scan(buf[:cut])
+
+    def _scan(self, block: bytes) -> None:
+        if b"CARTESIAN_POINT" in block:
+            found = _POINT3_RE.findall(block)
+            if found:
+                self._ids.append(np.array([int(f[0]) for f in found], dtype=np.int64))
+                coords = b",".join(b"%s,%s,%s" % f[1:] for f in found).decode("ascii")
+                self._xyz.append(np.fromstring(coords, dtype=np.float64, sep=",").reshape(-1, 3))
+        self._referenced.extend(int(i) for i in _VERTEX_RE.findall(block))
+        if b"B_SPLINE_" in block:
+            for statement in _BSPLINE_RE.findall(block):
+                self._referenced.extend(int(i) for i in _REF_RE.findall(statement))
+        if b"CIRCLE" in block or b"ELLIPSE" in block:
+            self._circles.extend((int(p), float(r)) for p, r in _CIRCLE_RE.findall(block))
+        for pid, loc, axis in _PLACEMENT_RE.findall(block):
+            self._placements[int(pid)] = (int(loc), int(axis))
+        for did, x, y, z in _DIRECTION3_RE.findall(block):
+            self._directions[int(did)] = (float(x), float(y), float(z))
+
+    def result(self, to_mm: Optional[float]) -> Optional[Dict[str, Any]]:
+        if self._tail.strip():
+            tail, self._tail = self._tail, b""
+            self._scan(tail)
+        if not self._ids:
+            return None
+        ids = np.concatenate(self._ids)
+        xyz = np.concatenate(self._xyz)
+
+        mins: List[Any] = []
+        maxs: List[Any] = []
+        mask = np.isin(ids, np.array(self._referenced, dtype=np.int64)) if self._referenced else None
+        restricted = mask is not None and bool(mask.any())
+        if restricted:
+            pts = xyz[mask]
+            mins.append(pts.min(axis=0))
+            maxs.append(pts.max(axis=0))
+
+            # Cirkels: extent per wereldas is r * sqrt(1 - n_k^2), n = normaal van het cirkelvlak
+            order = np.argsort(ids)
+            for placement, radius in self._circles:
+                loc_axis = self._placements.get(placement)
+                if loc_axis is None or loc_axis[1] not in self._directions:
+                    continue
+                pos = np.searchsorted(ids, loc_axis[0], sorter=order)
+                if pos >= len(ids) or ids[order[pos]] != loc_axis[0]:
+                    continue
+                n = np.array(self._directions[loc_axis[1]])
+                n = n / (np.linalg.norm(n) or 1.0)
+                extent = radius * np.sqrt(np.clip(1.0 - n * n, 0.0, 1.0))
+                center = xyz[order[pos]]
+                mins.append(center - extent)
+                maxs.append(center + extent)
+        else:
+            mins.append(xyz.min(axis=0))
+            maxs.append(xyz.max(axis=0))
+
+        size = np.max(maxs, axis=0) - np.min(mins, axis=0)
+        scale = to_mm if to_mm else 1.0
+        dims = sorted((float(d) * scale for d in size), reverse=True)
+        return {
+            "length_mm": round(dims[0], 3),
+            "width_mm": round(dims[1], 3),
+            "height_mm": round(dims[2], 3),
+            "points": int(len(ids)),
+            "points_used": int(mask.sum()) if restricted else int(len(ids)),
+            "restricted_to_geometry": restricted,
+            "unit_applied": bool(to_mm),
+        }
+
+
 # ===== STEP inlezen en OCCT-shape leveren =====
-def _read_step_shape(occ: Dict[str, Any], data: bytes):
+def _default_tmp_dir() -> str:
+    # tmpfs (/dev/shm) als die er is: de fallback-file raakt dan nooit de schijf
+    shm = "/dev/shm"
+    if os.path.isdir(shm) and os.access(shm, os.W_OK):
+        return shm
+    return tempfile.gettempdir()
+
+
+_TMP_DIR = os.getenv("STEP_TMP_DIR") or _default_tmp_dir()
+# Grote downloads/uploads spoolen naar schijf (niet tmpfs: dat telt als RAM)
+_SPOOL_DIR = os.getenv("STEP_SPOOL_DIR") or tempfile.gettempdir()
+_SPOOL_MEM_BYTES = int(os.getenv("STEP_SPOOL_MEM_BYTES", str(8 * 1024 * 1024)))
+_MAX_BYTES = int(os.getenv("STEP_MAX_BYTES", str(500 * 1024 * 1024)))
+_CHUNK_BYTES = 1024 * 1024
+
+# Per proces onthouden of de backend ReadStream met Python-bytes accepteert,
+# zodat we niet elke request opnieuw een TypeError hoeven te vangen.
+_READ_STREAM_OK: Optional[bool] = None
+
+
+def _read_step_stream(reader, data: bytes) -> Optional[int]:
+    """
+    Lees de STEP direct uit het geheugen via STEPControl_Reader.ReadStream.
+    Geeft de status terug, of None als de backend dat niet ondersteunt.
+    """
+    global _READ_STREAM_OK
+    if _READ_STREAM_OK is False or not hasattr(reader, "ReadStream"):
+        return None
+    try:
+        with _stage("read_file"):
+            # De binding wil een file-object (std::istream); BytesIO deelt de bytes, geen kopie
+            status = reader.ReadStream("upload.step", io.BytesIO(data))
+    except (TypeError, NotImplementedError):
+        _READ_STREAM_OK = False
+        return None
+    _READ_STREAM_OK = True
+    return status
+
+
+def _read_step_file(reader, data: bytes) -> int:
+    """Fallback: unieke tempfile per request, direct na ReadFile opgeruimd."""
+    fd, tmp = tempfile.mkstemp(prefix="step-", suffix=".step", dir=_TMP_DIR)
+    try:
+        with _stage("write_tmp"), os.fdopen(fd, "wb") as f:
+            f.write(data)
+        with _stage("read_file"):
+            return reader.ReadFile(tmp)
+    finally:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+
+
+class _Footprint:
+    """
+    Goedkope kenmerken voor de geheugenvoorspelling (zie _MemoryGovernor):
+    alleen bytes.count, dus op C-snelheid. Een treffer die precies op een
+    chunkgrens valt wordt gemist; dat maakt voor een schatting niet uit.
+    """
+
+    def __init__(self):
+        self.bytes = 0
+        self.statements = 0
+        self.bspline_surfaces = 0
+        self.faces = 0
+
+    def feed(self, chunk: bytes) -> None:
+        self.bytes += len(chunk)
+        self.statements += chunk.count(b";")
+        self.bspline_surfaces += chunk.count(b"B_SPLINE_SURFACE")
+        self.faces += chunk.count(b"ADVANCED_FACE")
+
+    def features(self) -> Dict[str, int]:
+        return {
+            "bytes": self.bytes,
+            "entities": self.statements,
+            "bspline_surfaces": self.bspline_surfaces,
+            "faces": self.faces,
+        }
+
+
+class _StepSpool:
+    """
+    Vangt een STEP in stukken op: tot spool_bytes in het geheugen, daarboven in
+    een tempfile op schijf. Onderweg worden grootte (met harde limiet), SHA-256
+    en de eerste bytes (voor header-sniffing) bijgehouden, zodat het piekgeheugen
+    vlak blijft, hoe groot de file ook is.
+    """
+
+    def __init__(self, max_bytes: int, spool_bytes: int, scanners: Sequence[Any] = (), keep: bool = True):
+        self.max_bytes = max_bytes
+        self.spool_bytes = spool_bytes
+        # Objecten met feed(chunk) die de bytes onderweg meelezen (preflight, punten)
+        self.scanners = tuple(scanners)
+        # keep=False: alleen tellen, hashen en scannen (preflight), niets bewaren
+        self.keep = keep
+        self.size = 0
+        self.head = b""
+        self.footprint = _Footprint()
+        # Herkomst als de STEP uit een archief kwam (zie _Ingest)
+        self.name: Optional[str] = None
+        self.compression: Optional[str] = None
+        self._hasher = hashlib.sha256()
+        self._buf: Optional[io.BytesIO] = io.BytesIO()
+        self._file = None
+        self.path: Optional[str] = None
+
+    def write(self, chunk: bytes) -> None:
+        if not chunk:
+            return
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Bestand is groter dan de limiet van {self.max_bytes} bytes.",
+            )
+        self._hasher.update(chunk)
+        self.footprint.feed(chunk)
+        for scanner in self.scanners:
+            scanner.feed(chunk)
+        if len(self.head) < 4096:
+            self.head += chunk[: 4096 - len(self.head)]
+        if not self.keep:
+            return
+        if self._buf is not None and self.size > self.spool_bytes:
+            # Rol over naar schijf
+            fd, self.path = tempfile.mkstemp(prefix="step-dl-", suffix=".step", dir=_SPOOL_DIR)
+            self._file = os.fdopen(fd, "wb")
+            self._file.write(self._buf.getbuffer())
+            self._buf = None
+        if self._buf is not None:
+            self._buf.write(chunk)
+        else:
+            self._file.write(chunk)
+
+    @property
+    def sha256(self) -> str:
+        return self._hasher.hexdigest()
+
+    def source(self) -> Union[bytes, str]:
+        """Bytes als alles in het geheugen past, anders het pad van de tempfile."""
+        if self._buf is not None:
+            return self._buf.getvalue()
+        self._file.flush()
+        return self.path
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.path:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+        self._buf = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ===== Gecomprimeerde input: gzip, STEPZ en zip =====
+# STEP-tekst comprimeert 5-10x; klanten mailen zips en CAD-pakketten schrijven
+# .stpz (gzip). Alles wordt onderweg uitgepakt, zodat de spool (en daarmee
+# SHA-256, groottelimiet en scanners) altijd de uitgepakte STEP-bytes ziet.
+_GZIP_MAGIC = b"\x1f\x8b"
+_ZIP_MAGIC = b"PK\x03\x04"
+_STEP_SUFFIXES = (".step", ".stp")
+_COMPRESSED_SUFFIXES = (".stpz", ".stepz", ".gz", ".zip")
+_ZIP_MAX_MEMBERS = int(os.getenv("STEP_ZIP_MAX_MEMBERS", "50"))
+# Uitgepakt samen, anders spoolt één zip tot _ZIP_MAX_MEMBERS x _MAX_BYTES naar schijf
+_ZIP_MAX_TOTAL_BYTES = int(os.getenv("STEP_ZIP_MAX_TOTAL_BYTES", str(_MAX_BYTES)))
+
+
+def _check_upload_name(filename: Optional[str]) -> None:
+    if not (filename or "").lower().endswith(_STEP_SUFFIXES + _COMPRESSED_SUFFIXES):
+        raise HTTPException(
+            status_code=400,
+            detail="Alleen .step/.stp bestanden zijn toegestaan (ook gecomprimeerd: .stpz, .gz, .zip).",
+        )
+
+
+class _Gunzip:
+    """Pakt gzip stroomsgewijs uit naar sink.write(), ook meerdere gzip-members achter elkaar."""
+
+    def __init__(self, sink):
+        self.sink = sink
+        self._z = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self._pending = False   # midden in een gzip-member
+        self._done = False      # alles na de laatste member wordt genegeerd
+
+    def write(self, chunk: bytes) -> None:
+        data = chunk
+        try:
+            while data and not self._done:
+                self._pending = True
+                # max_length begrenst wat één gecomprimeerde chunk in één keer oplevert
+                self.sink.write(self._z.decompress(data, _CHUNK_BYTES))
+                if self._z.eof:
+                    data = self._z.unused_data
+                    self._z = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                    self._pending = False
+                    if data and not data.startswith(_GZIP_MAGIC[:len(data)]):
+                        self._done = True  # padding/rommel achter de data, net als gzip zelf negeren
+                else:
+                    data = self._z.unconsumed_tail
+        except zlib.error as e:
+            raise HTTPException(status_code=400, detail=f"Ongeldige gzip-data: {e}")
+
+    def close(self) -> None:
+        if not self._pending:
+            return
+        try:
+            self.sink.write(self._z.flush())
+        except zlib.error as e:
+            raise HTTPException(status_code=400, detail=f"Ongeldige gzip-data: {e}")
+        if not self._z.eof:
+            raise HTTPException(status_code=400, detail="Gzip-data is afgekapt (onvolledige upload of download).")
+
+
+class _Ingest:
+    """
+    Neemt de ruwe bytes van een upload of download aan en kiest op de eerste
+    bytes de route: platte STEP gaat direct de spool in, gzip/STEPZ wordt
+    onderweg uitgepakt, en een zip wordt gecomprimeerd opgevangen (zipfile moet
+    kunnen seeken) en in finish() member voor member uitgepakt.
+    """
+
+    def __init__(self, scanners: Callable[[], Sequence[Any]] = tuple, keep: bool = True):
+        # Fabriek i.p.v. lijst: elke zip-member krijgt zijn eigen scanners
+        self._scanners = scanners
+        self._keep = keep
+        self.compression: Optional[str] = None
+        self.raw_bytes = 0
+        self._spool: Optional[_StepSpool] = None
+        self._sink = None
+
+    def write(self, chunk: bytes) -> None:
+        if not chunk:
+            return
+        if self._sink is None:
+            self._start(chunk)
+        self.raw_bytes += len(chunk)
+        self._sink.write(chunk)
+
+    def _start(self, first: bytes) -> None:
+        if first.startswith(_ZIP_MAGIC):
+            self.compression = "zip"
+            self._spool = self._sink = _StepSpool(_MAX_BYTES, _SPOOL_MEM_BYTES)
+            return
+        self._spool = _StepSpool(_MAX_BYTES, _SPOOL_MEM_BYTES, self._scanners(), keep=self._keep)
+        if first.startswith(_GZIP_MAGIC):
+            self.compression = self._spool.compression = "gzip"
+            self._sink = _Gunzip(self._spool)
+        else:
+            self._sink = self._spool
+
+    def finish(self) -> List[_StepSpool]:
+        """Eén spool, of bij een zip één per STEP-member."""
+        if self._sink is None:
+            return [_StepSpool(_MAX_BYTES, _SPOOL_MEM_BYTES, self._scanners(), keep=self._keep)]
+        if self.compression != "zip":
+            if self.compression == "gzip":
+                self._sink.close()
+            spool, self._spool = self._spool, None
+            return [spool]
+        try:
+            with _stage("unzip"):
+                return _unzip_members(self._spool, self._scanners, self._keep)
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+
+
+def _unzip_member(zf: zipfile.ZipFile, info: zipfile.ZipInfo, spool: _StepSpool) -> None:
+    sink = None
+    with zf.open(info) as f:
+        while True:
+            chunk = f.read(_CHUNK_BYTES)
+            if not chunk:
+                break
+            if sink is None:
+                # .stpz in een zip komt voor; dan ook die laag uitpakken
+                sink = _Gunzip(spool) if chunk.startswith(_GZIP_MAGIC) else spool
+            sink.write(chunk)
+    if isinstance(sink, _Gunzip):
+        sink.close()
+
+
+def _unzip_members(raw: _StepSpool, scanners: Callable[[], Sequence[Any]], keep: bool) -> List[_StepSpool]:
+    source = raw.source()
+    members: List[_StepSpool] = []
+    try:
+        with zipfile.ZipFile(io.BytesIO(source) if isinstance(source, bytes) else source) as zf:
+            infos = [
+                info for info in zf.infolist()
+                if not info.is_dir()
+                and not info.filename.startswith("__MACOSX/")
+                and info.filename.lower().endswith(_STEP_SUFFIXES + (".stpz", ".stepz"))
+            ]
+            if not infos:
+                raise HTTPException(status_code=400, detail="Zip bevat geen .step/.stp bestanden.")
+            if len(infos) > _ZIP_MAX_MEMBERS:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Te veel STEP-bestanden in de zip ({len(infos)} > {_ZIP_MAX_MEMBERS}).",
+                )
+            too_big = HTTPException(
+                status_code=413,
+                detail=f"Uitgepakte zip is groter dan de limiet van {_ZIP_MAX_TOTAL_BYTES} bytes.",
+            )
+            # Eerst de opgegeven groottes (goedkoop), daarna telt het echte uitpakken:
+            # de centrale directory kan liegen en een .stpz-member pakt verder uit
+            if sum(info.file_size for info in infos) > _ZIP_MAX_TOTAL_BYTES:
+                raise too_big
+            remaining = _ZIP_MAX_TOTAL_BYTES
+            for info in infos:
+                spool = _StepSpool(min(_MAX_BYTES, remaining), _SPOOL_MEM_BYTES, scanners(), keep=keep)
+                spool.name = info.filename
+                spool.compression = "zip"
+                members.append(spool)
+                try:
+                    _unzip_member(zf, info, spool)
+                except HTTPException as e:
+                    # De spool-limiet was hier het restant van het zip-totaal
+                    if e.status_code == 413 and spool.max_bytes < _MAX_BYTES:
+                        raise too_big
+                    raise
+                remaining -= spool.size
+    except (zipfile.BadZipFile, zlib.error) as e:
+        for spool in members:
+            spool.close()
+        raise HTTPException(status_code=400, detail=f"Ongeldig zip-bestand: {e}")
+    except (RuntimeError, NotImplementedError) as e:
+        # zipfile: versleutelde members en onbekende compressiemethodes
+        for spool in members:
+            spool.close()
+        raise HTTPException(status_code=400, detail=f"Zip-member kan niet uitgepakt worden: {e}")
+    except BaseException:
+        for spool in members:
+            spool.close()
+        raise
+    return members
+
+
+async def _finish_ingest(ingest: _Ingest, source: str) -> List[_StepSpool]:
+    # Uitpakken van een zip is CPU- en schijfwerk: niet op de event loop
+    if ingest.compression == "zip":
+        spools = await asyncio.to_thread(ingest.finish)
+    else:
+        spools = ingest.finish()
+    if ingest.compression:
+        _METRICS.inc("step_analyzer_compressed_bytes_total", ingest.raw_bytes, format=ingest.compression)
+    _METRICS.inc("step_analyzer_bytes_total", sum(s.size for s in spools), source=source)
+    return spools
+
+
+def _single_spool(spools: List[_StepSpool]) -> _StepSpool:
+    if len(spools) == 1:
+        return spools[0]
+    for spool in spools:
+        spool.close()
+    raise HTTPException(
+        status_code=400,
+        detail=f"Zip bevat {len(spools)} STEP-bestanden; dit endpoint verwerkt er één "
+               "(gebruik /analyze of /analyze-url voor archieven met meerdere bestanden).",
+    )
+
+
+def _describe_source(result: Dict[str, Any], spool: _StepSpool) -> Dict[str, Any]:
+    if spool.compression:
+        result["compression"] = spool.compression
+    if spool.compression == "zip":
+        result["member"] = spool.name
+    return result
+
+
+def _read_step_shape(occ: Dict[str, Any], data: Union[bytes, str]):
     STEPControl_Reader = occ["STEPControl_Reader"]
     IFSelect_RetDone = occ["IFSelect_RetDone"]
-    Message_ProgressRange = occ["Message_ProgressRange"]
-
-    tmp = "/tmp/upload.step"
-    with open(tmp, "wb") as f:
-        f.write(data)
 
     reader = STEPControl_Reader()
-    status = reader.ReadFile(tmp)
+    if isinstance(data, str):
+        # Al een bestand op schijf (grote download): direct lezen, geen kopie
+        with _stage("read_file"):
+            status = reader.ReadFile(data)
+    else:
+        status = _read_step_stream(reader, data)
+        if status is None:
+            status = _read_step_file(reader, data)
     if status != IFSelect_RetDone:
         raise HTTPException(status_code=400, detail="STEP lezen mislukte (status != RetDone).")
+    _progress("parsed", roots=int(reader.NbRootsForTransfer()))
 
     # Sommige OCCT builds vereisen een progress-range, andere niet
-    try:
-        reader.TransferRoots(Message_ProgressRange())
-    except TypeError:
-        reader.TransferRoots()
+    with _stage("transfer_roots"):
+        progress, indicator = _progress_range(occ)
+        try:
+            reader.TransferRoots(progress)
+        except TypeError:
+            reader.TransferRoots()
+    # Een UserBreak laat een half vertaalde shape achter: die niet meten of cachen
+    _check_cancel()
+    if indicator is None or indicator.percent != 100:
+        _progress("transfer", percent=100)
 
     return reader.OneShape()
 
 
-# ===== Shape -> maten/volume/gewicht =====
-def _analyze_shape(
-    occ: Dict[str, Any],
-    shape,
-    material: str,
-    density_override: Optional[float],
-) -> Dict[str, Any]:
-    # Bounding box
+# Per proces: None = nog niet geprobeerd, False = de binding kan
+# Message_ProgressIndicator niet in Python subclassen.
+_PROGRESS_CLASS: Optional[Any] = None
+
+
+def _progress_range(occ: Dict[str, Any]):
+    """
+    Range voor TransferRoots, plus de indicator die in leven moet blijven zolang
+    OCCT hem gebruikt. Kan de binding Message_ProgressIndicator subclassen, dan
+    meldt OCCT onderweg het percentage (Show) en vraagt hij via UserBreak of de
+    job moet stoppen; anders een kale range: dan alleen begin en eind van de
+    transfer, en wordt alleen tussen de stages gecontroleerd.
+    """
+    global _PROGRESS_CLASS
+    if _PROGRESS_CLASS is None:
+        try:
+            class _JobProgress(occ["Message_ProgressIndicator"]):
+                def __init__(self):
+                    super().__init__()
+                    self.percent = 0
+
+                def Show(self, scope, force):
+                    percent = int(self.GetPosition() * 100)
+                    if percent != self.percent:
+                        self.percent = percent
+                        _progress("transfer", percent=percent)
+
+                def UserBreak(self):
+                    return _should_stop()
+
+            _JobProgress()
+            _PROGRESS_CLASS = _JobProgress
+        except Exception:
+            _PROGRESS_CLASS = False
+    _progress("transfer", percent=0)
+    if _PROGRESS_CLASS is False:
+        return occ["Message_ProgressRange"](), None
+    indicator = _PROGRESS_CLASS()
+    return indicator.Start(), indicator
+
+
+# ===== Geometrie-opties (horen bij de cache-key) =====
+# obb: "off" | "fast" (punten uit geometrie/triangulatie, PCA-achtig, goedkoop)
+#      | "optimal" (OCCT zoekt de echt minimale box; duurder bij veel vlakken)
+# precision: "fast" | "standard" | "exact" (zie _PRECISION_TIERS)
+_GEOMETRY_CHOICES = {"obb": ("off", "fast", "optimal"), "precision": ("fast", "standard", "exact")}
+_GEOMETRY_DEFAULTS = {
+    "obb": os.getenv("STEP_OBB_DEFAULT", "fast"),
+    "precision": os.getenv("STEP_PRECISION_DEFAULT", "standard"),
+}
+
+# Per tier: bbox-methode en de Eps van de adaptieve volume-integratie.
+# Eps None = OCCT's standaard (niet-adaptieve) integratie, zonder foutschatting.
+_PRECISION_TIERS = {
+    "fast": {"bbox": "geometry", "eps": 1e-2},
+    "standard": {"bbox": "triangulation", "eps": None},
+    "exact": {"bbox": "optimal", "eps": 1e-6},
+}
+
+
+def _geometry_opts(**given: Optional[str]) -> Dict[str, str]:
+    opts = dict(_GEOMETRY_DEFAULTS)
+    for name, value in given.items():
+        if value is None:
+            continue
+        value = value.strip().lower()
+        if value not in _GEOMETRY_CHOICES[name]:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Ongeldige waarde voor {name}: {value!r} (kies uit {', '.join(_GEOMETRY_CHOICES[name])}).",
+            )
+        opts[name] = value
+    return opts
+
+
+# ===== Oriented bounding box (OBB) =====
+def _measure_obb(occ: Dict[str, Any], shape, optimal: bool) -> Optional[Dict[str, Any]]:
+    obb = occ["Bnd_OBB"]()
+    # fast: triangulatie (als die er is) of geometriepunten; optimal: exacte zoektocht
+    with _stage("obb"):
+        occ["BRepBndLib_AddOBB"](shape, obb, not optimal, optimal, False)
+    if obb.IsVoid():
+        return None
+
+    axes = [
+        (2.0 * obb.XHSize(), obb.XDirection()),
+        (2.0 * obb.YHSize(), obb.YDirection()),
+        (2.0 * obb.ZHSize(), obb.ZDirection()),
+    ]
+    # Zelfde conventie als de AABB: L ≥ B ≥ H
+    axes.sort(key=lambda a: a[0], reverse=True)
+    center = obb.Center()
+    return {
+        "dims_mm": [float(size) for size, _ in axes],
+        "axes": [[float(d.X()), float(d.Y()), float(d.Z())] for _, d in axes],
+        "center_mm": [float(center.X()), float(center.Y()), float(center.Z())],
+    }
+
+
+# ===== Shape -> maten/volume (materiaal-onafhankelijk, dus cachebaar) =====
+def _measure_bbox(occ: Dict[str, Any], shape, precision: str = "standard") -> List[float]:
     Bnd_Box = occ["Bnd_Box"]
-    BRepBndLib_Add = occ["BRepBndLib_Add"]
+    method = _PRECISION_TIERS[precision]["bbox"]
 
     box = Bnd_Box()
-    BRepBndLib_Add(shape, box, True)
-    xmin, ymin, zmin, xmax, ymax, zmax = box.Get()
+    with _stage("bbox"):
+        if method == "optimal":
+            occ["BRepBndLib_AddOptimal"](shape, box, False, False)
+        else:
+            occ["BRepBndLib_Add"](shape, box, method == "triangulation")
+    lo, hi = box.CornerMin(), box.CornerMax()
+    return [float(hi.X() - lo.X()), float(hi.Y() - lo.Y()), float(hi.Z() - lo.Z())]
 
-    dx = float(xmax - xmin)
-    dy = float(ymax - ymin)
-    dz = float(zmax - zmin)
 
-    # Sorteer afmetingen (L ≥ B ≥ H)
-    dims = sorted([dx, dy, dz], reverse=True)
-    L, B, H = dims[0], dims[1], dims[2]
-
-    # Volume via OCCT (Mass == volume bij dichtheid 1.0)
+def _measure_volume(occ: Dict[str, Any], shape, bbox: List[float], precision: str = "standard"):
+    """
+    Volume in m^3 via OCCT (Mass == volume bij dichtheid 1.0).
+    Geeft (volume, fallback?, relatieve tolerantie of None) terug. Die
+    tolerantie is een bovengrens: OCCT stopt zodra de integratie binnen Eps
+    zit en geeft dan meestal Eps zelf terug, niet de werkelijk behaalde fout.
+    """
     GProp_GProps = occ["GProp_GProps"]
     VolumeProperties = occ["VolumeProperties"]
-    volume_m3: float
-
+    eps = _PRECISION_TIERS[precision]["eps"]
     try:
         props = GProp_GProps()
-        VolumeProperties(shape, props)
+        with _stage("volume"):
+            error = VolumeProperties(shape, props, eps)
         volume_mm3 = float(props.Mass())
         if volume_mm3 <= 0:
             raise ValueError("Volume <= 0")
-        volume_m3 = volume_mm3 * 1e-9  # mm^3 -> m^3
+        rel_tolerance = abs(float(error)) if eps is not None and error is not None else None
+        return volume_mm3 * 1e-9, False, rel_tolerance  # mm^3 -> m^3
+    except HTTPException:
+        raise  # geannuleerd of tijdsbudget op: geen schatting
     except Exception:
         # Fallback: conservatieve schatting (80% van bbox-volume)
-        volume_m3 = (dx * dy * dz) * 1e-9 * 0.8
-
-    # Dichtheden (kg/m^3)
-    densities = {
-        "steel": 7850,
-        "stainless": 8000,
-        "aluminum": 2700,
-        "brass": 8500,
-        "copper": 8960,
-        "plastic": 1200,
+        _count("step_analyzer_volume_fallback_total")
+        dx, dy, dz = bbox
+        return (dx * dy * dz) * 1e-9 * 0.8, True, None
+
+
+def _measure_body(occ: Dict[str, Any], shape, precision: str = "standard") -> Dict[str, Any]:
+    bbox = _measure_bbox(occ, shape, precision)
+    volume_m3, fallback, rel_tolerance = _measure_volume(occ, shape, bbox, precision)
+    # Sorteer afmetingen (L ≥ B ≥ H)
+    return {
+        "dims_mm": sorted(bbox, reverse=True),
+        "volume_m3": volume_m3,
+        "volume_fallback": fallback,
+        "volume_rel_tolerance": rel_tolerance,
+    }
+
+
+def _solids_of(occ: Dict[str, Any], shape) -> List[Any]:
+    explorer = occ["TopExp_Explorer"](shape, occ["TopAbs_SOLID"])
+    solids = []
+    while explorer.More():
+        solids.append(explorer.Current())
+        explorer.Next()
+    return solids
+
+
+def _measure_envelope(occ: Dict[str, Any], shape, opts: Dict[str, str]) -> Dict[str, Any]:
+    """Alles wat over de shape als geheel gaat: AABB en (optioneel) OBB."""
+    geometry: Dict[str, Any] = {
+        "dims_mm": sorted(_measure_bbox(occ, shape, opts["precision"]), reverse=True),
+        "backend": occ["flavor"],
+        "precision": opts["precision"],
+    }
+    _progress("bbox", dims_mm=[round(d, 3) for d in geometry["dims_mm"]])
+    if opts["obb"] != "off":
+        geometry["obb"] = _measure_obb(occ, shape, optimal=opts["obb"] == "optimal")
+        if geometry["obb"] is not None:
+            geometry["obb"]["mode"] = opts["obb"]
+    return geometry
+
+
+def _sum_bodies(geometry: Dict[str, Any], bodies: List[Dict[str, Any]]) -> Dict[str, Any]:
+    geometry["bodies"] = bodies
+    geometry["solids"] = len(bodies)
+    geometry["volume_m3"] = sum(b["volume_m3"] for b in bodies)
+    geometry["volume_fallback"] = any(b["volume_fallback"] for b in bodies)
+    tolerances = [b["volume_rel_tolerance"] for b in bodies if b.get("volume_rel_tolerance") is not None]
+    geometry["volume_rel_tolerance"] = max(tolerances) if tolerances else None
+    return geometry
+
+
+def _measure_shape(occ: Dict[str, Any], shape, opts: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    opts = opts or _GEOMETRY_DEFAULTS
+    geometry = _measure_envelope(occ, shape, opts)
+
+    solids = _solids_of(occ, shape)
+    if solids:
+        bodies = []
+        for solid in solids:
+            bodies.append(_measure_body(occ, solid, opts["precision"]))
+            _progress_count("volume", len(bodies), len(solids))
+        return _sum_bodies(geometry, bodies)
+
+    # Geen solids (bijv. alleen surfaces): de hele shape als één geheel
+    volume_m3, fallback, rel_tolerance = _measure_volume(occ, shape, geometry["dims_mm"], opts["precision"])
+    _progress_count("volume", 1, 1)
+    geometry.update(
+        volume_m3=volume_m3,
+        volume_fallback=fallback,
+        volume_rel_tolerance=rel_tolerance,
+        solids=0,
+        bodies=[],
+    )
+    return geometry
+
+
+# ===== Materialen (dichtheden in kg/m^3) =====
+# Ingebouwde tabel, aan te vullen of te overschrijven met STEP_MATERIALS_FILE:
+# JSON {"naam": dichtheid} of {"naam": {"density_kg_m3": dichtheid}}.
+_DEFAULT_MATERIALS = {
+    "steel": 7850,
+    "stainless": 8000,
+    "aluminum": 2700,
+    "brass": 8500,
+    "copper": 8960,
+    "plastic": 1200,
+}
+_MATERIALS_FILE = os.getenv("STEP_MATERIALS_FILE")
+
+
+def _load_materials(path: Optional[str]) -> Dict[str, float]:
+    materials = {name: float(density) for name, density in _DEFAULT_MATERIALS.items()}
+    if not path:
+        return materials
+    with open(path) as f:
+        extra = json.load(f)
+    for name, value in extra.items():
+        density = float(value["density_kg_m3"] if isinstance(value, dict) else value)
+        if density <= 0:
+            raise ValueError(f"Dichtheid van {name!r} in {path} moet > 0 zijn.")
+        materials[name.strip().lower()] = density
+    return materials
+
+
+_MATERIALS = _load_materials(_MATERIALS_FILE)
+
+
+def _pricing(
+    material: Optional[str],
+    density_override: Optional[float],
+    materials: Union[str, Sequence[str], None] = None,
+    densities: Union[str, Sequence[float], None] = None,
+) -> Dict[str, Any]:
+    """
+    Materiaalkeuze van een request: het hoofdmateriaal (bepaalt weight_kg) plus
+    optioneel een lijst materialen/dichtheden waarvoor allemaal een gewicht
+    wordt berekend. Lijsten mogen als komma-gescheiden string (query/form).
+    """
+    if isinstance(materials, str):
+        materials = [m for m in materials.split(",") if m.strip()]
+    if isinstance(densities, str):
+        try:
+            densities = [float(d) for d in densities.split(",") if d.strip()]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="densities_kg_m3 moet een komma-gescheiden lijst getallen zijn.")
+
+    weights_for = []
+    for name in materials or ():
+        key = name.strip().lower()
+        if key not in _MATERIALS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Onbekend materiaal: {name!r} (zie GET /materials).",
+            )
+        weights_for.append({"material": key, "density_kg_m3": _MATERIALS[key]})
+    for density in densities or ():
+        if density <= 0:
+            raise HTTPException(status_code=400, detail="Dichtheden moeten > 0 zijn.")
+        weights_for.append({"material": None, "density_kg_m3": float(density)})
+    return {"material": material or "steel", "density_kg_m3": density_override, "weights_for": weights_for}
+
+
+def _weight_matrix(geometry: Dict[str, Any], weights_for: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+    """Gewichten voor alle gevraagde dichtheden; bij meerdere bodies als matrix bodies x materialen."""
+    densities = np.array([w["density_kg_m3"] for w in weights_for], dtype=np.float64)
+    out = {
+        "materials": [w["material"] for w in weights_for],
+        "density_kg_m3": densities.tolist(),
+        "weight_kg": np.round(geometry["volume_m3"] * densities, 4).tolist(),
     }
+    bodies = geometry.get("bodies") or []
+    if len(bodies) > 1:
+        volumes = np.array([b["volume_m3"] for b in bodies], dtype=np.float64)
+        out["bodies_weight_kg"] = np.round(np.outer(volumes, densities), 4).tolist()
+    return out
+
+
+@app.get("/materials")
+def list_materials():
+    return {"materials": _MATERIALS, "source": _MATERIALS_FILE or "builtin"}
+
+
+# ===== Geometrie + materiaal -> respons =====
+def _apply_material(
+    geometry: Dict[str, Any],
+    material: str,
+    density_override: Optional[float],
+    weights_for: Sequence[Dict[str, Any]] = (),
+) -> Dict[str, Any]:
+    L, B, H = geometry["dims_mm"]
+    volume_m3 = geometry["volume_m3"]
+
     if density_override and density_override > 0:
         density = float(density_override)
     else:
-        density = float(densities.get((material or "steel").lower(), 7850))
+        density = _MATERIALS.get((material or "steel").lower(), _MATERIALS["steel"])
 
     weight_kg = volume_m3 * density
 
@@ -204,76 +1406,1933 @@ def _analyze_shape(
     largest = max(L, B, H)
     classification = "tiny" if largest < 1 else ("small" if largest < 100 else "large")
 
-    return {
+    result = {
         "length_mm": round(L, 3),
         "width_mm": round(B, 3),
         "height_mm": round(H, 3),
         "volume_m3": round(volume_m3, 6),
         "weight_kg": round(weight_kg, 4),
-        "solids": 1,  # simplificatie
-        "backend": occ["flavor"],
+        "solids": geometry["solids"],
+        "backend": geometry["backend"],
         "derived": {"largest_dimension": float(round(largest, 3)), "classification": classification},
     }
+    rel_tolerance = geometry.get("volume_rel_tolerance")
+    result["precision"] = {
+        "tier": geometry.get("precision", "standard"),
+        "volume_rel_tolerance": rel_tolerance,
+        "volume_abs_tolerance_m3": round(rel_tolerance * volume_m3, 9) if rel_tolerance is not None else None,
+    }
+    bodies = geometry.get("bodies") or []
+    if len(bodies) > 1:
+        result["bodies"] = [
+            {
+                "index": i,
+                "length_mm": round(b["dims_mm"][0], 3),
+                "width_mm": round(b["dims_mm"][1], 3),
+                "height_mm": round(b["dims_mm"][2], 3),
+                "volume_m3": round(b["volume_m3"], 6),
+                "weight_kg": round(b["volume_m3"] * density, 4),
+            }
+            for i, b in enumerate(bodies)
+        ]
+    obb = geometry.get("obb")
+    if obb:
+        ol, ob, oh = obb["dims_mm"]
+        result["obb"] = {
+            "length_mm": round(ol, 3),
+            "width_mm": round(ob, 3),
+            "height_mm": round(oh, 3),
+            "axes": [[round(c, 6) for c in axis] for axis in obb["axes"]],
+            "center_mm": [round(c, 3) for c in obb["center_mm"]],
+            "mode": obb["mode"],
+        }
+    if weights_for:
+        result["weights"] = _weight_matrix(geometry, weights_for)
+    return result
 
 
-# ===== URL normalizer =====
-def _normalize_url(raw: str) -> str:
-    raw = (raw or "").strip()
-    # GitHub blob → raw
-    if raw.startswith("https://github.com/") and "/blob/" in raw:
-        raw = raw.replace("https://github.com/", "https://raw.githubusercontent.com/").replace("/blob/", "/")
-    # OneDrive: forceer download
-    if ("1drv.ms" in raw or "onedrive.live.com" in raw) and "download=1" not in raw:
-        sep = "&" if "?" in raw else "?"
-        raw = f"{raw}{sep}download=1"
-    # Encode pad en query; schema/host blijven
-    sp = urlsplit(raw)
-    safe_path  = quote(sp.path, safe="/%:@")
-    safe_query = quote_plus(sp.query, safe="=&:%@")
-    return urlunsplit((sp.scheme, sp.netloc, safe_path, safe_query, sp.fragment))
+# ===== Worker-pool: OCCT-werk buiten de event loop =====
+# Parsen en analyseren is CPU-gebonden en houdt de GIL vast; daarom draait het in
+# aparte processen, zodat /healthz en andere requests gewoon blijven antwoorden.
+# Eén worker per job, via een eigen pipe. Een segfault in OCCT kost alleen die
+# worker (en die job); de pool vervangt hem, net als workers die te veel jobs
+# gedraaid hebben of te groot zijn geworden.
+def _cgroup_cpu_count() -> int:
+    """Aantal CPU's dat de container echt mag gebruiken (cgroup v2, v1, affinity)."""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+        if quota != "max":
+            return max(1, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota_us = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period_us = int(f.read())
+        if quota_us > 0:
+            return max(1, math.ceil(quota_us / period_us))
+    except (OSError, ValueError):
+        pass
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
 
 
-# ====== Analyze via URL (JSON) ======
-@app.post("/analyze-url")
-def analyze_step_url(body: AnalyzeUrlRequest):
+def _cgroup_memory_limit() -> int:
+    """Geheugenlimiet van de container (cgroup v2, v1), anders het fysieke geheugen."""
+    physical = os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                raw = f.read().strip()
+        except OSError:
+            continue
+        if raw.isdigit() and int(raw) < physical:
+            return int(raw)
+    return physical
+
+
+_WORKERS = int(os.getenv("STEP_WORKERS", "0")) or _cgroup_cpu_count()
+# Vanaf dit aantal solids worden de volumes parallel over de workers berekend
+_SOLID_FANOUT_MIN = int(os.getenv("STEP_SOLID_FANOUT_MIN", "8"))
+# OCCT geeft geheugen slecht terug: workers worden na zoveel jobs of boven dit RSS vervangen
+_WORKER_MAX_JOBS = int(os.getenv("STEP_WORKER_MAX_JOBS", "200"))
+_WORKER_MAX_RSS_BYTES = int(os.getenv("STEP_WORKER_MAX_RSS_BYTES", str(2 * 1024 * 1024 * 1024)))
+# Grens op de adresruimte per worker: leeg = huidige VSZ + geheugenbudget, 0 = geen grens
+_WORKER_MAX_AS_BYTES = int(os.getenv("STEP_WORKER_MAX_AS_BYTES", "-1"))
+# Tijdsbudget per analyse in seconden (0 = geen); een request kan met timeout_s korter vragen
+_JOB_TIMEOUT_S = float(os.getenv("STEP_JOB_TIMEOUT_S", "600"))
+# Zo lang krijgt een afgebroken worker om zelf te stoppen; daarna wordt hij gekild en vervangen
+_CANCEL_GRACE_S = float(os.getenv("STEP_CANCEL_GRACE_S", "1"))
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def _rss_bytes(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _worker_init() -> None:
+    # OCCT is meestal al in de parent geïmporteerd (fork); anders hier alsnog.
+    try:
+        _need_occ()
+    except HTTPException as e:
+        log.warning("Worker %s: geen CAD-backend: %s", os.getpid(), e.detail)
+
+
+def _reset_peak_rss() -> int:
+    """Zet VmHWM terug op het huidige RSS (Linux clear_refs) en geeft dat RSS terug."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass  # dan meten we de piek sinds de start: hooguit te hoog
+    return _rss_bytes(os.getpid())
+
+
+def _peak_rss() -> int:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
+
+
+def _limit_address_space() -> None:
     """
-    Download een STEP vanaf body.file_url en analyseer deze.
+    Harde grens op de groei van deze worker: een allocatie daarboven faalt met
+    MemoryError/bad_alloc in plaats van dat de OOM-killer de container raakt.
     """
-    # 1) Download
+    if _WORKER_MAX_AS_BYTES == 0:
+        return
+    try:
+        with open("/proc/self/statm") as f:
+            vsz = int(f.read().split()[0]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return
+    cap = _WORKER_MAX_AS_BYTES if _WORKER_MAX_AS_BYTES > 0 else vsz + _MEMORY.capacity
+    if cap <= vsz:
+        log.warning("Worker %s: RLIMIT_AS %d ligt onder de huidige VSZ %d; geen grens gezet.", os.getpid(), cap, vsz)
+        return
     try:
-        headers = {
-            "User-Agent": "step-analyzer/1.0 (+https://step-analyzer.onrender.com)",
-            "Accept": "*/*",
+        resource.setrlimit(resource.RLIMIT_AS, (cap, cap))
+    except (ValueError, OSError) as e:
+        log.warning("Worker %s: RLIMIT_AS zetten mislukte: %s", os.getpid(), e)
+
+
+def _worker_main(conn: Connection) -> None:
+    """
+    Hoofdlus van een worker: (fn, args, deadline, progress) in, ("ok",
+    resultaat, stats) of ("error", status, detail) uit; met progress=True gaan
+    daarvóór ("progress", stage, data)-berichten over dezelfde pipe.
+    """
+    global _JOB_DEADLINE, _JOB_CANCELLED, _JOB_CONN
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C is voor de parent
+    signal.signal(signal.SIGUSR1, _on_cancel_signal)
+    _worker_init()
+    _limit_address_space()
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, OSError):
+            break
+        if msg is None:
+            break
+        fn, args, _JOB_DEADLINE, progress = msg
+        _JOB_CANCELLED = False
+        _JOB_CONN = conn if progress else None
+        try:
+            base = _reset_peak_rss()
+            result, stats = _collected(fn, *args)
+            stats["peak_rss_bytes"] = max(0, _peak_rss() - base)
+            reply = ("ok", result, stats)
+        except HTTPException as e:
+            reply = ("error", e.status_code, e.detail)
+        except MemoryError:
+            reply = ("error", 413, "Analyse had meer geheugen nodig dan een worker mag gebruiken.")
+        except Exception as e:
+            reply = ("error", 500, f"Analyseren faalde: {type(e).__name__}: {e}")
+        _JOB_DEADLINE = _JOB_CONN = None
+        try:
+            conn.send(reply)
+        except OSError:
+            break  # parent is weg
+        except Exception as e:
+            conn.send(("error", 500, f"Resultaat niet over te dragen: {type(e).__name__}: {e}"))
+    os._exit(0)
+
+
+def _zygote_main(conn: Connection) -> None:
+    """
+    Draait in een proces dat direct na de OCCT-import en warm-up uit de API is
+    geforkt en op verzoek workers forkt. Die erven zo de opgewarmde toestand,
+    en de API (met threads en een draaiende event loop) hoeft zelf niet te forken.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)  # gestopte workers automatisch opruimen
+    while True:
+        try:
+            fd = reduction.recv_handle(conn)
+        except (EOFError, OSError):
+            break
+        pid = os.fork()
+        if pid == 0:
+            try:
+                conn.close()
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                _worker_main(Connection(fd))
+            finally:
+                os._exit(1)
+        os.close(fd)
+        conn.send(pid)
+    os._exit(0)
+
+
+class _Worker:
+    def __init__(self, pid: int, conn: Connection):
+        self.pid = pid
+        self.conn = conn
+        self.jobs = 0
+
+    async def call(self, fn, args, deadline: Optional[float], on_progress: Optional[Callable] = None):
+        self.conn.send((fn, args, deadline, on_progress is not None))
+        return await self.reply(on_progress)
+
+    async def reply(self, on_progress: Optional[Callable] = None):
+        """Het antwoord op de lopende job; progress-berichten gaan onderweg naar on_progress."""
+        while True:
+            msg = await self._recv()
+            if msg[0] != "progress":
+                return msg
+            if on_progress is not None:
+                on_progress(msg[1], msg[2])
+
+    async def _recv(self):
+        loop = asyncio.get_running_loop()
+        fd = self.conn.fileno()
+        while not self.conn.poll():
+            ready = loop.create_future()
+            loop.add_reader(fd, lambda: ready.done() or ready.set_result(None))
+            try:
+                await ready
+            finally:
+                loop.remove_reader(fd)
+        return self.conn.recv()  # EOFError als de worker gestorven is
+
+    def stop(self, kill: bool) -> None:
+        if kill:
+            try:
+                os.kill(self.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        else:
+            try:
+                self.conn.send(None)
+            except OSError:
+                pass
+        self.conn.close()
+
+
+class _WorkerPool:
+    def __init__(self, size: int):
+        self.size = size
+        self._idle: "asyncio.Queue[_Worker]" = asyncio.Queue()
+        self._workers: Dict[int, _Worker] = {}
+        self._zygote: Optional[Any] = None  # (pid, conn)
+        self._draining: set = set()  # tasks die op afgebroken workers wachten
+
+    def start(self) -> None:
+        self._start_zygote()
+        for _ in range(self.size):
+            self._idle.put_nowait(self._spawn())
+
+    def _start_zygote(self) -> None:
+        if self._zygote is not None:
+            pid, conn = self._zygote
+            conn.close()
+            try:
+                os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                pass
+        ours, theirs = multiprocessing.Pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                ours.close()
+                _zygote_main(theirs)
+            finally:
+                os._exit(1)
+        theirs.close()
+        self._zygote = (pid, ours)
+
+    def _spawn(self) -> _Worker:
+        ours, theirs = multiprocessing.Pipe()
+        try:
+            try:
+                zpid, zconn = self._zygote
+                reduction.send_handle(zconn, theirs.fileno(), zpid)
+                pid = zconn.recv()
+            except (EOFError, OSError):
+                log.error("Zygote-proces is weg; wordt opnieuw gestart.")
+                self._start_zygote()
+                zpid, zconn = self._zygote
+                reduction.send_handle(zconn, theirs.fileno(), zpid)
+                pid = zconn.recv()
+        finally:
+            theirs.close()
+        worker = self._workers[pid] = _Worker(pid, ours)
+        return worker
+
+    def _replace(self, worker: _Worker, reason: str) -> None:
+        kill = reason in ("crash", "cancelled", "timeout")
+        worker.stop(kill=kill)
+        if kill:
+            # Een gekilde worker ruimt zijn shape-*.tmp niet meer op; die van eerdere kills zijn nu oud genoeg
+            _sweep_shape_tmp()
+        self._workers.pop(worker.pid, None)
+        _METRICS.inc("step_analyzer_worker_restarts_total", reason=reason)
+        try:
+            self._idle.put_nowait(self._spawn())
+        except Exception:
+            log.exception("Nieuwe worker starten mislukte; de pool heeft nu een worker minder.")
+
+    async def run(self, fn, *args, deadline: Optional[float] = None, on_progress: Optional[Callable] = None):
+        """
+        Voert fn(*args) uit in een vrije worker. Na de deadline (time.monotonic)
+        breekt de worker de job zelf af met een 504; lukt dat niet binnen
+        STEP_CANCEL_GRACE_S, dan wordt hij gekild. on_progress(stage, data)
+        krijgt de voortgangsevents van de job.
+        """
+        worker = await self._idle.get()
+        hard_timeout = None if deadline is None else max(0.0, deadline - time.monotonic()) + _CANCEL_GRACE_S
+        try:
+            reply = await asyncio.wait_for(worker.call(fn, args, deadline, on_progress), hard_timeout)
+        except asyncio.TimeoutError:
+            # Vast in een OCCT-aanroep zonder controlepunt: de worker moet eraan geloven
+            log.warning("Worker %d reageert niet op de deadline van %s; wordt gekild.", worker.pid, fn.__name__)
+            self._replace(worker, "timeout")
+            reply = ("error", 504, "Analyse duurde langer dan het tijdsbudget (timeout_s/STEP_JOB_TIMEOUT_S).")
+        except (EOFError, OSError):
+            log.error("Worker %d gestorven tijdens %s; wordt vervangen.", worker.pid, fn.__name__)
+            self._replace(worker, "crash")
+            raise HTTPException(
+                status_code=500,
+                detail="Analyse-worker is onverwacht gestopt (crash in de CAD-kernel?); probeer een ander bestand of exporteer opnieuw.",
+            )
+        except asyncio.CancelledError:
+            # De aanvrager is weg (client, batch of shutdown): afbreken en de worker terugwinnen
+            _METRICS.inc("step_analyzer_cancelled_total", reason="client")
+            self._abandon(worker)
+            raise
+        except BaseException:
+            self._replace(worker, "cancelled")
+            raise
+        else:
+            self._release(worker)
+
+        if reply[0] == "error":
+            if reply[1] == 504:
+                _METRICS.inc("step_analyzer_cancelled_total", reason="timeout")
+            raise HTTPException(status_code=reply[1], detail=reply[2])
+        return reply[1], reply[2]
+
+    def _release(self, worker: _Worker) -> None:
+        worker.jobs += 1
+        if worker.jobs >= _WORKER_MAX_JOBS:
+            self._replace(worker, "jobs")
+        elif _WORKER_MAX_RSS_BYTES and _rss_bytes(worker.pid) > _WORKER_MAX_RSS_BYTES:
+            self._replace(worker, "rss")
+        else:
+            self._idle.put_nowait(worker)
+
+    def _abandon(self, worker: _Worker) -> None:
+        """
+        Laat de worker zijn job afbreken (SIGUSR1, zie _check_cancel). Zijn
+        antwoord moet nog gelezen worden, anders komt het bij de volgende job
+        terecht: dat gebeurt op de achtergrond, zodat de aanvrager niet wacht.
+        """
+        if _CANCEL_GRACE_S <= 0:
+            self._replace(worker, "cancelled")
+            return
+        try:
+            os.kill(worker.pid, signal.SIGUSR1)
+        except ProcessLookupError:
+            pass
+        task = asyncio.get_running_loop().create_task(self._drain(worker))
+        self._draining.add(task)
+        task.add_done_callback(self._draining.discard)
+
+    async def _drain(self, worker: _Worker) -> None:
+        try:
+            reply = await asyncio.wait_for(worker.reply(), _CANCEL_GRACE_S)
+        except (asyncio.TimeoutError, EOFError, OSError):
+            self._replace(worker, "cancelled")
+        else:
+            if reply[0] == "ok":
+                # Toch nog afgemaakt: de tmp-bestanden in het resultaat haalt niemand meer op
+                _discard_job_files(reply[1])
+            self._release(worker)
+
+    def shutdown(self) -> None:
+        for task in list(self._draining):
+            task.cancel()
+        for worker in list(self._workers.values()):
+            worker.stop(kill=True)
+        self._workers.clear()
+        if self._zygote is not None:
+            pid, conn = self._zygote
+            conn.close()
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+            self._zygote = None
+
+
+_POOL: Optional[_WorkerPool] = None
+
+# Tijdsbudget (seconden) van de lopende request en de deadline van de analyse
+# die eruit volgt; _run_in_pool geeft die mee aan de worker.
+_TIME_BUDGET: "contextvars.ContextVar[Optional[float]]" = contextvars.ContextVar(
+    "time_budget", default=_JOB_TIMEOUT_S or None
+)
+_DEADLINE: "contextvars.ContextVar[Optional[float]]" = contextvars.ContextVar("deadline", default=None)
+
+
+def _set_time_budget(timeout_s: Optional[float]) -> None:
+    """Korter budget voor deze request; STEP_JOB_TIMEOUT_S blijft het maximum."""
+    if timeout_s is None:
+        return
+    if timeout_s <= 0:
+        raise HTTPException(status_code=400, detail="timeout_s moet groter dan 0 zijn.")
+    _TIME_BUDGET.set(min(timeout_s, _JOB_TIMEOUT_S) if _JOB_TIMEOUT_S else timeout_s)
+
+
+def _brep_tmp() -> str:
+    fd, path = tempfile.mkstemp(prefix="shape-", suffix=".tmp", dir=_SHAPE_CACHE.directory)
+    os.close(fd)
+    return path
+
+
+def _load_shape(occ: Dict[str, Any], data: Union[bytes, str], sha: str):
+    """
+    Geeft (shape, brep_tmp) terug. Staat de shape al in de BRep-cache, dan wordt
+    hij daaruit gelezen en is brep_tmp None. Anders wordt de STEP vertaald en de
+    shape naar brep_tmp geschreven; de parent neemt dat bestand op in de cache.
+    """
+    if not _SHAPE_CACHE.max_bytes:
+        return _read_step_shape(occ, data), None
+
+    cached = _SHAPE_CACHE.path(sha)
+    if os.path.exists(cached):
+        shape = occ["TopoDS_Shape"]()
+        try:
+            with _stage("shape_cache_read"):
+                ok = occ["BinTools_Read"](shape, cached)
+        except Exception:
+            ok = False
+        if ok is not False and not shape.IsNull():
+            _count("step_analyzer_shape_cache_hits_total")
+            _progress("transfer", percent=100, cached=True)
+            try:
+                os.utime(cached)  # markeer als recent gebruikt
+            except OSError:
+                pass
+            return shape, None
+
+    _count("step_analyzer_shape_cache_misses_total")
+    shape = _read_step_shape(occ, data)
+    path = _brep_tmp()
+    try:
+        with _stage("shape_cache_write"):
+            occ["BinTools_Write"](shape, path)
+    except Exception as e:
+        log.warning("Shape naar de BRep-cache schrijven mislukte: %s: %s", type(e).__name__, e)
+        os.unlink(path)
+        path = None
+    return shape, path
+
+
+def _geometry_job(data: Union[bytes, str], opts: Dict[str, str], sha: str) -> Dict[str, Any]:
+    """
+    Draait in een worker: shape laden (BRep-cache of STEP) en meten. Bij veel
+    solids wordt alleen de omhullende gemeten en verdeelt de parent de solids
+    over alle workers (zie _fan_out_solids); die lezen de binaire BRep.
+    """
+    occ = _need_occ()
+    shape, brep = _load_shape(occ, data, sha)
+    owned = None
+    try:
+        solids = _solids_of(occ, shape)
+        if len(solids) < _SOLID_FANOUT_MIN or _WORKERS < 2:
+            geometry = _measure_shape(occ, shape, opts)
+        else:
+            geometry = _measure_envelope(occ, shape, opts)
+            if brep is not None:
+                geometry["_fanout"] = {"path": brep, "count": len(solids), "owned": False}
+            else:
+                # Shape kwam uit de cache: eigen kopie, die kan niet tussentijds ge-evict worden
+                owned = _brep_tmp()
+                occ["BinTools_Write"](shape, owned)
+                geometry["_fanout"] = {"path": owned, "count": len(solids), "owned": True}
+    except BaseException:
+        # Ook bij annuleren of tijdsbudget op: de parent krijgt de paden nooit te zien
+        for path in (brep, owned):
+            if path is not None:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+        raise
+    if brep is not None:
+        geometry["_brep"] = brep
+    return geometry
+
+
+def _discard_job_files(result: Any) -> None:
+    """Verwijdert de BRep-bestanden uit een _geometry_job-resultaat dat niet gebruikt wordt."""
+    if not isinstance(result, dict):
+        return
+    fanout = result.get("_fanout") or {}
+    for path in (result.get("_brep"), fanout.get("path") if fanout.get("owned") else None):
+        if path is not None:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+
+def _solids_job(path: str, indices: List[int], precision: str) -> List[Dict[str, Any]]:
+    """Draait in een worker: meet een deel van de solids uit een BRep-bestand."""
+    occ = _need_occ()
+    shape = occ["TopoDS_Shape"]()
+    occ["BinTools_Read"](shape, path)
+    solids = _solids_of(occ, shape)
+    return [_measure_body(occ, solids[i], precision) for i in indices]
+
+
+async def _fan_out_solids(geometry: Dict[str, Any], per_worker: int) -> Dict[str, Any]:
+    """
+    Verdeelt de solids over de workers. Elke worker laadt de hele shape, dus
+    per gelijktijdige job wordt per_worker (de voorspelde piek van één
+    analyse) gereserveerd; past dat niet voor alle workers, dan draaien er
+    minder tegelijk.
+    """
+    fanout = geometry.pop("_fanout")
+    count = fanout["count"]
+    parallel = min(_WORKERS, count, max(1, _MEMORY.capacity // per_worker))
+    per_job = max(1, math.ceil(count / parallel))
+    done = 0
+
+    async def part(indices: List[int]) -> List[Dict[str, Any]]:
+        nonlocal done
+        bodies = await _run_in_pool(_solids_job, fanout["path"], indices, geometry["precision"])
+        done += len(indices)
+        _progress("volume", done=done, total=count, percent=done * 100 // count)
+        return bodies
+
+    try:
+        async with _MEMORY.admit(per_worker * parallel, learn=False):
+            with _stage("solids_fanout"):
+                parts = await asyncio.gather(*(
+                    part(list(range(start, min(count, start + per_job))))
+                    for start in range(0, count, per_job)
+                ))
+    finally:
+        if fanout["owned"]:
+            try:
+                os.unlink(fanout["path"])
+            except FileNotFoundError:
+                pass
+    return _sum_bodies(geometry, [body for part in parts for body in part])
+
+
+def _pool() -> _WorkerPool:
+    global _POOL
+    if _POOL is None:
+        _POOL = _WorkerPool(_WORKERS)
+        _POOL.start()
+    return _POOL
+
+
+async def _run_in_pool(fn, *args):
+    events = _PROGRESS.get()
+    result, stats = await _pool().run(
+        fn, *args, deadline=_DEADLINE.get(), on_progress=events.emit if events is not None else None
+    )
+    _record_job_stats(stats)
+    reservation = _RESERVATION.get()
+    if reservation is not None:
+        reservation.observe(stats.get("peak_rss_bytes", 0))
+    return result
+
+
+# ===== Geheugenbudget: jobs toelaten op hun voorspelde piek =====
+# TransferRoots op dichte B-spline-files is de grootste oorzaak van OOM-kills.
+# Per job wordt de piek (bovenop het RSS van een lege worker) voorspeld uit
+# goedkope kenmerken van de input; jobs starten alleen zolang de som van de
+# voorspellingen binnen het budget past. De factoren worden bijgesteld met de
+# gemeten pieken (VmHWM van de worker).
+_MEM_LIMIT_BYTES = int(os.getenv("STEP_MEM_LIMIT_BYTES", "0")) or _cgroup_memory_limit()
+_MEM_FRACTION = float(os.getenv("STEP_MEM_FRACTION", "0.8"))
+# Voor het API-proces en de lege workers: vast opgegeven, of een deel van de
+# limiet (hooguit 512 MB), zodat een kleine instance niet op een negatief budget uitkomt
+_MEM_RESERVED_FRACTION = float(os.getenv("STEP_MEM_RESERVED_FRACTION", "0.25"))
+_MEM_RESERVED_BYTES = int(os.getenv("STEP_MEM_RESERVED_BYTES", "0")) or min(
+    512 * 1024 * 1024, int(_MEM_LIMIT_BYTES * _MEM_RESERVED_FRACTION)
+)
+_MEM_QUEUE_TIMEOUT_S = float(os.getenv("STEP_MEM_QUEUE_TIMEOUT_S", "120"))
+_MEM_PER_BYTE = float(os.getenv("STEP_MEM_PER_BYTE", "6"))
+_MEM_PER_ENTITY = float(os.getenv("STEP_MEM_PER_ENTITY", "600"))
+_MEM_PER_BSPLINE = float(os.getenv("STEP_MEM_PER_BSPLINE", str(32 * 1024)))
+_MEM_FLOOR_BYTES = 32 * 1024 * 1024
+
+
+class _Reservation:
+    def __init__(self, predicted: int, learn: bool = True):
+        self.predicted = predicted
+        # Alleen reserveringen voor één STEP-vertaling stellen de voorspelling bij
+        self.learn = learn
+        self.peak = 0
+
+    def observe(self, peak: int) -> None:
+        self.peak = max(self.peak, peak)
+
+
+_RESERVATION: "contextvars.ContextVar[Optional[_Reservation]]" = contextvars.ContextVar("reservation", default=None)
+
+
+class _MemoryGovernor:
+    def __init__(self, capacity: int):
+        self.capacity = max(capacity, _MEM_FLOOR_BYTES)
+        self.reserved = 0
+        self.calibration = 1.0
+        self._cond = asyncio.Condition()
+
+    def predict(self, features: Dict[str, int]) -> int:
+        raw = (
+            _MEM_PER_BYTE * features["bytes"]
+            + _MEM_PER_ENTITY * features["entities"]
+            + _MEM_PER_BSPLINE * features["bspline_surfaces"]
+        )
+        return int(max(_MEM_FLOOR_BYTES, raw * self.calibration))
+
+    def _learn(self, reservation: _Reservation) -> None:
+        if not reservation.learn or not reservation.peak or not reservation.predicted:
+            return
+        ratio = reservation.peak * self.calibration / reservation.predicted
+        ratio = min(4.0, max(0.25, ratio))
+        # Snel omhoog (veiligheid), langzaam omlaag
+        self.calibration = ratio if ratio > self.calibration else 0.9 * self.calibration + 0.1 * ratio
+        _METRICS.set("step_analyzer_memory_calibration", self.calibration)
+
+    @asynccontextmanager
+    async def admit(self, predicted: int, learn: bool = True):
+        if predicted > self.capacity:
+            _METRICS.inc("step_analyzer_memory_rejected_total", reason="too_large")
+            raise HTTPException(
+                status_code=413,
+                detail=f"Deze STEP vraagt naar schatting {predicted / 2**20:.0f} MB geheugen; "
+                       f"het budget is {self.capacity / 2**20:.0f} MB.",
+            )
+        async with self._cond:
+            try:
+                await asyncio.wait_for(
+                    self._cond.wait_for(lambda: self.reserved + predicted <= self.capacity),
+                    _MEM_QUEUE_TIMEOUT_S,
+                )
+            except asyncio.TimeoutError:
+                _METRICS.inc("step_analyzer_memory_rejected_total", reason="timeout")
+                raise HTTPException(
+                    status_code=503,
+                    detail="Te veel grote analyses tegelijk; probeer het later opnieuw.",
+                    headers={"Retry-After": "30"},
+                )
+            self.reserved += predicted
+            _METRICS.set("step_analyzer_memory_reserved_bytes", self.reserved)
+        reservation = _Reservation(predicted, learn)
+        token = _RESERVATION.set(reservation)
+        try:
+            yield reservation
+        finally:
+            _RESERVATION.reset(token)
+            self._learn(reservation)
+            async with self._cond:
+                self.reserved -= predicted
+                _METRICS.set("step_analyzer_memory_reserved_bytes", self.reserved)
+                self._cond.notify_all()
+
+
+_MEM_BUDGET_BYTES = int(_MEM_LIMIT_BYTES * _MEM_FRACTION) - _MEM_RESERVED_BYTES
+if _MEM_BUDGET_BYTES < _MEM_FLOOR_BYTES:
+    log.error(
+        "Geheugenbudget voor analyses is %.0f MB (limiet %.0f MB × %.2f − %.0f MB gereserveerd); er wordt met "
+        "het minimum van %.0f MB gewerkt, ook voor RLIMIT_AS van de workers. Zet STEP_MEM_FRACTION, "
+        "STEP_MEM_RESERVED_BYTES of STEP_MEM_RESERVED_FRACTION passend bij deze instance.",
+        _MEM_BUDGET_BYTES / 2**20, _MEM_LIMIT_BYTES / 2**20, _MEM_FRACTION, _MEM_RESERVED_BYTES / 2**20,
+        _MEM_FLOOR_BYTES / 2**20,
+    )
+_MEMORY = _MemoryGovernor(_MEM_BUDGET_BYTES)
+_METRICS.set("step_analyzer_memory_capacity_bytes", _MEMORY.capacity)
+
+
+def _memory_estimate(spool: _StepSpool) -> Dict[str, Any]:
+    predicted = _MEMORY.predict(spool.footprint.features())
+    return {"predicted_peak_bytes": predicted, "budget_bytes": _MEMORY.capacity, "fits": predicted <= _MEMORY.capacity}
+
+
+# ===== Warm-up: OCCT's lazy initialisatie betalen vóór de eerste klant =====
+# Een kubus van 10 mm (AP214). Wordt in de parent geparsed vóórdat de workers
+# forken, zodat die de opgewarmde toestand meteen erven.
+_WARMUP = os.getenv("STEP_WARMUP", "1") not in ("0", "false", "no")
+_WARMUP_STEP = (
+    b"ISO-10303-21;\n"
+    b"HEADER;\n"
+    b"FILE_DESCRIPTION(('step-analyzer warm-up cube'),'2;1');\n"
+    b"FILE_NAME('warmup.step','2024-01-01T00:00:00',(''),(''),'','','');\n"
+    b"FILE_SCHEMA(('AUTOMOTIVE_DESIGN { 1 0 10303 214 1 1 1 1 }'));\n"
+    b"ENDSEC;\n"
+    b"DATA;\n"
+    b"#1=CARTESIAN_POINT('',(0.,0.,0.));\n"
+    b"#2=CARTESIAN_POINT('',(10.,0.,0.));\n"
+    b"#3=CARTESIAN_POINT('',(10.,10.,0.));\n"
+    b"#4=CARTESIAN_POINT('',(0.,10.,0.));\n"
+    b"#5=CARTESIAN_POINT('',(0.,0.,10.));\n"
+    b"#6=CARTESIAN_POINT('',(10.,0.,10.));\n"
+    b"#7=CARTESIAN_POINT('',(10.,10.,10.));\n"
+    b"#8=CARTESIAN_POINT('',(0.,10.,10.));\n"
+    b"#9=VERTEX_POINT('',#1);\n"
+    b"#10=VERTEX_POINT('',#2);\n"
+    b"#11=VERTEX_POINT('',#3);\n"
+    b"#12=VERTEX_POINT('',#4);\n"
+    b"#13=VERTEX_POINT('',#5);\n"
+    b"#14=VERTEX_POINT('',#6);\n"
+    b"#15=VERTEX_POINT('',#7);\n"
+    b"#16=VERTEX_POINT('',#8);\n"
+    b"#17=DIRECTION('',(1.,0.,0.));\n"
+    b"#18=DIRECTION('',(0.,1.,0.));\n"
+    b"#19=DIRECTION('',(0.,0.,1.));\n"
+    b"#20=DIRECTION('',(-1.,0.,0.));\n"
+    b"#21=DIRECTION('',(0.,-1.,0.));\n"
+    b"#22=DIRECTION('',(0.,0.,-1.));\n"
+    b"#23=VECTOR('',#17,1.);\n"
+    b"#24=VECTOR('',#18,1.);\n"
+    b"#25=VECTOR('',#19,1.);\n"
+    b"#26=LINE('',#1,#23);\n"
+    b"#27=EDGE_CURVE('',#9,#10,#26,.T.);\n"
+    b"#28=LINE('',#2,#24);\n"
+    b"#29=EDGE_CURVE('',#10,#11,#28,.T.);\n"
+    b"#30=LINE('',#4,#23);\n"
+    b"#31=EDGE_CURVE('',#12,#11,#30,.T.);\n"
+    b"#32=LINE('',#1,#24);\n"
+    b"#33=EDGE_CURVE('',#9,#12,#32,.T.);\n"
+    b"#34=LINE('',#5,#23);\n"
+    b"#35=EDGE_CURVE('',#13,#14,#34,.T.);\n"
+    b"#36=LINE('',#6,#24);\n"
+    b"#37=EDGE_CURVE('',#14,#15,#36,.T.);\n"
+    b"#38=LINE('',#8,#23);\n"
+    b"#39=EDGE_CURVE('',#16,#15,#38,.T.);\n"
+    b"#40=LINE('',#5,#24);\n"
+    b"#41=EDGE_CURVE('',#13,#16,#40,.T.);\n"
+    b"#42=LINE('',#1,#25);\n"
+    b"#43=EDGE_CURVE('',#9,#13,#42,.T.);\n"
+    b"#44=LINE('',#2,#25);\n"
+    b"#45=EDGE_CURVE('',#10,#14,#44,.T.);\n"
+    b"#46=LINE('',#3,#25);\n"
+    b"#47=EDGE_CURVE('',#11,#15,#46,.T.);\n"
+    b"#48=LINE('',#4,#25);\n"
+    b"#49=EDGE_CURVE('',#12,#16,#48,.T.);\n"
+    b"#50=ORIENTED_EDGE('',*,*,#33,.T.);\n"
+    b"#51=ORIENTED_EDGE('',*,*,#31,.T.);\n"
+    b"#52=ORIENTED_EDGE('',*,*,#29,.F.);\n"
+    b"#53=ORIENTED_EDGE('',*,*,#27,.F.);\n"
+    b"#54=EDGE_LOOP('',(#50,#51,#52,#53));\n"
+    b"#55=FACE_OUTER_BOUND('',#54,.T.);\n"
+    b"#56=AXIS2_PLACEMENT_3D('',#1,#22,#17);\n"
+    b"#57=PLANE('',#56);\n"
+    b"#58=ADVANCED_FACE('',(#55),#57,.T.);\n"
+    b"#59=ORIENTED_EDGE('',*,*,#35,.T.);\n"
+    b"#60=ORIENTED_EDGE('',*,*,#37,.T.);\n"
+    b"#61=ORIENTED_EDGE('',*,*,#39,.F.);\n"
+    b"#62=ORIENTED_EDGE('',*,*,#41,.F.);\n"
+    b"#63=EDGE_LOOP('',(#59,#60,#61,#62));\n"
+    b"#64=FACE_OUTER_BOUND('',#63,.T.);\n"
+    b"#65=AXIS2_PLACEMENT_3D('',#5,#19,#17);\n"
+    b"#66=PLANE('',#65);\n"
+    b"#67=ADVANCED_FACE('',(#64),#66,.T.);\n"
+    b"#68=ORIENTED_EDGE('',*,*,#27,.T.);\n"
+    b"#69=ORIENTED_EDGE('',*,*,#45,.T.);\n"
+    b"#70=ORIENTED_EDGE('',*,*,#35,.F.);\n"
+    b"#71=ORIENTED_EDGE('',*,*,#43,.F.);\n"
+    b"#72=EDGE_LOOP('',(#68,#69,#70,#71));\n"
+    b"#73=FACE_OUTER_BOUND('',#72,.T.);\n"
+    b"#74=AXIS2_PLACEMENT_3D('',#1,#21,#17);\n"
+    b"#75=PLANE('',#74);\n"
+    b"#76=ADVANCED_FACE('',(#73),#75,.T.);\n"
+    b"#77=ORIENTED_EDGE('',*,*,#49,.T.);\n"
+    b"#78=ORIENTED_EDGE('',*,*,#39,.T.);\n"
+    b"#79=ORIENTED_EDGE('',*,*,#47,.F.);\n"
+    b"#80=ORIENTED_EDGE('',*,*,#31,.F.);\n"
+    b"#81=EDGE_LOOP('',(#77,#78,#79,#80));\n"
+    b"#82=FACE_OUTER_BOUND('',#81,.T.);\n"
+    b"#83=AXIS2_PLACEMENT_3D('',#4,#18,#17);\n"
+    b"#84=PLANE('',#83);\n"
+    b"#85=ADVANCED_FACE('',(#82),#84,.T.);\n"
+    b"#86=ORIENTED_EDGE('',*,*,#43,.T.);\n"
+    b"#87=ORIENTED_EDGE('',*,*,#41,.T.);\n"
+    b"#88=ORIENTED_EDGE('',*,*,#49,.F.);\n"
+    b"#89=ORIENTED_EDGE('',*,*,#33,.F.);\n"
+    b"#90=EDGE_LOOP('',(#86,#87,#88,#89));\n"
+    b"#91=FACE_OUTER_BOUND('',#90,.T.);\n"
+    b"#92=AXIS2_PLACEMENT_3D('',#1,#20,#18);\n"
+    b"#93=PLANE('',#92);\n"
+    b"#94=ADVANCED_FACE('',(#91),#93,.T.);\n"
+    b"#95=ORIENTED_EDGE('',*,*,#29,.T.);\n"
+    b"#96=ORIENTED_EDGE('',*,*,#47,.T.);\n"
+    b"#97=ORIENTED_EDGE('',*,*,#37,.F.);\n"
+    b"#98=ORIENTED_EDGE('',*,*,#45,.F.);\n"
+    b"#99=EDGE_LOOP('',(#95,#96,#97,#98));\n"
+    b"#100=FACE_OUTER_BOUND('',#99,.T.);\n"
+    b"#101=AXIS2_PLACEMENT_3D('',#2,#17,#18);\n"
+    b"#102=PLANE('',#101);\n"
+    b"#103=ADVANCED_FACE('',(#100),#102,.T.);\n"
+    b"#104=CLOSED_SHELL('',(#58,#67,#76,#85,#94,#103));\n"
+    b"#105=MANIFOLD_SOLID_BREP('cube',#104);\n"
+    b"#106=(LENGTH_UNIT()NAMED_UNIT(*)SI_UNIT(.MILLI.,.METRE.));\n"
+    b"#107=(NAMED_UNIT(*)PLANE_ANGLE_UNIT()SI_UNIT($,.RADIAN.));\n"
+    b"#108=(NAMED_UNIT(*)SI_UNIT($,.STERADIAN.)SOLID_ANGLE_UNIT());\n"
+    b"#109=UNCERTAINTY_MEASURE_WITH_UNIT(LENGTH_MEASURE(1.E-07),#106,'distance_accuracy_value','');\n"
+    b"#110=(GEOMETRIC_REPRESENTATION_CONTEXT(3)GLOBAL_UNCERTAINTY_ASSIGNED_CONTEXT((#109))GLOBAL_UNIT_ASSIGNED_CONTEXT((#106,#107,#108))REPRESENTATION_CONTEXT('',''));\n"
+    b"#111=AXIS2_PLACEMENT_3D('',#1,#19,#17);\n"
+    b"#112=ADVANCED_BREP_SHAPE_REPRESENTATION('',(#111,#105),#110);\n"
+    b"#113=APPLICATION_CONTEXT('automotive design');\n"
+    b"#114=APPLICATION_PROTOCOL_DEFINITION('international standard','automotive_design',2000,#113);\n"
+    b"#115=PRODUCT_CONTEXT('',#113,'mechanical');\n"
+    b"#116=PRODUCT('cube','cube','',(#115));\n"
+    b"#117=PRODUCT_DEFINITION_CONTEXT('part definition',#113,'design');\n"
+    b"#118=PRODUCT_DEFINITION_FORMATION('','',#116);\n"
+    b"#119=PRODUCT_DEFINITION('design','',#118,#117);\n"
+    b"#120=PRODUCT_DEFINITION_SHAPE('','',#119);\n"
+    b"#121=SHAPE_DEFINITION_REPRESENTATION(#120,#112);\n"
+    b"ENDSEC;\n"
+    b"END-ISO-10303-21;\n"
+)
+
+
+def _warmup() -> float:
+    t0 = time.perf_counter()
+    occ = _need_occ()
+    shape = _read_step_shape(occ, _WARMUP_STEP)
+    geometry = _measure_shape(occ, shape)
+    elapsed = time.perf_counter() - t0
+    if geometry["volume_fallback"] or abs(geometry["volume_m3"] - 1e-6) > 1e-9:
+        log.warning("Warm-up kubus gaf onverwachte geometrie: %s", geometry)
+    return elapsed
+
+
+@app.on_event("startup")
+def _start_pool() -> None:
+    # Eerst OCCT in de parent laden (en opwarmen), zodat geforkte workers dat erven.
+    try:
+        _need_occ()
+        log.info("CAD-backend %s opgelost in %.3fs.", _OCC["flavor"], _BACKEND_TIMINGS["resolve_s"])
+        if _WARMUP:
+            # Via _collected, zodat de warm-up niet in /metrics meetelt
+            _BACKEND_TIMINGS["warmup_s"] = round(_collected(_warmup)[0], 4)
+            log.info("Warm-up parse klaar in %.3fs.", _BACKEND_TIMINGS["warmup_s"])
+    except HTTPException as e:
+        log.warning("Geen CAD-backend bij startup: %s", e.detail)
+    except Exception:
+        log.exception("Warm-up faalde; eerste request betaalt de initialisatie.")
+    _sweep_shape_tmp()
+    # Nu pas forken: de zygote (en daarmee elke worker) erft de opgewarmde OCCT
+    _pool()
+    log.info("Worker-pool gestart met %d processen.", _WORKERS)
+
+
+@app.on_event("shutdown")
+def _stop_pool() -> None:
+    global _POOL
+    if _POOL is not None:
+        _POOL.shutdown()
+        _POOL = None
+
+
+# ===== Resultaat-cache, geadresseerd op SHA-256 van de STEP-bytes =====
+# Alleen de geometrie (bbox/volume) wordt bewaard; materiaal/dichtheid worden er
+# per request overheen gelegd, zodat een ander materiaal nooit een re-parse kost.
+_CACHE_DIR = os.getenv("STEP_CACHE_DIR", "/tmp/step-analyzer-cache")
+_CACHE_MEM_ITEMS = int(os.getenv("STEP_CACHE_MEM_ITEMS", "512"))
+_CACHE_DISK_BYTES = int(os.getenv("STEP_CACHE_DISK_BYTES", str(256 * 1024 * 1024)))
+
+
+class _DiskLRU:
+    """
+    Directory met één bestand per key. Boven max_bytes worden de langst niet
+    gebruikte bestanden (oudste mtime) verwijderd.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, suffix: str):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(size for _, _, size in self._entries())
+
+    def _entries(self):
+        out = []
+        with os.scandir(self.directory) as it:
+            for e in it:
+                if e.is_file() and e.name.endswith(self.suffix):
+                    st = e.stat()
+                    out.append((st.st_mtime, e.path, st.st_size))
+        return out
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}{self.suffix}")
+
+    def read(self, key: str) -> Optional[bytes]:
+        p = self.path(key)
+        try:
+            with open(p, "rb") as f:
+                data = f.read()
+            os.utime(p)  # markeer als recent gebruikt
+            return data
+        except FileNotFoundError:
+            return None
+
+    def write(self, key: str, data: bytes) -> int:
+        """Schrijft atomair (tmp + rename) en geeft het aantal evicties terug."""
+        p = self.path(key)
+        tmp = f"{p}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        return self.adopt(key, tmp)
+
+    def adopt(self, key: str, tmp: str) -> int:
+        """Neemt een al geschreven bestand op onder key (rename) en geeft het aantal evicties terug."""
+        p = self.path(key)
+        size = os.path.getsize(tmp)
+        try:
+            old = os.path.getsize(p)
+        except OSError:
+            old = 0
+        os.replace(tmp, p)
+        with self._lock:
+            self._size += size - old
+        return self._evict()
+
+    def sweep_tmp(self, max_age_s: float) -> int:
+        """
+        Verwijdert halfgeschreven *.tmp-bestanden ouder dan max_age_s, bijv. van
+        een gekilde worker, en geeft het aantal terug. Jongere zijn misschien nog
+        in gebruik, ook door een ander API-proces op dezelfde map.
+        """
+        cutoff = time.time() - max_age_s
+        removed = 0
+        with os.scandir(self.directory) as it:
+            for e in it:
+                try:
+                    if e.name.endswith(".tmp") and e.is_file() and e.stat().st_mtime < cutoff:
+                        os.remove(e.path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+    def _evict(self) -> int:
+        with self._lock:
+            if self._size <= self.max_bytes:
+                return 0
+            entries = sorted(self._entries())
+            self._size = sum(size for _, _, size in entries)
+            evicted = 0
+            for _, p, size in entries:
+                if self._size <= self.max_bytes:
+                    break
+                try:
+                    os.remove(p)
+                except FileNotFoundError:
+                    pass
+                self._size -= size
+                evicted += 1
+            return evicted
+
+
+class _ResultCache:
+    """In-memory LRU voor de hete set, met een _DiskLRU eronder."""
+
+    def __init__(self, directory: str, mem_items: int, disk_bytes: int):
+        self._mem: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._mem_items = mem_items
+        self._lock = threading.Lock()
+        self._disk = _DiskLRU(directory, disk_bytes, ".json")
+        self.stats = {
+            "hits_memory": 0,
+            "hits_disk": 0,
+            "misses": 0,
+            "evictions_memory": 0,
+            "evictions_disk": 0,
+        }
+
+    def get(self, key: str):
+        """Geeft (waarde, tier) terug; tier is 'memory', 'disk' of 'miss'."""
+        value, tier = self.peek(key)
+        with self._lock:
+            self.stats[{"memory": "hits_memory", "disk": "hits_disk"}.get(tier, "misses")] += 1
+        return value, tier
+
+    def peek(self, key: str):
+        """Als get(), maar zonder hits en misses te tellen (nogmaals kijken na het wachten)."""
+        with self._lock:
+            if key in self._mem:
+                self._mem.move_to_end(key)
+                return self._mem[key], "memory"
+        raw = self._disk.read(key)
+        if raw is not None:
+            try:
+                value = json.loads(raw)
+            except ValueError:
+                value = None
+            if value is not None:
+                self._remember(key, value)
+                return value, "disk"
+        return None, "miss"
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        self._remember(key, value)
+        try:
+            evicted = self._disk.write(key, json.dumps(value).encode("utf-8"))
+        except OSError as e:
+            log.warning("Cache naar schijf schrijven mislukte: %s", e)
+            return
+        with self._lock:
+            self.stats["evictions_disk"] += evicted
+
+    def _remember(self, key: str, value: Dict[str, Any]) -> None:
+        with self._lock:
+            self._mem[key] = value
+            self._mem.move_to_end(key)
+            while len(self._mem) > self._mem_items:
+                self._mem.popitem(last=False)
+                self.stats["evictions_memory"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self.stats,
+                "memory_items": len(self._mem),
+                "memory_capacity": self._mem_items,
+                "disk_bytes": self._disk._size,
+                "disk_capacity_bytes": self._disk.max_bytes,
+            }
+
+
+_GEOMETRY_CACHE = _ResultCache(os.path.join(_CACHE_DIR, "geometry"), _CACHE_MEM_ITEMS, _CACHE_DISK_BYTES)
+
+# De vertaalde shape zelf (BinTools-formaat), per SHA-256 van de STEP. Een nieuwe
+# precisie-tier of OBB-modus mist de geometrie-cache, maar hoeft dan alleen de
+# BRep te laden in plaats van de STEP opnieuw te vertalen. 0 = uit.
+_SHAPE_CACHE = _DiskLRU(
+    os.path.join(_CACHE_DIR, "shape"),
+    int(os.getenv("STEP_SHAPE_DISK_BYTES", str(1024 * 1024 * 1024))),
+    ".brep",
+)
+# Een shape-*.tmp leeft hooguit één analyse (binnen de deadline); wat ouder is,
+# is achtergelaten door een gekilde of gecrashte worker
+_SHAPE_TMP_MAX_AGE_S = (_JOB_TIMEOUT_S + _CANCEL_GRACE_S) if _JOB_TIMEOUT_S else 24 * 3600
+
+
+def _sweep_shape_tmp() -> None:
+    try:
+        removed = _SHAPE_CACHE.sweep_tmp(_SHAPE_TMP_MAX_AGE_S)
+    except OSError as e:
+        log.warning("Opruimen van de BRep-cache mislukte: %s", e)
+        return
+    if removed:
+        log.info("%d achtergelaten BRep-tmp-bestand(en) opgeruimd.", removed)
+
+
+# ===== Single-flight: gelijke analyses die tegelijk binnenkomen één keer doen =====
+# Een gedeelde offerte-link wordt vaak door meerdere mensen tegelijk geopend.
+# Binnen het API-proces wachten zulke requests op dezelfde task; tussen
+# API-processen (uvicorn --workers) houdt de leider een flock onder
+# STEP_CACHE_DIR en lezen de anderen daarna het resultaat uit de cache.
+_FLIGHT_POLL_S = 0.05
+# Fouten die alleen over de leider zeggen (afgehaakt, zijn timeout_s op)
+_LEADER_ONLY_STATUS = (499, 504)
+
+
+def _try_flock(path: str) -> Optional[int]:
+    """
+    fd met exclusieve lock op path, of None als een ander proces hem heeft.
+    De houder haalt het bestand weg vóór hij het sluit. Wie daarna de lock
+    krijgt op die oude inode, ziet dat path niet meer naar zijn inode wijst
+    (of niet meer bestaat) en probeert het opnieuw; omdat alleen de houder
+    path weghaalt, wijst path zolang hij de lock heeft naar zijn inode.
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        # De vorige houder haalt het bestand weg vóór hij loslaat: dan is dit een oude inode
+        if os.fstat(fd).st_ino == os.stat(path).st_ino:
+            return fd
+    except (BlockingIOError, FileNotFoundError):
+        pass
+    os.close(fd)
+    return None
+
+
+class _SingleFlight:
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._tasks: Dict[str, "asyncio.Task"] = {}
+
+    async def run(self, key: str, compute: Callable, recheck: Optional[Callable] = None):
+        """
+        Resultaat van compute() voor key, met hooguit één berekening tegelijk.
+        Met recheck (geeft het gecachete resultaat of None) geldt dat ook over
+        API-processen heen. De berekening hoort bij de eerste aanvrager: haakt
+        die af of is zijn tijdsbudget op, dan begint een wachtende opnieuw met
+        zijn eigen invoer en budget.
+        """
+        while True:
+            task = self._tasks.get(key)
+            if task is None:
+                task = self._tasks[key] = asyncio.ensure_future(self._lead(key, compute, recheck))
+                task.add_done_callback(lambda done, key=key: self._forget(key, done))
+                return await task
+            _METRICS.inc("step_analyzer_coalesced_total", scope="process")
+            await asyncio.wait({task})  # afhaken stopt de berekening van een ander niet
+            if task.cancelled():
+                continue
+            error = task.exception()
+            # Het tijdsbudget en de verbinding zijn van de leider, niet van ons: dan zelf opnieuw
+            if isinstance(error, HTTPException) and error.status_code in _LEADER_ONLY_STATUS:
+                continue
+            return task.result()
+
+    def _forget(self, key: str, task: "asyncio.Task") -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+
+    async def _lead(self, key: str, compute: Callable, recheck: Optional[Callable]):
+        if recheck is None:
+            return await compute()
+        path = os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest() + ".lock")
+        # Wachten op een ander proces telt mee in ons tijdsbudget; afhaken
+        # (499) breekt de sleep af via _unless_disconnected
+        budget = _TIME_BUDGET.get()
+        give_up = time.monotonic() + budget if budget else None
+        while (fd := _try_flock(path)) is None:
+            if give_up is not None and time.monotonic() >= give_up:
+                _METRICS.inc("step_analyzer_cancelled_total", reason="timeout")
+                raise HTTPException(
+                    status_code=504,
+                    detail="Dezelfde analyse loopt in een ander proces en duurt langer dan het tijdsbudget (timeout_s/STEP_JOB_TIMEOUT_S).",
+                )
+            await asyncio.sleep(_FLIGHT_POLL_S)
+        try:
+            # Altijd opnieuw kijken: ook zonder wachten kan een ander proces
+            # net klaar zijn tussen onze cache-miss en de lock
+            cached = recheck()
+            if cached is not None:
+                _METRICS.inc("step_analyzer_coalesced_total", scope="host")
+                return cached
+            return await compute()
+        finally:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+
+_IN_FLIGHT = _SingleFlight(os.path.join(_CACHE_DIR, "inflight"))
+
+
+# ===== Entity-index over een (memory-mapped) STEP =====
+# entity-id -> byte-offset, lengte en type, gebouwd met NumPy in één pass per
+# venster. Zo zijn productnamen, assembly-structuur en eenheden op te vragen
+# zonder OCCT en zonder de file in het geheugen te laden: de bytes blijven in
+# de page cache, resident zijn alleen de indexarrays.
+_INDEX_WINDOW_BYTES = 16 * 1024 * 1024
+_INDEX_TYPE_WIDTH = 64
+_QUOTED_RE = re.compile(rb"'((?:[^']|'')*)'")
+
+
+class _StepIndex:
+    def __init__(self, buf, ids, offsets, ends, codes, types):
+        self.buf = buf
+        self.ids = ids          # gesorteerd
+        self.offsets = offsets
+        self.ends = ends
+        self.codes = codes
+        self.types = types      # code -> typenaam ("" = complexe entiteit)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, buf) -> "_StepIndex":
+        data_at = buf.find(b"DATA;")
+        start = data_at + 5 if data_at >= 0 else 0
+        # Typenamen worden per venster al codes: resident blijven 28 bytes per
+        # entiteit, geen naam van _INDEX_TYPE_WIDTH bytes
+        vocab: Dict[bytes, int] = {}
+        parts = []
+        while start < len(buf):
+            end = min(len(buf), start + _INDEX_WINDOW_BYTES)
+            if end < len(buf):
+                # Venster laten eindigen op een statement-grens: een ';' buiten strings
+                arr = np.frombuffer(buf, dtype=np.uint8, count=end - start, offset=start)
+                semis = cls._unquoted(np.flatnonzero(arr == ord(";")), np.flatnonzero(arr == ord("'")))
+                end = start + int(semis[-1]) + 1 if len(semis) else len(buf)
+                del arr, semis
+            ids, offsets, ends, codes, names = cls._scan_window(buf, start, end)
+            remap = np.array([vocab.setdefault(name, len(vocab)) for name in names], np.int32)
+            parts.append((ids, offsets, ends, remap[codes] if len(names) else codes.astype(np.int32)))
+            start = end
+
+        if parts:
+            ids, offsets, ends, codes = (np.concatenate([p[k] for p in parts]) for k in range(4))
+        else:
+            ids = offsets = ends = np.zeros(0, np.int64)
+            codes = np.zeros(0, np.int32)
+        del parts
+        # Meestal staan de ids al oplopend in de file; dan hoeft er niets gekopieerd
+        if len(ids) > 1 and not (ids[1:] >= ids[:-1]).all():
+            order = np.argsort(ids, kind="stable")
+            ids, offsets, ends, codes = ids[order], offsets[order], ends[order], codes[order]
+        return cls(buf, ids, offsets, ends, codes, [t.decode("ascii", "replace") for t in vocab])
+
+    @staticmethod
+    def _unquoted(positions: np.ndarray, quotes: np.ndarray) -> np.ndarray:
+        """
+        De posities buiten strings: met een even aantal quotes ervoor. Een
+        ge-escapete '' telt dubbel en verandert de pariteit dus niet; het
+        venster begint altijd op een statement-grens, dus buiten een string.
+        """
+        return positions[np.searchsorted(quotes, positions) % 2 == 0]
+
+    @classmethod
+    def _scan_window(cls, buf, lo: int, hi: int):
+        """(ids, offsets, ends, codes, typenamen) van de entiteiten in buf[lo:hi]."""
+        arr = np.frombuffer(buf, dtype=np.uint8, count=hi - lo, offset=lo)
+        # ';', '#', '=' en '(' in strings (productnamen, beschrijvingen) zijn geen syntax
+        quotes = np.flatnonzero(arr == ord("'"))
+        hashes = cls._unquoted(np.flatnonzero(arr == ord("#")), quotes)
+        eqs = cls._unquoted(np.flatnonzero(arr == ord("=")), quotes)
+        parens = cls._unquoted(np.flatnonzero(arr == ord("(")), quotes)
+        semis = cls._unquoted(np.flatnonzero(arr == ord(";")), quotes)
+        del quotes
+        empty = np.zeros(0, np.int64)
+        if not len(hashes) or not len(eqs) or not len(semis):
+            return empty, empty, empty, empty, []
+
+        # Kandidaten: '#' aan het begin van een regel of direct na een ';'
+        prev = np.where(hashes > 0, arr[np.maximum(hashes - 1, 0)], ord("\n"))
+        starts = hashes[(prev == ord("\n")) | (prev == ord("\r")) | (prev == ord(";")) | (prev == ord(" "))]
+        # Echte definitie (#12=...): de eerstvolgende '=' komt vóór de volgende '(' en ';'
+        sentinel = len(arr)
+        eq_next = np.append(eqs, sentinel)[np.searchsorted(eqs, starts)]
+        paren_next = np.append(parens, sentinel)[np.searchsorted(parens, starts)]
+        semi_next = np.append(semis, sentinel)[np.searchsorted(semis, starts)]
+        ok = (eq_next < paren_next) & (eq_next < semi_next) & (semi_next < sentinel)
+        starts, eq_next, semi_next = starts[ok], eq_next[ok], semi_next[ok]
+
+        # Id: cijfers na '#', gevectoriseerd per positie
+        ids = np.zeros(len(starts), np.int64)
+        active = np.ones(len(starts), bool)
+        for k in range(1, 20):
+            pos = np.minimum(starts + k, sentinel - 1)
+            digit = arr[pos].astype(np.int64) - ord("0")
+            active &= (digit >= 0) & (digit <= 9) & (starts + k < eq_next)
+            if not active.any():
+                break
+            ids = np.where(active, ids * 10 + digit, ids)
+
+        # Type: naam tussen '=' (plus spaties) en de eerste '(' erna
+        tstart = eq_next + 1
+        for _ in range(8):
+            space = arr[np.minimum(tstart, sentinel - 1)] == ord(" ")
+            if not space.any():
+                break
+            tstart = tstart + space
+        tend = np.append(parens, sentinel)[np.searchsorted(parens, tstart)]
+        length = np.clip(np.minimum(tend, semi_next) - tstart, 0, _INDEX_TYPE_WIDTH)
+        cols = np.arange(_INDEX_TYPE_WIDTH)
+        names = np.zeros(len(starts), f"S{_INDEX_TYPE_WIDTH}")
+        # In blokjes: de gather-index is 8 bytes per teken
+        for b0 in range(0, len(starts), 1 << 16):
+            b1 = b0 + (1 << 16)
+            idx = np.minimum(tstart[b0:b1, None] + cols, sentinel - 1)
+            chars = np.where(cols < length[b0:b1, None], arr[idx], 0).astype(np.uint8)
+            names[b0:b1] = np.ascontiguousarray(chars).view(f"S{_INDEX_TYPE_WIDTH}").ravel()
+        # Spaties vóór de '(' pas op de (kleine) woordenlijst weghalen
+        types, codes = np.unique(names, return_inverse=True)
+        return ids, starts + lo, semi_next + 1 + lo, codes, [bytes(t).strip() for t in types]
+
+    # --- (de)serialisatie voor de on-disk cache ---
+    def dumps(self) -> bytes:
+        out = io.BytesIO()
+        np.savez(
+            out,
+            ids=self.ids,
+            offsets=self.offsets,
+            ends=self.ends,
+            codes=self.codes,
+            # Vaste breedte, geen object-array: de cache-map kan van een ander
+            # zijn, dus nooit iets laden dat unpicklen vraagt
+            types=np.array([t.encode("utf-8") for t in self.types], dtype=bytes),
+        )
+        return out.getvalue()
+
+    @classmethod
+    def loads(cls, buf, raw: bytes) -> "_StepIndex":
+        with np.load(io.BytesIO(raw), allow_pickle=False) as z:
+            types = [t.decode("utf-8", "replace") for t in z["types"].tolist()]
+            return cls(buf, z["ids"], z["offsets"], z["ends"], z["codes"], types)
+
+    # --- queries ---
+    def entity(self, entity_id: int) -> Optional[bytes]:
+        i = np.searchsorted(self.ids, entity_id)
+        if i >= len(self.ids) or self.ids[i] != entity_id:
+            return None
+        return bytes(self.buf[self.offsets[i]:self.ends[i]])
+
+    def type_of(self, entity_id: int) -> Optional[str]:
+        i = np.searchsorted(self.ids, entity_id)
+        if i >= len(self.ids) or self.ids[i] != entity_id:
+            return None
+        return self.types[self.codes[i]]
+
+    def ids_of_type(self, *names: str) -> np.ndarray:
+        wanted = [self.types.index(n) for n in names if n in self.types]
+        return self.ids[np.isin(self.codes, wanted)] if wanted else np.zeros(0, np.int64)
+
+    def args(self, entity_id: int) -> Dict[str, List[Any]]:
+        """Strings en referenties van een entiteit, in volgorde."""
+        raw = self.entity(entity_id) or b""
+        body = raw[raw.find(b"(") + 1:]
+        return {
+            "strings": [q.replace(b"''", b"'").decode("utf-8", "replace") for q in _QUOTED_RE.findall(body)],
+            "refs": [int(r) for r in _REF_RE.findall(_QUOTED_RE.sub(b"''", body))],
         }
-        url = _normalize_url(body.file_url)
-        resp = requests.get(url, headers=headers, timeout=45, allow_redirects=True)
+
+    def type_counts(self) -> Dict[str, int]:
+        counts = np.bincount(self.codes, minlength=len(self.types))
+        return {(self.types[c] or "<complex>"): int(counts[c])
+                for c in sorted(range(len(self.types)), key=self.types.__getitem__) if counts[c]}
+
+
+_INDEX_CACHE = _DiskLRU(
+    os.path.join(_CACHE_DIR, "index"),
+    int(os.getenv("STEP_INDEX_DISK_BYTES", str(256 * 1024 * 1024))),
+    ".npz",
+)
+
+
+def _index_memory(features: Dict[str, int]) -> int:
+    """
+    Piek van _StepIndex.build: de tijdelijke arrays van één venster (vast deel
+    plus ~600 bytes per entiteit erin) en 56 bytes per entiteit voor het
+    resultaat met zijn concatenatie.
+    """
+    entities = features["entities"]
+    in_window = entities * min(1.0, _INDEX_WINDOW_BYTES / max(1, features["bytes"]))
+    return int(_MEM_FLOOR_BYTES + 600 * in_window + 56 * entities)
+
+
+async def _spool_metadata(spool: _StepSpool) -> Dict[str, Any]:
+    """
+    _step_metadata via de (gecachte) index. Het bouwen is seconden NumPy- en
+    Python-werk, dus in een thread en binnen het geheugenbudget.
+    """
+    async with _MEMORY.admit(_index_memory(spool.footprint.features())):
+        return await asyncio.to_thread(_metadata_of, spool.source(), spool.sha256)
+
+
+def _metadata_of(source: Union[bytes, str], sha: str) -> Dict[str, Any]:
+    with _open_index(source, sha) as index:
+        return _step_metadata(index)
+
+
+@contextmanager
+def _open_index(source: Union[bytes, str], sha: str):
+    """Opent (of bouwt en cachet) de index; een pad wordt gememory-mapt."""
+    f = mm = None
+    try:
+        if isinstance(source, str):
+            f = open(source, "rb")
+            buf = mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            buf = source
+        raw = _INDEX_CACHE.read(sha)
+        index = None
+        if raw is not None:
+            try:
+                index = _StepIndex.loads(buf, raw)
+            except (ValueError, KeyError, OSError, zipfile.BadZipFile) as e:
+                # Oud formaat (object-array) of kapot: gewoon opnieuw bouwen
+                log.warning("Entity-index uit de cache is onbruikbaar (%s); wordt opnieuw gebouwd.", e)
+        if index is None:
+            with _stage("index_build"):
+                index = _StepIndex.build(buf)
+            _INDEX_CACHE.write(sha, index.dumps())
+        yield index
+    finally:
+        if mm is not None:
+            mm.close()
+        if f is not None:
+            f.close()
+
+
+def _step_metadata(index: _StepIndex) -> Dict[str, Any]:
+    """Producten, assembly-structuur en eenheden, puur uit de index."""
+    products = {}
+    for pid in index.ids_of_type("PRODUCT"):
+        strings = index.args(int(pid))["strings"]
+        products[int(pid)] = {"id": strings[0] if strings else None, "name": strings[1] if len(strings) > 1 else None}
+
+    # product_definition -> formation -> product
+    formation_product = {}
+    for fid in index.ids_of_type(
+        "PRODUCT_DEFINITION_FORMATION", "PRODUCT_DEFINITION_FORMATION_WITH_SPECIFIED_SOURCE"
+    ):
+        refs = index.args(int(fid))["refs"]
+        if refs:
+            formation_product[int(fid)] = refs[0]
+    definition_product = {}
+    for did in index.ids_of_type("PRODUCT_DEFINITION", "PRODUCT_DEFINITION_WITH_ASSOCIATED_DOCUMENTS"):
+        refs = index.args(int(did))["refs"]
+        if refs and refs[0] in formation_product:
+            definition_product[int(did)] = formation_product[refs[0]]
+
+    def product_name(definition: int) -> Optional[str]:
+        product = products.get(definition_product.get(definition, -1))
+        return product["name"] if product else None
+
+    occurrences = []
+    children = set()
+    for nid in index.ids_of_type("NEXT_ASSEMBLY_USAGE_OCCURRENCE"):
+        a = index.args(int(nid))
+        if len(a["refs"]) < 2:
+            continue
+        parent, child = a["refs"][0], a["refs"][1]
+        children.add(child)
+        occurrences.append({
+            "instance": a["strings"][1] if len(a["strings"]) > 1 else None,
+            "parent": product_name(parent),
+            "child": product_name(child),
+        })
+    roots = [product_name(d) for d in definition_product if d not in children]
+
+    units = [_parse_length_unit(index.entity(int(uid)) or b"") for uid in index.ids_of_type("")
+             if b"LENGTH_UNIT" in (index.entity(int(uid)) or b"")]
+    return {
+        "entities": len(index),
+        "entity_types": index.type_counts(),
+        "products": list(products.values()),
+        "roots": roots,
+        "assembly": occurrences,
+        "length_unit": units[0] if units else None,
+    }
+
+
+def _geometry_key(sha: str, opts: Dict[str, str]) -> str:
+    return sha + "".join(f"-{k}_{opts[k]}" for k in sorted(opts))
+
+
+async def _geometry_for(spool: _StepSpool, opts: Dict[str, str]):
+    """
+    Geeft (geometrie, sha256, cache-tier) terug. Alleen bij een miss wordt de
+    STEP echt ingelezen en geanalyseerd, in de worker-pool; loopt dezelfde
+    analyse al (ook in een ander API-proces), dan wordt daarop gewacht.
+    """
+    sha = spool.sha256
+    key = _geometry_key(sha, opts)
+    geometry, tier = _GEOMETRY_CACHE.get(key)
+    if geometry is None:
+        geometry, tier = await _IN_FLIGHT.run(
+            key, lambda: _compute_geometry(spool, opts, key), recheck=lambda: _cached_geometry(key)
+        )
+    return geometry, sha, tier
+
+
+def _cached_geometry(key: str):
+    # De miss is al geteld door _geometry_for
+    geometry, tier = _GEOMETRY_CACHE.peek(key)
+    return None if geometry is None else (geometry, tier)
+
+
+async def _compute_geometry(spool: _StepSpool, opts: Dict[str, str], key: str):
+    """De echte analyse in de worker-pool; het resultaat gaat de cache in."""
+    sha = spool.sha256
+    predicted = _MEMORY.predict(spool.footprint.features())
+    token = None
+    try:
+        async with _MEMORY.admit(predicted):
+            # Het budget loopt vanaf de toelating: wachten op geheugen heeft een eigen timeout
+            budget = _TIME_BUDGET.get()
+            token = _DEADLINE.set(time.monotonic() + budget if budget else None)
+            geometry = await _run_in_pool(_geometry_job, spool.source(), opts, sha)
+        # De fan-out reserveert opnieuw, voor al zijn workers; deze reservering
+        # vasthouden terwijl hij wacht zou twee grote requests op elkaar laten wachten
+        brep = geometry.pop("_brep", None)
+        try:
+            if "_fanout" in geometry:
+                geometry = await _fan_out_solids(geometry, predicted)
+        finally:
+            if brep is not None:
+                _adopt_shape(sha, brep)
+    finally:
+        if token is not None:
+            _DEADLINE.reset(token)
+    _GEOMETRY_CACHE.put(key, geometry)
+    return geometry, "miss"
+
+
+def _adopt_shape(sha: str, brep: str) -> None:
+    # Alleen de parent boekt in de BRep-cache, zodat de grootte-administratie klopt
+    try:
+        evicted = _SHAPE_CACHE.adopt(sha, brep)
+    except OSError as e:
+        log.warning("BRep-cache bijwerken mislukte: %s", e)
+        try:
+            os.unlink(brep)
+        except FileNotFoundError:
+            pass
+        return
+    if evicted:
+        _METRICS.inc("step_analyzer_shape_cache_evictions_total", evicted)
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    return {
+        "geometry": _GEOMETRY_CACHE.snapshot(),
+        "shape": {"disk_bytes": _SHAPE_CACHE._size, "disk_capacity_bytes": _SHAPE_CACHE.max_bytes},
+        "url": {"disk_bytes": _URL_CACHE._size, "disk_capacity_bytes": _URL_CACHE.max_bytes},
+    }
+
+
+# ===== URL normalizer =====
+def _normalize_url(raw: str) -> str:
+    raw = (raw or "").strip()
+    # GitHub blob → raw
+    if raw.startswith("https://github.com/") and "/blob/" in raw:
+        raw = raw.replace("https://github.com/", "https://raw.githubusercontent.com/").replace("/blob/", "/")
+    # OneDrive: forceer download
+    if ("1drv.ms" in raw or "onedrive.live.com" in raw) and "download=1" not in raw:
+        sep = "&" if "?" in raw else "?"
+        raw = f"{raw}{sep}download=1"
+    # Encode pad en query; schema/host blijven
+    sp = urlsplit(raw)
+    safe_path  = quote(sp.path, safe="/%:@")
+    safe_query = quote_plus(sp.query, safe="=&:%@")
+    return urlunsplit((sp.scheme, sp.netloc, safe_path, safe_query, sp.fragment))
+
+
+# ====== Download van een STEP-URL ======
+# Eén gedeelde async client: keep-alive per host en nauwelijks threads, ook met
+# honderden downloads tegelijk. Per host een semafoor, zodat één trage host
+# (OneDrive, GitHub raw) niet alle verbindingen opslokt.
+_HTTP_CONNECT_TIMEOUT = float(os.getenv("STEP_HTTP_CONNECT_TIMEOUT", "10"))
+_HTTP_READ_TIMEOUT = float(os.getenv("STEP_HTTP_READ_TIMEOUT", "45"))
+_HTTP_MAX_CONNECTIONS = int(os.getenv("STEP_HTTP_MAX_CONNECTIONS", "100"))
+_HTTP_PER_HOST = int(os.getenv("STEP_HTTP_PER_HOST", "8"))
+_PROGRESS_INTERVAL_S = 0.25  # hooguit zo vaak een download-event
+
+_HTTP_HEADERS = {
+    "User-Agent": "step-analyzer/1.0 (+https://step-analyzer.onrender.com)",
+    "Accept": "*/*",
+}
+_HTTP_CLIENT: Optional[httpx.AsyncClient] = None
+_HOST_SLOTS: Dict[str, asyncio.Semaphore] = {}
+
+
+def _http_client() -> httpx.AsyncClient:
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is None:
+        _HTTP_CLIENT = httpx.AsyncClient(
+            headers=_HTTP_HEADERS,
+            follow_redirects=True,
+            timeout=httpx.Timeout(
+                connect=_HTTP_CONNECT_TIMEOUT,
+                read=_HTTP_READ_TIMEOUT,
+                write=_HTTP_READ_TIMEOUT,
+                pool=_HTTP_READ_TIMEOUT,
+            ),
+            limits=httpx.Limits(
+                max_connections=_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=_HTTP_MAX_CONNECTIONS,
+            ),
+        )
+    return _HTTP_CLIENT
+
+
+def _host_slot(url: str) -> asyncio.Semaphore:
+    host = urlsplit(url).netloc.lower()
+    slot = _HOST_SLOTS.get(host)
+    if slot is None:
+        slot = _HOST_SLOTS[host] = asyncio.Semaphore(_HTTP_PER_HOST)
+    return slot
+
+
+@app.on_event("shutdown")
+async def _close_http_client() -> None:
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is not None:
+        await _HTTP_CLIENT.aclose()
+        _HTTP_CLIENT = None
+
+
+async def _stream_into(sink, url: str, validators: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Streamt de body van url naar sink en geeft de validators (ETag/Last-Modified)
+    van het antwoord terug. Met validators wordt het een conditionele GET; bij
+    een 304 komt er niets binnen en is het resultaat None.
+    """
+    headers = {}
+    if validators and validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators and validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    async with _http_client().stream("GET", url, headers=headers) as resp:
+        if resp.status_code == 304 and headers:
+            _progress("download", bytes=0, total=None, done=True, not_modified=True)
+            return None
         if resp.status_code != 200:
             raise HTTPException(
                 status_code=400,
                 detail=f"Download mislukt: HTTP {resp.status_code} voor URL {url}",
             )
-        data = resp.content
+        declared = resp.headers.get("Content-Length")
+        if declared and declared.isdigit() and int(declared) > _MAX_BYTES:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Bestand is groter dan de limiet van {_MAX_BYTES} bytes.",
+            )
+        total = int(declared) if declared and declared.isdigit() else None
+        received, reported = 0, 0.0
+        async for chunk in resp.aiter_bytes(_CHUNK_BYTES):
+            sink.write(chunk)
+            received += len(chunk)
+            if time.monotonic() - reported >= _PROGRESS_INTERVAL_S:
+                reported = time.monotonic()
+                _progress("download", bytes=received, total=total)
+        _progress("download", bytes=received, total=total, done=True)
+        return {"etag": resp.headers.get("ETag"), "last_modified": resp.headers.get("Last-Modified")}
+
 
-        if not data or len(data) < 1024:
+async def _download_members(
+    url: str,
+    scanners: Callable[[], Sequence[Any]] = tuple,
+    keep: bool = True,
+    validators: Optional[Dict[str, Any]] = None,
+) -> Tuple[Optional[List[_StepSpool]], Optional[Dict[str, Any]]]:
+    """
+    Streamt de download in stukken via _Ingest naar één of meer _StepSpools
+    (meer dan één alleen bij een zip). De groottelimiet wordt bewaakt terwijl
+    de bytes binnenkomen, niet pas achteraf. Geeft (spools, validators) terug;
+    met validators wordt er conditioneel gedownload en is spools None als de
+    bron ongewijzigd is (304).
+    """
+    ingest = _Ingest(scanners, keep)
+    try:
+        async with _host_slot(url):
+            with _stage("download"):
+                fresh = await _stream_into(ingest, url, validators)
+        if fresh is None:
+            ingest.close()
+            return None, validators
+        spools = await _finish_ingest(ingest, "url")
+    except HTTPException:
+        ingest.close()
+        raise
+    except Exception as e:
+        ingest.close()
+        raise HTTPException(status_code=400, detail=f"Download exception: {type(e).__name__}: {e}")
+
+    for spool in spools:
+        if spool.size < 1024:
+            for s in spools:
+                s.close()
             raise HTTPException(
                 status_code=400,
                 detail="Gedownloade file is leeg of verdacht klein. Is de URL juist en publiek toegankelijk?",
             )
-
         # STEP tekstbestanden bevatten meestal deze marker in de header
-        head = data[:4096]
-        if b"ISO-10303-21" not in head and b"STEP" not in head.upper():
+        if b"ISO-10303-21" not in spool.head and b"STEP" not in spool.head.upper():
             log.warning("Downloaded content mist typische STEP-header; ga toch proberen te parsen.")
-    except HTTPException:
+    return spools, fresh
+
+
+async def _download_step(url: str, scanners: Sequence[Any] = ()) -> _StepSpool:
+    spools, _ = await _download_members(url, lambda: scanners)
+    return _single_spool(spools)
+
+
+# ===== Revalidatie van /analyze-url-bronnen =====
+# Dezelfde OneDrive/GitHub-link komt in veel offertes terug. Per genormaliseerde
+# URL bewaren we de validators van de laatste download plus de SHA-256 van de
+# STEP-bestanden erin; de volgende keer wordt conditioneel gedownload en bij een
+# 304 komt de geometrie rechtstreeks uit _GEOMETRY_CACHE. 0 = uit.
+_URL_CACHE = _DiskLRU(
+    os.path.join(_CACHE_DIR, "url"),
+    int(os.getenv("STEP_URL_CACHE_DISK_BYTES", str(16 * 1024 * 1024))),
+    ".json",
+)
+
+
+def _url_entry(url: str) -> Optional[Dict[str, Any]]:
+    if not _URL_CACHE.max_bytes:
+        return None
+    raw = _URL_CACHE.read(hashlib.sha256(url.encode("utf-8")).hexdigest())
+    try:
+        return json.loads(raw) if raw is not None else None
+    except ValueError:
+        return None
+
+
+def _remember_url(url: str, validators: Optional[Dict[str, Any]], spools: List[_StepSpool]) -> None:
+    # Zonder ETag of Last-Modified valt er niets te revalideren
+    if not _URL_CACHE.max_bytes or not validators or not any(validators.values()):
+        return
+    entry = {
+        "url": url,
+        **validators,
+        "members": [{"sha256": s.sha256, "name": s.name, "compression": s.compression} for s in spools],
+    }
+    try:
+        _URL_CACHE.write(hashlib.sha256(url.encode("utf-8")).hexdigest(), json.dumps(entry).encode("utf-8"))
+    except OSError as e:
+        log.warning("URL-cache bijwerken mislukte: %s", e)
+
+
+def _cached_members(entry: Optional[Dict[str, Any]], opts: Dict[str, str]):
+    """
+    Geometrie van alle members van een eerdere download met deze opties, of
+    None als er één ontbreekt: dan heeft een 304 geen zin en wordt er gewoon
+    opnieuw gedownload.
+    """
+    if not entry or not entry.get("members"):
+        return None
+    cached = []
+    for member in entry["members"]:
+        geometry, tier = _GEOMETRY_CACHE.get(_geometry_key(member["sha256"], opts))
+        if geometry is None:
+            return None
+        cached.append((member, geometry, tier))
+    return cached
+
+
+# ====== Gedeelde stappen voor alle analyse-endpoints ======
+async def _client_gone(request: Request) -> None:
+    """Keert terug zodra de client de verbinding verbreekt (de body is dan al gelezen)."""
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+
+async def _unless_disconnected(request: Request, work):
+    """
+    Voert work uit, maar breekt het af zodra de client de verbinding verbreekt:
+    de workers krijgen dan het annuleersignaal en komen meteen weer vrij.
+    """
+    task = asyncio.ensure_future(work)
+    watcher = asyncio.ensure_future(_client_gone(request))
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        if task.done():
+            return task.result()
+        log.info("Client van %s is weg; analyse wordt afgebroken.", request.url.path)
+        raise HTTPException(status_code=499, detail="Client heeft de verbinding verbroken.")
+    finally:
+        task.cancel()
+        watcher.cancel()
+
+
+async def _ingest_upload(
+    file: UploadFile,
+    scanners: Callable[[], Sequence[Any]] = tuple,
+    keep: bool = True,
+) -> List[_StepSpool]:
+    ingest = _Ingest(scanners, keep)
+    try:
+        with _stage("upload"):
+            while True:
+                chunk = await file.read(_CHUNK_BYTES)
+                if not chunk:
+                    break
+                ingest.write(chunk)
+        spools = await _finish_ingest(ingest, "upload")
+    except BaseException:
+        ingest.close()
         raise
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Download exception: {type(e).__name__}: {e}")
+    for spool in spools:
+        spool.name = spool.name or file.filename
+    return spools
+
+
+async def _spool_upload(file: UploadFile, scanners: Sequence[Any] = (), keep: bool = True) -> _StepSpool:
+    return _single_spool(await _ingest_upload(file, lambda: scanners, keep))
+
+
+async def _analyze_spool(spool: _StepSpool, pricing: Dict[str, Any], opts: Dict[str, str]) -> Dict[str, Any]:
+    geometry, sha, tier = await _geometry_for(spool, opts)
+    return _priced(geometry, sha, tier, pricing)
+
+
+def _priced(geometry: Dict[str, Any], sha: str, tier: str, pricing: Dict[str, Any]) -> Dict[str, Any]:
+    result = _apply_material(geometry, pricing["material"], pricing["density_kg_m3"], pricing["weights_for"])
+    result["sha256"] = sha
+    result["cache"] = tier
+    return result
+
+
+async def _analyze_ingested(
+    spools: List[_StepSpool],
+    pricing: Dict[str, Any],
+    opts: Dict[str, str],
+) -> Dict[str, Any]:
+    """
+    Analyseert wat _Ingest opleverde en sluit de spools. Een zip met meerdere
+    STEP-bestanden geeft per member een resultaat, net als /analyze-batch.
+    """
+    if len(spools) == 1:
+        try:
+            result = await _analyze_spool(spools[0], pricing, opts)
+        finally:
+            spools[0].close()
+        return _describe_source(result, spools[0])
+
+    async def run(spool: _StepSpool) -> Dict[str, Any]:
+        label = {"member": spool.name}
+        try:
+            return {**label, "ok": True, **(await _analyze_spool(spool, pricing, opts))}
+        except HTTPException as e:
+            return {**label, "ok": False, "status_code": e.status_code, "error": e.detail}
+        except Exception as e:
+            log.exception("Zip-member %s faalde", spool.name)
+            return {**label, "ok": False, "status_code": 500, "error": f"Analyseren faalde: {type(e).__name__}: {e}"}
+        finally:
+            spool.close()
+
+    try:
+        members = await asyncio.gather(*(run(spool) for spool in spools))
+    finally:
+        for spool in spools:
+            spool.close()
+    return _zip_summary(members, pricing)
+
+
+def _zip_summary(members: List[Dict[str, Any]], pricing: Dict[str, Any]) -> Dict[str, Any]:
+    done = [m for m in members if m["ok"]]
+    result = {
+        "compression": "zip",
+        "count": len(members),
+        "succeeded": len(done),
+        "failed": len(members) - len(done),
+        "volume_m3": round(sum(m["volume_m3"] for m in done), 6),
+        "weight_kg": round(sum(m["weight_kg"] for m in done), 4),
+        "members": members,
+    }
+    if pricing["weights_for"] and done:
+        totals = np.sum([m["weights"]["weight_kg"] for m in done], axis=0)
+        result["weights"] = {**done[0]["weights"], "weight_kg": np.round(totals, 4).tolist()}
+        result["weights"].pop("bodies_weight_kg", None)
+    return result
+
+
+# ====== Analyze via URL (JSON) ======
+@app.post("/analyze-url")
+async def analyze_step_url(body: AnalyzeUrlRequest, request: Request):
+    """
+    Download een STEP vanaf body.file_url en analyseer deze.
+    """
+    return await _unless_disconnected(request, _analyze_url(body))
+
+
+async def _analyze_url(body: AnalyzeUrlRequest) -> Dict[str, Any]:
+    _set_time_budget(body.timeout_s)
+    opts = _geometry_opts(obb=body.obb, precision=body.precision)
+    pricing = _pricing(body.material, body.density_kg_m3, body.materials, body.densities_kg_m3)
+    url = _normalize_url(body.file_url)
+    # Identieke requests die tegelijk lopen delen ook de download
+    key = "url:" + json.dumps([url, opts, pricing], sort_keys=True)
+    return await _IN_FLIGHT.run(key, lambda: _analyze_url_once(url, pricing, opts))
+
+
+async def _analyze_url_once(url: str, pricing: Dict[str, Any], opts: Dict[str, str]) -> Dict[str, Any]:
+    # 1) Download (gzip/STEPZ/zip worden onderweg uitgepakt); conditioneel als
+    #    de geometrie van de vorige download nog in de cache staat
+    entry = _url_entry(url)
+    cached = _cached_members(entry, opts)
+    spools, validators = await _download_members(url, validators=entry if cached else None)
+    if spools is None:
+        _METRICS.inc("step_analyzer_url_revalidations_total", result="not_modified")
+        result = _revalidated(cached, pricing)
+        result["source"] = url
+        return result
+    _METRICS.inc("step_analyzer_url_revalidations_total", result="modified" if cached else "uncached")
 
     # 2) Parse + analyse
     try:
-        occ = _need_occ()
-        shape = _read_step_shape(occ, data)
-        result = _analyze_shape(occ, shape, body.material or "steel", body.density_kg_m3)
+        result = await _analyze_ingested(spools, pricing, opts)
+        _remember_url(url, validators, spools)
         result["source"] = url
         return result
     except HTTPException:
@@ -281,36 +3340,525 @@ def analyze_step_url(body: AnalyzeUrlRequest):
     except Exception as e:
         log.exception("Analyze-url faalde")
         raise HTTPException(status_code=500, detail=f"Analyseren faalde: {type(e).__name__}: {e}")
+    finally:
+        for spool in spools:
+            spool.close()
+
+
+def _revalidated(cached, pricing: Dict[str, Any]) -> Dict[str, Any]:
+    """Hetzelfde resultaat als _analyze_ingested, maar uit de cache na een 304."""
+    members = []
+    for member, geometry, tier in cached:
+        result = _priced(geometry, member["sha256"], tier, pricing)
+        members.append((member, result))
+    if len(members) == 1:
+        member, result = members[0]
+        # zoals _describe_source
+        if member["compression"]:
+            result["compression"] = member["compression"]
+        if member["compression"] == "zip":
+            result["member"] = member["name"]
+    else:
+        result = _zip_summary([{"member": m["name"], "ok": True, **r} for m, r in members], pricing)
+    result["download"] = "not_modified"
+    return result
 
 
 # ====== Analyze via upload (multipart/form-data) ======
 @app.post("/analyze")
 async def analyze_upload(
+    request: Request,
     file: UploadFile = File(...),
     material: str = "steel",
     density_kg_m3: Optional[float] = None,
+    materials: Optional[str] = None,
+    densities_kg_m3: Optional[str] = None,
+    obb: Optional[str] = None,
+    precision: Optional[str] = None,
+    timeout_s: Optional[float] = None,
 ):
     """
-    Upload een .step/.stp en krijg L/B/H (mm), volume (m^3) en gewicht (kg) terug.
+    Upload een .step/.stp (of .stpz/.gz/.zip) en krijg L/B/H (mm), volume (m^3)
+    en gewicht (kg) terug. Een zip met meerdere STEP-bestanden geeft per member
+    een resultaat. Met materials=steel,stainless,aluminum (en/of
+    densities_kg_m3=...) komen de gewichten voor al die materialen mee uit
+    dezelfde geometrie. timeout_s begrenst de rekentijd (max STEP_JOB_TIMEOUT_S).
     """
-    if not file.filename.lower().endswith((".step", ".stp")):
-        raise HTTPException(status_code=400, detail="Alleen .step/.stp bestanden zijn toegestaan.")
+    _check_upload_name(file.filename)
+    opts = _geometry_opts(obb=obb, precision=precision)
+    pricing = _pricing(material, density_kg_m3, materials, densities_kg_m3)
+    _set_time_budget(timeout_s)
 
-    data = await file.read()
-    if not data:
-        raise HTTPException(status_code=400, detail="Leeg bestand.")
+    spools = await _ingest_upload(file)
+    return await _unless_disconnected(request, _analyze_uploaded(spools, file.filename, pricing, opts))
 
+
+async def _analyze_uploaded(
+    spools: List[_StepSpool],
+    filename: str,
+    pricing: Dict[str, Any],
+    opts: Dict[str, str],
+) -> Dict[str, Any]:
+    """Analyseert een al gespoolde upload en ruimt de spools daarna op."""
     try:
-        occ = _need_occ()
-        shape = _read_step_shape(occ, data)
-        result = _analyze_shape(occ, shape, material, density_kg_m3)
-        result["filename"] = file.filename
+        if not any(spool.size for spool in spools):
+            raise HTTPException(status_code=400, detail="Leeg bestand.")
+
+        result = await _analyze_ingested(spools, pricing, opts)
+        result["filename"] = filename
         return result
     except HTTPException:
         raise
     except Exception as e:
         log.exception("Analyze (upload) faalde")
         raise HTTPException(status_code=500, detail=f"Analyseren faalde: {type(e).__name__}: {e}")
+    finally:
+        for spool in spools:
+            spool.close()
+
+# ====== Preflight: snelle check vóór een volledige analyse ======
+class PreflightUrlRequest(BaseModel):
+    file_url: str
+
+
+@app.post("/preflight")
+async def preflight_upload(file: UploadFile = File(...)):
+    """
+    Scant een upload zonder OCCT: schema (AP203/AP214/AP242), eenheden,
+    entiteiten (incl. zware types) en producten, plus een ruwe kostenschatting.
+    """
+    scanner = _StepPreflight()
+    # keep=False: de bytes alleen scannen en hashen, niet bewaren
+    spool = await _spool_upload(file, scanners=(scanner,), keep=False)
+    spool.close()
+    with _stage("preflight"):
+        result = scanner.result()
+    result["filename"] = file.filename
+    result["sha256"] = spool.sha256
+    result["memory"] = _memory_estimate(spool)
+    return _describe_source(result, spool)
+
+
+@app.post("/preflight-url")
+async def preflight_url(body: PreflightUrlRequest):
+    url = _normalize_url(body.file_url)
+    scanner = _StepPreflight()
+    spool = await _download_step(url, scanners=(scanner,))
+    try:
+        with _stage("preflight"):
+            result = scanner.result()
+        result["source"] = url
+        result["sha256"] = spool.sha256
+        result["memory"] = _memory_estimate(spool)
+        return _describe_source(result, spool)
+    finally:
+        spool.close()
+
+
+# ====== Metadata: producten/assembly/eenheden via de entity-index ======
+@app.post("/metadata")
+async def metadata_upload(file: UploadFile = File(...)):
+    spool = await _spool_upload(file)
+    try:
+        result = await _spool_metadata(spool)
+    finally:
+        spool.close()
+    result["filename"] = file.filename
+    return _describe_source(result, spool)
+
+
+@app.post("/metadata-url")
+async def metadata_url(body: PreflightUrlRequest):
+    url = _normalize_url(body.file_url)
+    spool = await _download_step(url)
+    try:
+        result = await _spool_metadata(spool)
+    finally:
+        spool.close()
+    result["source"] = url
+    result["sha256"] = spool.sha256
+    return _describe_source(result, spool)
+
+
+# ====== Batch: veel uploads en/of URL's in één request ======
+_BATCH_CONCURRENCY = int(os.getenv("STEP_BATCH_CONCURRENCY", "0")) or _WORKERS
+_BATCH_MAX_ITEMS = int(os.getenv("STEP_BATCH_MAX_ITEMS", "500"))
+
+
+@app.post("/analyze-batch")
+async def analyze_batch(
+    request: Request,
+    files: List[UploadFile] = File(default=[]),
+    urls: List[str] = Form(default=[]),
+    material: str = "steel",
+    density_kg_m3: Optional[float] = None,
+    materials: Optional[str] = None,
+    densities_kg_m3: Optional[str] = None,
+    obb: Optional[str] = None,
+    precision: Optional[str] = None,
+    timeout_s: Optional[float] = None,
+):
+    """
+    Analyseer alle uploads (form field: `files`) en URL's (form field: `urls`)
+    parallel, begrensd door STEP_BATCH_CONCURRENCY. Een fout in één item laat de
+    rest van de batch gewoon doorgaan; elk item krijgt een eigen resultaat.
+    timeout_s geldt per item.
+    """
+    items = [("upload", f) for f in files] + [("url", u) for u in urls if u and u.strip()]
+    if not items:
+        raise HTTPException(status_code=400, detail="Geen bestanden of URL's meegegeven.")
+    if len(items) > _BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Te veel items in één batch ({len(items)} > {_BATCH_MAX_ITEMS}).",
+        )
+
+    opts = _geometry_opts(obb=obb, precision=precision)
+    pricing = _pricing(material, density_kg_m3, materials, densities_kg_m3)
+    _set_time_budget(timeout_s)
+    slots = asyncio.Semaphore(_BATCH_CONCURRENCY)
+
+    async def run(index: int, kind: str, ref) -> Dict[str, Any]:
+        label: Dict[str, Any] = {"index": index}
+        async with slots:
+            try:
+                if kind == "upload":
+                    label["filename"] = ref.filename
+                    _check_upload_name(ref.filename)
+                    spools = await _ingest_upload(ref)
+                    if not any(spool.size for spool in spools):
+                        for spool in spools:
+                            spool.close()
+                        raise HTTPException(status_code=400, detail="Leeg bestand.")
+                    result = await _analyze_ingested(spools, pricing, opts)
+                else:
+                    label["source"] = _normalize_url(ref)
+                    result = await _analyze_url_once(label["source"], pricing, opts)
+                return {**label, "ok": True, **result}
+            except HTTPException as e:
+                return {**label, "ok": False, "status_code": e.status_code, "error": e.detail}
+            except Exception as e:
+                log.exception("Batch-item %d faalde", index)
+                return {
+                    **label,
+                    "ok": False,
+                    "status_code": 500,
+                    "error": f"Analyseren faalde: {type(e).__name__}: {e}",
+                }
+
+    results = await _unless_disconnected(
+        request, asyncio.gather(*(run(i, kind, ref) for i, (kind, ref) in enumerate(items)))
+    )
+    succeeded = sum(1 for r in results if r["ok"])
+    return {
+        "count": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "items": results,
+    }
+
+
+# ====== Jobs: asynchroon analyseren, resultaat ophalen via /jobs/{id} ======
+# Voor assemblies die langer duren dan de timeout van de reverse proxy: de
+# request geeft meteen een job-id terug en de analyse loopt op de achtergrond
+# in de worker-pool. Resultaten blijven STEP_JOB_TTL_S seconden bewaard
+# (per API-proces, in het geheugen).
+_JOB_TTL_S = float(os.getenv("STEP_JOB_TTL_S", "3600"))
+_JOBS: Dict[str, Dict[str, Any]] = {}
+_SSE_KEEPALIVE_S = 15.0
+
+
+class _EventLog:
+    """
+    Alle voortgangsevents van één job, met volgnummer. Een lezer die opnieuw
+    verbindt (reload) krijgt de geschiedenis vanaf Last-Event-ID en volgt dan
+    live verder; de job zelf wordt daarvoor niet opnieuw gestart.
+    """
+
+    def __init__(self):
+        self.events: List[Any] = []  # (stage, data)
+        self.closed = False
+        self._changed = asyncio.Event()
+
+    def emit(self, stage: str, data: Dict[str, Any]) -> None:
+        self.events.append((stage, data))
+        self._wake()
+
+    def close(self) -> None:
+        self.closed = True
+        self._wake()
+
+    def _wake(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self, start: int = 0):
+        """Levert (id, stage, data); None als er een tijd niets gebeurde (keep-alive)."""
+        seq = start
+        while True:
+            while seq < len(self.events):
+                yield (seq, *self.events[seq])
+                seq += 1
+            if self.closed:
+                return
+            try:
+                await asyncio.wait_for(self._changed.wait(), _SSE_KEEPALIVE_S)
+            except asyncio.TimeoutError:
+                yield None
+
+
+def _sse(events: _EventLog, start: int = 0) -> StreamingResponse:
+    async def stream():
+        async for item in events.follow(start):
+            if item is None:
+                yield ": keep-alive\n\n"
+                continue
+            seq, stage, data = item
+            yield f"id: {seq}\nevent: {stage}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+    # X-Accel-Buffering: nginx zou de events anders bufferen tot de job klaar is
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _purge_jobs() -> None:
+    now = time.time()
+    for job_id in [j for j, job in _JOBS.items() if job.get("expires_at", math.inf) < now]:
+        del _JOBS[job_id]
+
+
+def _job_view(job: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in job.items() if not k.startswith("_")}
+
+
+async def _post_callback(job: Dict[str, Any]) -> None:
+    url = job["_callback_url"]
+    try:
+        resp = await _http_client().post(url, json=_job_view(job))
+        job["callback_status"] = resp.status_code
+    except Exception as e:
+        log.warning("Callback naar %s mislukte: %s: %s", url, type(e).__name__, e)
+        job["callback_status"] = f"{type(e).__name__}: {e}"
+
+
+async def _run_job(job: Dict[str, Any], work) -> None:
+    events = job["_events"]
+    _PROGRESS.set(events)  # alleen in de context van deze task
+    job["status"] = "running"
+    job["started_at"] = time.time()
+    try:
+        job["result"] = await work
+        job["status"] = "done"
+    except HTTPException as e:
+        job.update(status="failed", status_code=e.status_code, error=e.detail)
+    except Exception as e:
+        log.exception("Job %s faalde", job["job_id"])
+        job.update(status="failed", status_code=500, error=f"Analyseren faalde: {type(e).__name__}: {e}")
+    if job["status"] == "done":
+        events.emit("result", job["result"])
+    else:
+        events.emit("error", {"status_code": job["status_code"], "detail": job["error"]})
+    events.close()
+    job["finished_at"] = time.time()
+    job["expires_at"] = job["finished_at"] + _JOB_TTL_S
+    job.pop("_task", None)
+    if job.get("_callback_url"):
+        await _post_callback(job)
+
+
+def _submit_job(work, callback_url: Optional[str], **meta) -> Dict[str, Any]:
+    _purge_jobs()
+    job_id = uuid.uuid4().hex
+    job = {"job_id": job_id, "status": "queued", "created_at": time.time(), **meta}
+    if callback_url:
+        job["_callback_url"] = _normalize_url(callback_url)
+    view = {"job_id": job_id, "status": job["status"], "poll": f"/jobs/{job_id}", "events": f"/jobs/{job_id}/events"}
+    job["_events"] = _EventLog()
+    job["_events"].emit("job", view)
+    _JOBS[job_id] = job
+    # Referentie bewaren, anders kan de event loop de task opruimen
+    job["_task"] = asyncio.get_running_loop().create_task(_run_job(job, work))
+    return view
+
+
+@app.post("/jobs/analyze", status_code=202)
+async def submit_upload_job(
+    file: UploadFile = File(...),
+    material: str = "steel",
+    density_kg_m3: Optional[float] = None,
+    materials: Optional[str] = None,
+    densities_kg_m3: Optional[str] = None,
+    obb: Optional[str] = None,
+    precision: Optional[str] = None,
+    timeout_s: Optional[float] = None,
+    callback_url: Optional[str] = None,
+):
+    """Zoals /analyze, maar geeft meteen een job-id terug."""
+    _check_upload_name(file.filename)
+    opts = _geometry_opts(obb=obb, precision=precision)
+    pricing = _pricing(material, density_kg_m3, materials, densities_kg_m3)
+    _set_time_budget(timeout_s)  # de job-task erft het budget
+    # De upload moet binnen deze request gelezen worden; de analyse niet.
+    spools = await _ingest_upload(file)
+    work = _analyze_uploaded(spools, file.filename, pricing, opts)
+    return _submit_job(work, callback_url, filename=file.filename)
+
+
+@app.post("/jobs/analyze-url", status_code=202)
+async def submit_url_job(body: AnalyzeUrlJobRequest):
+    """Zoals /analyze-url, maar geeft meteen een job-id terug; downloaden gebeurt ook op de achtergrond."""
+    # Ongeldige opties en onbekende materialen meteen afwijzen
+    _geometry_opts(obb=body.obb, precision=body.precision)
+    _pricing(body.material, body.density_kg_m3, body.materials, body.densities_kg_m3)
+    _set_time_budget(body.timeout_s)
+    return _submit_job(_analyze_url(body), body.callback_url, source=_normalize_url(body.file_url))
+
+
+def _find_job(job_id: str) -> Dict[str, Any]:
+    _purge_jobs()
+    job = _JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Onbekende of verlopen job.")
+    return job
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    return _job_view(_find_job(job_id))
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request):
+    """
+    Server-Sent Events van een job: job, download, parsed, transfer (percent),
+    bbox, volume (percent) en tot slot result of error. Na een reload verder
+    lezen met de Last-Event-ID-header; de job loopt gewoon door.
+    """
+    job = _find_job(job_id)
+    last = request.headers.get("Last-Event-ID", "")
+    return _sse(job["_events"], int(last) + 1 if last.isdigit() else 0)
+
+
+# ====== Streaming: analyse als job, voortgang en resultaat als SSE ======
+@app.post("/analyze-stream")
+async def analyze_upload_stream(
+    file: UploadFile = File(...),
+    material: str = "steel",
+    density_kg_m3: Optional[float] = None,
+    materials: Optional[str] = None,
+    densities_kg_m3: Optional[str] = None,
+    obb: Optional[str] = None,
+    precision: Optional[str] = None,
+    timeout_s: Optional[float] = None,
+):
+    """
+    Zoals /analyze, maar het antwoord is een SSE-stream met de voortgang en
+    als laatste event het resultaat. Het eerste event noemt de job; bij een
+    verbroken verbinding loopt die door en is hij te volgen via /jobs/{id}/events.
+    """
+    view = await submit_upload_job(
+        file, material, density_kg_m3, materials, densities_kg_m3, obb, precision, timeout_s
+    )
+    return _sse(_JOBS[view["job_id"]]["_events"])
+
+
+@app.post("/analyze-url-stream")
+async def analyze_url_stream(body: AnalyzeUrlJobRequest):
+    """Zoals /analyze-url, als SSE-stream (zie /analyze-stream); de download-voortgang zit erbij."""
+    view = await submit_url_job(body)
+    return _sse(_JOBS[view["job_id"]]["_events"])
+
+
+# ====== Estimate: benaderde L/B/H in milliseconden, exact resultaat optioneel als job ======
+class EstimateUrlRequest(AnalyzeUrlRequest):
+    follow: bool = False                # ook de exacte analyse als job starten
+    callback_url: Optional[str] = None
+
+
+def _estimate_response(scanner: _StepPreflight, points: _PointCollector) -> Dict[str, Any]:
+    with _stage("estimate"):
+        preflight = scanner.result()
+        unit = preflight["length_unit"] or {}
+        estimate = points.result(unit.get("to_mm"))
+    if estimate is None:
+        raise HTTPException(status_code=400, detail="Geen 3D CARTESIAN_POINT-entiteiten gevonden; is dit een STEP-file?")
+    estimate["approximate"] = True
+    estimate["length_unit"] = unit.get("name")
+    # Assembly-plaatsingen worden niet toegepast: bij meerdere instanties van
+    # hetzelfde part is de schatting de bbox van de part-geometrie zelf.
+    estimate["products"] = preflight["products"]
+    return estimate
+
+
+@app.post("/estimate")
+async def estimate_upload(
+    file: UploadFile = File(...),
+    material: str = "steel",
+    density_kg_m3: Optional[float] = None,
+    materials: Optional[str] = None,
+    densities_kg_m3: Optional[str] = None,
+    obb: Optional[str] = None,
+    precision: Optional[str] = None,
+    timeout_s: Optional[float] = None,
+    follow: bool = False,
+    callback_url: Optional[str] = None,
+):
+    """
+    Benaderde L/B/H uit de CARTESIAN_POINT-entiteiten, zonder OCCT. Met
+    follow=true start meteen ook de exacte analyse als job (zie /jobs/{id}).
+    """
+    _check_upload_name(file.filename)
+    opts = _geometry_opts(obb=obb, precision=precision)
+    pricing = _pricing(material, density_kg_m3, materials, densities_kg_m3)
+    _set_time_budget(timeout_s)
+    scanner, points = _StepPreflight(), _PointCollector()
+    spool = await _spool_upload(file, scanners=(scanner, points))
+    try:
+        result = _estimate_response(scanner, points)
+    except BaseException:
+        spool.close()
+        raise
+    result["filename"] = file.filename
+    _describe_source(result, spool)
+    if follow:
+        work = _analyze_uploaded([spool], file.filename, pricing, opts)
+        result["job"] = _submit_job(work, callback_url, filename=file.filename)
+    else:
+        spool.close()
+    return result
+
+
+@app.post("/estimate-url")
+async def estimate_url(body: EstimateUrlRequest):
+    opts = _geometry_opts(obb=body.obb, precision=body.precision)
+    pricing = _pricing(body.material, body.density_kg_m3, body.materials, body.densities_kg_m3)
+    _set_time_budget(body.timeout_s)
+    url = _normalize_url(body.file_url)
+    scanner, points = _StepPreflight(), _PointCollector()
+    spool = await _download_step(url, scanners=(scanner, points))
+    try:
+        result = _estimate_response(scanner, points)
+    except BaseException:
+        spool.close()
+        raise
+    result["source"] = url
+    _describe_source(result, spool)
+    if body.follow:
+        async def exact() -> Dict[str, Any]:
+            try:
+                analysis = await _analyze_spool(spool, pricing, opts)
+            finally:
+                spool.close()
+            analysis["source"] = url
+            return _describe_source(analysis, spool)
+
+        result["job"] = _submit_job(exact(), body.callback_url, source=url)
+    else:
+        spool.close()
+    return result
 
 
 if __name__ == "__main__":
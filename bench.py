@@ -0,0 +1,249 @@
+"""
+Benchmark voor _read_step_shape en _measure_shape.
+
+Genereert met OCCT een synthetisch STEP-corpus met gecontroleerde complexiteit
+(boxen, afgeronde blokken, B-spline-vlakken en assemblies van ~10 tot ~100k
+vlakken), meet elke stap apart en schrijft schaalcurves (tijd en piek-RSS
+tegen vlakken/entiteiten/bytes) als JSON. Alles draait offline.
+
+    python bench.py --out bench.json
+    python bench.py --max-faces 10000 --repeat 5
+"""
+import os
+import re
+import json
+import math
+import time
+import argparse
+import importlib
+import resource
+import statistics
+import multiprocessing
+from typing import Any, Dict, List
+
+import app
+
+_FACE_TARGETS = (10, 100, 1_000, 10_000, 100_000)
+_ENTITY_RE = re.compile(rb"^\s*#\d+\s*=", re.MULTILINE)
+
+
+# ===== OCCT-symbolen (OCP of pythonocc-core, net als in app._resolve_occ) =====
+# Per naam de plekken waar hij kan staan; OCP 8 verhuisde de arrays naar
+# OCP.collections en de statische casts verloren daar hun _s.
+_SYMBOLS = {
+    "BRepPrimAPI_MakeBox": [("BRepPrimAPI", "BRepPrimAPI_MakeBox")],
+    "BRepPrimAPI_MakePrism": [("BRepPrimAPI", "BRepPrimAPI_MakePrism")],
+    "BRepFilletAPI_MakeFillet": [("BRepFilletAPI", "BRepFilletAPI_MakeFillet")],
+    "BRepBuilderAPI_Transform": [("BRepBuilderAPI", "BRepBuilderAPI_Transform")],
+    "BRepBuilderAPI_MakeFace": [("BRepBuilderAPI", "BRepBuilderAPI_MakeFace")],
+    "BRep_Builder": [("BRep", "BRep_Builder")],
+    "TopoDS_Compound": [("TopoDS", "TopoDS_Compound")],
+    "TopoDS_Edge": [("TopoDS", "TopoDS.Edge_s"), ("TopoDS", "TopoDS.Edge"), ("TopoDS", "topods.Edge")],
+    "TopExp_Explorer": [("TopExp", "TopExp_Explorer")],
+    "TopAbs_EDGE": [("TopAbs", "TopAbs_EDGE")],
+    "TopAbs_FACE": [("TopAbs", "TopAbs_FACE")],
+    "TopAbs_SOLID": [("TopAbs", "TopAbs_SOLID")],
+    "gp_Pnt": [("gp", "gp_Pnt")],
+    "gp_Vec": [("gp", "gp_Vec")],
+    "gp_Trsf": [("gp", "gp_Trsf")],
+    "TColgp_Array2OfPnt": [("TColgp", "TColgp_Array2OfPnt"), ("collections", "Array2_gp_Pnt")],
+    "GeomAPI_PointsToBSplineSurface": [("GeomAPI", "GeomAPI_PointsToBSplineSurface")],
+    "STEPControl_Writer": [("STEPControl", "STEPControl_Writer")],
+    "STEPControl_AsIs": [("STEPControl", "STEPControl_AsIs")],
+}
+
+
+def _symbol(prefix: str, places) -> Any:
+    for module, path in places:
+        try:
+            obj = importlib.import_module(prefix + module)
+            for attr in path.split("."):
+                obj = getattr(obj, attr)
+            return obj
+        except (ImportError, AttributeError):
+            continue
+    return None
+
+
+class _Occ:
+    def __init__(self):
+        # Eén backend voor alles: een module die wel importeert maar een naam
+        # mist (OCP.TColgp in OCP 8) telt als ontbrekend, niet als crash
+        missing = {}
+        for prefix in ("OCP.", "OCC.Core."):
+            symbols = {name: _symbol(prefix, places) for name, places in _SYMBOLS.items()}
+            missing[prefix] = [name for name, obj in symbols.items() if obj is None]
+            if not missing[prefix]:
+                self.__dict__.update(symbols)
+                return
+        raise SystemExit(
+            "Geen complete OCC/OCP CAD-backend gevonden; ontbrekend: "
+            + "; ".join(f"{prefix} {', '.join(names)}" for prefix, names in missing.items())
+        )
+
+    def count(self, shape, kind) -> int:
+        explorer = self.TopExp_Explorer(shape, kind)
+        n = 0
+        while explorer.More():
+            n += 1
+            explorer.Next()
+        return n
+
+
+# ===== Corpus =====
+def _box(o: _Occ, size: float = 10.0):
+    return o.BRepPrimAPI_MakeBox(size, size, size).Shape()
+
+
+def _filleted(o: _Occ, size: float = 10.0):
+    box = _box(o, size)
+    fillet = o.BRepFilletAPI_MakeFillet(box)
+    explorer = o.TopExp_Explorer(box, o.TopAbs_EDGE)
+    while explorer.More():
+        fillet.Add(size * 0.1, o.TopoDS_Edge(explorer.Current()))
+        explorer.Next()
+    return fillet.Shape()
+
+
+def _bspline_slab(o: _Occ, grid: int, size: float = 50.0):
+    """Een golvend B-spline-vlak met grid x grid controlepunten, geëxtrudeerd tot solid."""
+    points = o.TColgp_Array2OfPnt(1, grid, 1, grid)
+    for i in range(1, grid + 1):
+        for j in range(1, grid + 1):
+            x = size * (i - 1) / (grid - 1)
+            y = size * (j - 1) / (grid - 1)
+            z = 2.0 * math.sin(x / 4.0) * math.cos(y / 5.0)
+            points.SetValue(i, j, o.gp_Pnt(x, y, z))
+    surface = o.GeomAPI_PointsToBSplineSurface(points).Surface()
+    face = o.BRepBuilderAPI_MakeFace(surface, 1e-6).Face()
+    return o.BRepPrimAPI_MakePrism(face, o.gp_Vec(0, 0, 10)).Shape()
+
+
+def _assembly(o: _Occ, parts: List[Any], spacing: float = 20.0):
+    """Kopieën van de parts op een vierkant raster in één compound."""
+    builder = o.BRep_Builder()
+    compound = o.TopoDS_Compound()
+    builder.MakeCompound(compound)
+    side = max(1, math.ceil(math.sqrt(len(parts))))
+    for n, part in enumerate(parts):
+        trsf = o.gp_Trsf()
+        trsf.SetTranslation(o.gp_Vec((n % side) * spacing, (n // side) * spacing, 0))
+        builder.Add(compound, o.BRepBuilderAPI_Transform(part, trsf, True).Shape())
+    return compound
+
+
+def _corpus(o: _Occ, max_faces: int):
+    """Levert (soort, doel-vlakken, shape) voor alle cases tot max_faces."""
+    yield "box", 6, _box(o)
+    yield "filleted", 26, _filleted(o)
+    for grid in (8, 32, 128):
+        yield f"bspline_{grid}", grid * grid, _bspline_slab(o, grid)
+    for target in _FACE_TARGETS:
+        if target > max_faces:
+            break
+        yield "assembly", target, _assembly(o, [_box(o)] * max(1, target // 6))
+
+
+def _write_step(o: _Occ, shape, path: str) -> None:
+    writer = o.STEPControl_Writer()
+    writer.Transfer(shape, o.STEPControl_AsIs)
+    writer.Write(path)
+
+
+# ===== Meten =====
+def _analyze_file(path: str) -> Dict[str, Any]:
+    occ = app._need_occ()
+    shape = app._read_step_shape(occ, path)
+    return app._measure_shape(occ, shape, app._geometry_opts())
+
+
+def _measure_once(path: str) -> Dict[str, Any]:
+    """Draait in een vers proces, zodat ru_maxrss alleen deze case meet."""
+    t0 = time.perf_counter()
+    geometry, stats = app._collected(_analyze_file, path)
+    total = time.perf_counter() - t0
+    return {
+        "total_s": total,
+        "stages": stats["stages"],
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "solids": geometry["solids"],
+    }
+
+
+def _measure(path: str, repeat: int) -> Dict[str, Any]:
+    ctx = multiprocessing.get_context("fork")
+    runs = []
+    for _ in range(repeat):
+        with ctx.Pool(1, maxtasksperchild=1) as pool:
+            runs.append(pool.apply(_measure_once, (path,)))
+    stages = {name: statistics.median(r["stages"].get(name, 0.0) for r in runs) for name in runs[0]["stages"]}
+    return {
+        "total_s": statistics.median(r["total_s"] for r in runs),
+        "stages_s": stages,
+        "peak_rss_bytes": max(r["peak_rss_bytes"] for r in runs),
+        "solids": runs[0]["solids"],
+    }
+
+
+def _slope(points: List[List[float]]) -> float:
+    """Exponent k in t ~ x^k (kleinste kwadraten op log-log)."""
+    pts = [(math.log(x), math.log(y)) for x, y in points if x > 0 and y > 0]
+    if len(pts) < 2:
+        return float("nan")
+    mx = sum(x for x, _ in pts) / len(pts)
+    my = sum(y for _, y in pts) / len(pts)
+    den = sum((x - mx) ** 2 for x, _ in pts)
+    return sum((x - mx) * (y - my) for x, y in pts) / den if den else float("nan")
+
+
+def _curves(cases: List[Dict[str, Any]]) -> Dict[str, Any]:
+    curves = {}
+    for x in ("faces", "entities", "bytes"):
+        for y, key in (("time", "total_s"), ("rss", "peak_rss_bytes")):
+            points = sorted([c[x], c[key]] for c in cases)
+            curves[f"{y}_vs_{x}"] = {"points": points, "loglog_slope": round(_slope(points), 3)}
+    return curves
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default="bench.json", help="JSON-uitvoer (default bench.json)")
+    parser.add_argument("--corpus-dir", default="bench-corpus", help="map voor de gegenereerde STEP-files")
+    parser.add_argument("--max-faces", type=int, default=max(_FACE_TARGETS), help="grootste assembly (vlakken)")
+    parser.add_argument("--repeat", type=int, default=3, help="metingen per case (mediaan)")
+    args = parser.parse_args()
+
+    o = _Occ()
+    os.makedirs(args.corpus_dir, exist_ok=True)
+    cases = []
+    for kind, target, shape in _corpus(o, args.max_faces):
+        path = os.path.join(args.corpus_dir, f"{kind}_{target}.step")
+        if not os.path.exists(path):
+            _write_step(o, shape, path)
+        with open(path, "rb") as f:
+            entities = len(_ENTITY_RE.findall(f.read()))
+        case = {
+            "kind": kind,
+            "target_faces": target,
+            "faces": o.count(shape, o.TopAbs_FACE),
+            "entities": entities,
+            "bytes": os.path.getsize(path),
+            **_measure(path, args.repeat),
+        }
+        print(f"{kind:>12} faces={case['faces']:>7} bytes={case['bytes']:>11} "
+              f"total={case['total_s']:.3f}s rss={case['peak_rss_bytes'] / 2**20:.0f}MB")
+        cases.append(case)
+
+    report = {
+        "backend": app._need_occ()["flavor"],
+        "repeat": args.repeat,
+        "cases": cases,
+        "curves": _curves(cases),
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Rapport geschreven naar {args.out}")
+
+
+if __name__ == "__main__":
+    main()
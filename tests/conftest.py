@@ -0,0 +1,30 @@
+import os
+import tempfile
+
+import pytest
+
+# Vóór de import van app: caches in een eigen map, één worker, geen warm-up
+os.environ["STEP_CACHE_DIR"] = tempfile.mkdtemp(prefix="step-analyzer-test-")
+os.environ.setdefault("STEP_WORKERS", "1")
+os.environ.setdefault("STEP_WARMUP", "0")
+
+import app  # noqa: E402
+from fastapi import HTTPException  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def client():
+    # Eén client (en dus één event loop) voor de hele sessie: de gedeelde
+    # httpx-client en de worker-pool horen bij die loop
+    with TestClient(app.app) as c:
+        yield c
+
+
+@pytest.fixture(scope="session")
+def occ():
+    """De CAD-backend; tests die OCCT nodig hebben worden zonder backend overgeslagen."""
+    try:
+        return app._need_occ()
+    except HTTPException:
+        pytest.skip("geen OCC/OCP CAD-backend")
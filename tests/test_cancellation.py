@@ -0,0 +1,132 @@
+"""Afbreken van analyses: tijdsbudget in de worker, harde kill, en een client die weggaat."""
+import asyncio
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+import app
+
+
+def _pid():
+    return os.getpid()
+
+
+def _checking():
+    # Zoals een analyse tussen de OCCT-stappen: _check_cancel bij elk controlepunt
+    while True:
+        app._check_cancel()
+        time.sleep(0.01)
+
+
+def _stuck():
+    time.sleep(30)  # een OCCT-aanroep zonder controlepunt
+
+
+def _with_pool(body):
+    async def go():
+        pool = app._WorkerPool(1)
+        pool.start()
+        try:
+            return await body(pool)
+        finally:
+            pool.shutdown()
+
+    return asyncio.run(go())
+
+
+def test_deadline_is_enforced_inside_the_worker():
+    async def body(pool):
+        before, _ = await pool.run(_pid)
+        with pytest.raises(HTTPException) as e:
+            await pool.run(_checking, deadline=time.monotonic() + 0.2)
+        after, _ = await pool.run(_pid)
+        return e.value.status_code, before == after
+
+    # De worker stopte zelf en blijft in dienst
+    assert _with_pool(body) == (504, True)
+
+
+def test_worker_without_checkpoint_is_killed_after_the_grace(monkeypatch):
+    monkeypatch.setattr(app, "_CANCEL_GRACE_S", 0.2)
+
+    async def body(pool):
+        before, _ = await pool.run(_pid)
+        t0 = time.monotonic()
+        with pytest.raises(HTTPException) as e:
+            await pool.run(_stuck, deadline=time.monotonic() + 0.2)
+        elapsed = time.monotonic() - t0
+        after, _ = await pool.run(_pid)
+        return e.value.status_code, elapsed, before != after
+
+    status, elapsed, replaced = _with_pool(body)
+    assert status == 504
+    assert elapsed < 5
+    assert replaced
+
+
+def test_cancelled_caller_signals_the_worker():
+    async def body(pool):
+        before, _ = await pool.run(_pid)
+        job = asyncio.ensure_future(pool.run(_checking))
+        await asyncio.sleep(0.2)
+        job.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await job
+        # SIGUSR1: de worker breekt af met een 499, wordt leeggelezen en komt terug
+        after, _ = await asyncio.wait_for(pool.run(_pid), 5)
+        return before == after
+
+    assert _with_pool(body)
+
+
+def test_disconnect_cancels_the_work():
+    async def go():
+        disconnected = asyncio.Event()
+
+        async def receive():
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        request = SimpleNamespace(receive=receive, url=SimpleNamespace(path="/analyze"))
+        work_cancelled = asyncio.Event()
+
+        async def work():
+            try:
+                await asyncio.sleep(30)
+            except asyncio.CancelledError:
+                work_cancelled.set()
+                raise
+
+        asyncio.get_running_loop().call_later(0.05, disconnected.set)
+        with pytest.raises(HTTPException) as e:
+            await app._unless_disconnected(request, work())
+        await asyncio.wait_for(work_cancelled.wait(), 1)
+        return e.value.status_code
+
+    assert asyncio.run(go()) == 499
+
+
+def test_finished_work_wins_from_the_watcher():
+    async def go():
+        async def receive():
+            await asyncio.sleep(30)
+
+        async def work():
+            return "klaar"
+
+        request = SimpleNamespace(receive=receive, url=SimpleNamespace(path="/analyze"))
+        return await app._unless_disconnected(request, work())
+
+    assert asyncio.run(go()) == "klaar"
+
+
+def test_timeout_s_must_be_positive(client):
+    resp = client.post(
+        "/analyze",
+        params={"timeout_s": 0},
+        files={"file": ("cube.step", app._WARMUP_STEP, "application/octet-stream")},
+    )
+    assert resp.status_code == 400
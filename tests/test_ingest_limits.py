@@ -0,0 +1,88 @@
+"""Grenzen bij het uitpakken van gzip/STEPZ en zip: bommen mogen nooit de schijf vullen."""
+import gzip
+import io
+import zipfile
+
+import pytest
+from fastapi import HTTPException
+
+import app
+
+_STEP = app._WARMUP_STEP
+
+
+def _ingest(raw: bytes):
+    ingest = app._Ingest()
+    try:
+        for i in range(0, len(raw), 64 * 1024):
+            ingest.write(raw[i:i + 64 * 1024])
+        return ingest.finish()
+    finally:
+        ingest.close()
+
+
+def _zip(members) -> bytes:
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members:
+            zf.writestr(name, data)
+    return out.getvalue()
+
+
+def _status(raw: bytes) -> int:
+    with pytest.raises(HTTPException) as e:
+        _ingest(raw)
+    return e.value.status_code
+
+
+def test_gzip_bomb_stops_at_max_bytes(monkeypatch):
+    monkeypatch.setattr(app, "_MAX_BYTES", 1024 * 1024)
+    bomb = gzip.compress(b"\0" * (64 * 1024 * 1024))  # ~64 KB gecomprimeerd
+    assert len(bomb) < app._MAX_BYTES
+    assert _status(bomb) == 413
+
+
+def test_gzip_roundtrip_is_the_plain_step():
+    (spool,) = _ingest(gzip.compress(_STEP))
+    assert spool.compression == "gzip"
+    assert spool.size == len(_STEP)
+    spool.close()
+
+
+def test_zip_with_too_many_members(monkeypatch):
+    monkeypatch.setattr(app, "_ZIP_MAX_MEMBERS", 3)
+    assert _status(_zip([(f"p{i}.step", _STEP) for i in range(4)])) == 400
+
+
+def test_zip_members_within_limits():
+    spools = _ingest(_zip([("a.step", _STEP), ("b.stp", _STEP), ("notes.txt", b"x")]))
+    assert [s.name for s in spools] == ["a.step", "b.stp"]
+    for spool in spools:
+        spool.close()
+
+
+def test_zip_declared_total_over_the_cap(monkeypatch):
+    monkeypatch.setattr(app, "_ZIP_MAX_TOTAL_BYTES", 3 * len(_STEP))
+    with pytest.raises(HTTPException) as e:
+        _ingest(_zip([(f"p{i}.step", _STEP) for i in range(4)]))
+    assert e.value.status_code == 413
+    assert "zip" in e.value.detail
+
+
+def test_zip_of_stpz_members_counts_the_real_size(monkeypatch):
+    # De centrale directory kent alleen de gzip-grootte; pas het uitpakken telt echt
+    monkeypatch.setattr(app, "_MAX_BYTES", 4 * 1024 * 1024)
+    monkeypatch.setattr(app, "_ZIP_MAX_TOTAL_BYTES", 4 * 1024 * 1024)
+    layer = gzip.compress(b"\0" * (3 * 1024 * 1024))
+    raw = _zip([(f"p{i}.stpz", layer) for i in range(3)])
+    with pytest.raises(HTTPException) as e:
+        _ingest(raw)
+    assert e.value.status_code == 413
+    assert "zip" in e.value.detail
+
+
+def test_upload_of_a_gzip_bomb_is_413(client, monkeypatch):
+    monkeypatch.setattr(app, "_MAX_BYTES", 1024 * 1024)
+    bomb = gzip.compress(b"\0" * (16 * 1024 * 1024))
+    resp = client.post("/analyze", files={"file": ("bomb.stpz", bomb, "application/octet-stream")})
+    assert resp.status_code == 413
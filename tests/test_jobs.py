@@ -0,0 +1,71 @@
+"""De asynchrone job-API: meteen een job-id, daarna pollen of de events volgen."""
+import time
+
+import pytest
+
+import app
+
+_CUBE = app._WARMUP_STEP.replace(b"2024-01-01T00:00:00", b"2024-05-05T05:05:05")
+
+
+def _submit(client, data: bytes, **params):
+    resp = client.post(
+        "/jobs/analyze", params=params, files={"file": ("part.step", data, "application/octet-stream")}
+    )
+    assert resp.status_code == 202, resp.text
+    return resp.json()
+
+
+def _wait(client, view, timeout_s: float = 30):
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        job = client.get(view["poll"]).json()
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.05)
+    pytest.fail(f"job {view['job_id']} niet klaar binnen {timeout_s}s")
+
+
+def _events(client, view):
+    resp = client.get(view["events"])
+    assert resp.headers["content-type"].startswith("text/event-stream")
+    return [line.split(": ", 1)[1] for line in resp.text.splitlines() if line.startswith("event: ")]
+
+
+def test_job_runs_in_the_background(client, occ):
+    view = _submit(client, _CUBE, material="aluminium")
+    assert view["status"] == "queued"
+    assert view["poll"] == f"/jobs/{view['job_id']}"
+
+    job = _wait(client, view)
+    assert job["status"] == "done", job
+    assert job["result"]["volume_m3"] == pytest.approx(1e-6)
+    assert job["finished_at"] >= job["started_at"] >= job["created_at"]
+    assert not any(k.startswith("_") for k in job)
+
+    events = _events(client, view)
+    assert events[0] == "job"
+    assert events[-1] == "result"
+
+
+def test_failed_job_keeps_status_and_detail(client, occ):
+    view = _submit(client, b"ISO-10303-21;\nHEADER;\nENDSEC;\nDATA;\n#1=RUBBISH(;\nENDSEC;\nEND-ISO-10303-21;\n")
+    job = _wait(client, view)
+    assert job["status"] == "failed"
+    assert 400 <= job["status_code"] < 600
+    assert job["error"]
+    assert _events(client, view)[-1] == "error"
+
+
+def test_invalid_options_are_rejected_before_queueing(client):
+    resp = client.post(
+        "/jobs/analyze",
+        params={"precision": "ultra"},
+        files={"file": ("part.step", _CUBE, "application/octet-stream")},
+    )
+    assert resp.status_code == 400
+
+
+def test_unknown_job_is_404(client):
+    assert client.get("/jobs/bestaat-niet").status_code == 404
+    assert client.get("/jobs/bestaat-niet/events").status_code == 404
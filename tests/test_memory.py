@@ -0,0 +1,113 @@
+"""Het geheugenbudget: toelaten, wachten, weigeren, en de reservering voor een fan-out."""
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import app
+
+MB = 1024 * 1024
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def test_admits_what_fits_and_releases_it():
+    async def go():
+        gov = app._MemoryGovernor(100 * MB)
+        async with gov.admit(60 * MB) as r:
+            assert gov.reserved == 60 * MB
+            assert app._RESERVATION.get() is r
+        assert gov.reserved == 0
+        assert app._RESERVATION.get() is None
+
+    _run(go())
+
+
+def test_never_fitting_job_is_413():
+    async def go():
+        gov = app._MemoryGovernor(100 * MB)
+        async with gov.admit(101 * MB):
+            pass
+
+    with pytest.raises(HTTPException) as e:
+        _run(go())
+    assert e.value.status_code == 413
+
+
+def test_waits_for_memory_then_503(monkeypatch):
+    monkeypatch.setattr(app, "_MEM_QUEUE_TIMEOUT_S", 0.05)
+
+    async def go():
+        gov = app._MemoryGovernor(100 * MB)
+        async with gov.admit(60 * MB):
+            async with gov.admit(60 * MB):
+                pass
+
+    with pytest.raises(HTTPException) as e:
+        _run(go())
+    assert e.value.status_code == 503
+    assert e.value.headers["Retry-After"]
+
+
+def test_waiter_starts_when_memory_is_released():
+    async def go():
+        gov = app._MemoryGovernor(100 * MB)
+        order = []
+
+        async def job(name, hold):
+            async with gov.admit(60 * MB):
+                order.append(name)
+                await asyncio.sleep(hold)
+
+        await asyncio.gather(job("a", 0.05), job("b", 0))
+        return order, gov.reserved
+
+    assert _run(go()) == (["a", "b"], 0)
+
+
+def test_calibration_learns_only_from_translations():
+    async def go():
+        gov = app._MemoryGovernor(1024 * MB)
+        async with gov.admit(100 * MB, learn=False) as r:
+            r.observe(400 * MB)
+        assert gov.calibration == 1.0
+        async with gov.admit(100 * MB) as r:
+            r.observe(200 * MB)
+        assert gov.calibration == pytest.approx(2.0)
+
+    _run(go())
+
+
+@pytest.mark.parametrize("capacity, expected", [(1000 * MB, 4), (250 * MB, 2), (100 * MB, 1)])
+def test_fan_out_reserves_per_concurrent_worker(monkeypatch, capacity, expected):
+    per_worker = 100 * MB
+
+    async def go():
+        gov = app._MemoryGovernor(capacity)
+        active = peak = 0
+        reserved = []
+
+        async def fake_run(fn, path, indices, precision):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            reserved.append(gov.reserved)
+            await asyncio.sleep(0.01)
+            active -= 1
+            return [{"dims_mm": [1, 1, 1], "volume_m3": 1.0, "volume_fallback": False,
+                     "volume_rel_tolerance": None} for _ in indices]
+
+        monkeypatch.setattr(app, "_MEMORY", gov)
+        monkeypatch.setattr(app, "_WORKERS", 4)
+        monkeypatch.setattr(app, "_run_in_pool", fake_run)
+        geometry = {"precision": "standard", "_fanout": {"path": "unused", "count": 10, "owned": False}}
+        geometry = await app._fan_out_solids(geometry, per_worker)
+        return geometry, peak, set(reserved), gov.reserved
+
+    geometry, peak, reserved, after = _run(go())
+    assert geometry["solids"] == 10
+    assert peak == expected
+    assert reserved == {expected * per_worker}
+    assert after == 0
@@ -0,0 +1,34 @@
+import pytest
+
+import app
+
+# Eigen bytes (andere FILE_NAME-tijd): de geometrie-cache van andere tests blijft koud
+_CUBE = app._WARMUP_STEP.replace(b"2024-01-01T00:00:00", b"2024-03-03T03:03:03")
+
+
+def _analyze(client, precision: str):
+    resp = client.post(
+        "/analyze",
+        params={"precision": precision},
+        files={"file": ("cube.step", _CUBE, "application/octet-stream")},
+    )
+    assert resp.status_code == 200, resp.text
+    return resp.json()["precision"]
+
+
+def test_fast_reports_the_requested_tolerance(client, occ):
+    # OCCT geeft bij grove Eps de Eps zelf terug; dat is een grens, geen fout
+    precision = _analyze(client, "fast")
+    assert precision["tier"] == "fast"
+    assert precision["volume_rel_tolerance"] == pytest.approx(1e-2)
+    assert precision["volume_abs_tolerance_m3"] == pytest.approx(1e-8)
+    assert "volume_rel_error" not in precision
+
+
+def test_exact_tolerance_within_requested_eps(client, occ):
+    precision = _analyze(client, "exact")
+    assert precision["volume_rel_tolerance"] <= 1e-6
+
+
+def test_standard_has_no_tolerance(client, occ):
+    assert _analyze(client, "standard")["volume_rel_tolerance"] is None
@@ -0,0 +1,10 @@
+import app
+
+
+def test_read_stream_supported_after_analysis(occ):
+    # Met bytes i.p.v. een file-object gaf OCP 8 een TypeError, en bleef de
+    # in-memory route de rest van het proces uit
+    app._READ_STREAM_OK = None
+    shape = app._read_step_shape(occ, app._WARMUP_STEP)
+    assert app._READ_STREAM_OK is True
+    assert app._measure_shape(occ, shape)["volume_m3"] > 0
@@ -0,0 +1,66 @@
+"""Geen shape-*.tmp achterlaten in de BRep-cache als meten mislukt of een worker wegvalt."""
+import hashlib
+import os
+import time
+
+import pytest
+
+import app
+
+
+def _tmp_files():
+    return sorted(n for n in os.listdir(app._SHAPE_CACHE.directory) if n.endswith(".tmp"))
+
+
+def _sha(tag: str) -> str:
+    # Eigen key per test: de shape mag niet al in de cache staan
+    return hashlib.sha256(tag.encode()).hexdigest()
+
+
+def test_measure_error_removes_the_new_brep(occ, monkeypatch):
+    def boom(*args, **kwargs):
+        raise RuntimeError("meten faalt")
+
+    monkeypatch.setattr(app, "_measure_shape", boom)
+    before = _tmp_files()
+    with pytest.raises(RuntimeError):
+        app._geometry_job(app._WARMUP_STEP, app._geometry_opts(), _sha("measure-error"))
+    assert _tmp_files() == before
+    assert not os.path.exists(app._SHAPE_CACHE.path(_sha("measure-error")))
+
+
+def test_fanout_copy_is_removed_when_writing_it_fails(occ, monkeypatch):
+    sha = _sha("fanout-copy")
+    # Eerst de shape in de cache, zodat de fan-out een eigen kopie nodig heeft
+    geometry = app._geometry_job(app._WARMUP_STEP, app._geometry_opts(), sha)
+    app._adopt_shape(sha, geometry.pop("_brep"))
+    assert os.path.exists(app._SHAPE_CACHE.path(sha))
+
+    def half_written(shape, path):
+        with open(path, "wb") as f:
+            f.write(b"half")
+        raise OSError("schijf vol")
+
+    monkeypatch.setattr(app, "_WORKERS", 2)
+    monkeypatch.setattr(app, "_SOLID_FANOUT_MIN", 1)
+    monkeypatch.setitem(occ, "BinTools_Write", half_written)
+    before = _tmp_files()
+    with pytest.raises(OSError):
+        app._geometry_job(app._WARMUP_STEP, app._geometry_opts(), sha)
+    assert _tmp_files() == before
+
+
+def test_discarded_result_removes_its_files():
+    paths = [app._brep_tmp(), app._brep_tmp()]
+    app._discard_job_files({"_brep": paths[0], "_fanout": {"path": paths[1], "count": 9, "owned": True}})
+    assert not any(os.path.exists(p) for p in paths)
+
+
+def test_sweep_removes_only_stale_tmp():
+    stale, fresh = app._brep_tmp(), app._brep_tmp()
+    old = time.time() - app._SHAPE_TMP_MAX_AGE_S - 60
+    os.utime(stale, (old, old))
+    app._sweep_shape_tmp()
+    assert not os.path.exists(stale)
+    assert os.path.exists(fresh)
+    os.unlink(fresh)
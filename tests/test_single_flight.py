@@ -0,0 +1,162 @@
+"""
+Single-flight: gelijke analyses tegelijk één keer doen. Twee _SingleFlight's op
+dezelfde map gedragen zich als twee API-processen: flock geldt per open file.
+"""
+import asyncio
+import fcntl
+import os
+
+import pytest
+from fastapi import HTTPException
+
+import app
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+class _Compute:
+    """compute() die telt hoe vaak hij draait en pas klaar is na release()."""
+
+    def __init__(self, result="klaar", error=None):
+        self.calls = 0
+        self.result = result
+        self.error = error
+        self.gate = None
+
+    async def __call__(self):
+        self.calls += 1
+        if self.gate is None:
+            self.gate = asyncio.Event()
+        await self.gate.wait()
+        if self.error is not None and self.calls == 1:
+            raise self.error
+        return self.result
+
+    def release(self):
+        self.gate.set()
+
+
+def test_concurrent_requests_compute_once(tmp_path):
+    async def go():
+        flight = app._SingleFlight(str(tmp_path))
+        compute = _Compute()
+        tasks = [asyncio.ensure_future(flight.run("k", compute)) for _ in range(5)]
+        await asyncio.sleep(0.01)
+        compute.release()
+        return await asyncio.gather(*tasks), compute.calls
+
+    results, calls = _run(go())
+    assert results == ["klaar"] * 5
+    assert calls == 1
+
+
+@pytest.mark.parametrize("status", [499, 504])
+def test_waiter_retries_after_leader_only_error(tmp_path, status):
+    async def go():
+        flight = app._SingleFlight(str(tmp_path))
+        compute = _Compute(error=HTTPException(status_code=status, detail="leider"))
+        leader = asyncio.ensure_future(flight.run("k", compute))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.ensure_future(flight.run("k", compute))
+        await asyncio.sleep(0.01)
+        compute.release()
+        with pytest.raises(HTTPException):
+            await leader
+        return await waiter, compute.calls
+
+    assert _run(go()) == ("klaar", 2)
+
+
+def test_waiter_retries_after_leader_is_cancelled(tmp_path):
+    async def go():
+        flight = app._SingleFlight(str(tmp_path))
+        compute = _Compute()
+        leader = asyncio.ensure_future(flight.run("k", compute))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.ensure_future(flight.run("k", compute))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        await asyncio.sleep(0.01)
+        compute.release()
+        return await waiter, compute.calls
+
+    assert _run(go()) == ("klaar", 2)
+
+
+def test_other_errors_are_shared(tmp_path):
+    async def go():
+        flight = app._SingleFlight(str(tmp_path))
+        compute = _Compute(error=HTTPException(status_code=400, detail="kapotte STEP"))
+        tasks = [asyncio.ensure_future(flight.run("k", compute)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        compute.release()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        return [r.status_code for r in results], compute.calls
+
+    assert _run(go()) == ([400, 400, 400], 1)
+
+
+def test_second_process_waits_and_reads_the_cache(tmp_path):
+    async def go():
+        cache = {}
+        first, second = app._SingleFlight(str(tmp_path)), app._SingleFlight(str(tmp_path))
+        compute = _Compute()
+
+        async def compute_and_store():
+            cache["k"] = await compute()
+            return cache["k"]
+
+        a = asyncio.ensure_future(first.run("k", compute_and_store, recheck=lambda: cache.get("k")))
+        await asyncio.sleep(0.01)
+        b = asyncio.ensure_future(second.run("k", compute_and_store, recheck=lambda: cache.get("k")))
+        await asyncio.sleep(0.2)
+        assert not b.done()  # de lock is van de eerste
+        compute.release()
+        return await a, await b, compute.calls, os.listdir(tmp_path)
+
+    assert _run(go()) == ("klaar", "klaar", 1, [])
+
+
+def test_waiting_on_another_process_is_bounded_by_the_budget(tmp_path):
+    async def go():
+        first, second = app._SingleFlight(str(tmp_path)), app._SingleFlight(str(tmp_path))
+        compute = _Compute()
+        a = asyncio.ensure_future(first.run("k", compute, recheck=lambda: None))
+        await asyncio.sleep(0.01)
+        app._TIME_BUDGET.set(0.2)
+        try:
+            with pytest.raises(HTTPException) as e:
+                await second.run("k", compute, recheck=lambda: None)
+        finally:
+            compute.release()
+            await a
+        return e.value.status_code, compute.calls
+
+    assert _run(go()) == (504, 1)
+
+
+def test_lock_is_exclusive_across_unlink(tmp_path):
+    path = str(tmp_path / "x.lock")
+    held = app._try_flock(path)
+    assert held is not None
+    assert app._try_flock(path) is None
+    # Zo laat _lead los: eerst weghalen, dan sluiten
+    stale = os.open(path, os.O_RDWR)
+    os.unlink(path)
+    os.close(held)
+    new = app._try_flock(path)
+    assert new is not None
+    # De oude inode is nu vrij, maar path wijst naar de nieuwe
+    fcntl.flock(stale, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    assert os.fstat(stale).st_ino != os.stat(path).st_ino
+    assert app._try_flock(path) is None
+    os.close(stale)
+    os.close(new)
+
+
+def test_recheck_does_not_count_as_a_miss():
+    before = dict(app._GEOMETRY_CACHE.stats)
+    assert app._cached_geometry("bestaat-niet") is None
+    assert app._GEOMETRY_CACHE.stats == before
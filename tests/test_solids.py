@@ -0,0 +1,93 @@
+"""Per-solid analyse: elke solid apart gemeten, ook verdeeld over de workers (fan-out)."""
+import asyncio
+import os
+
+import pytest
+
+import app
+
+MB = 1024 * 1024
+
+
+@pytest.fixture(scope="module")
+def two_boxes(occ, tmp_path_factory):
+    """(STEP-bytes, BRep-pad) van een compound met blokken van 10 en 20 mm, los van elkaar."""
+    prim = pytest.importorskip("OCP.BRepPrimAPI")
+    from OCP.BRep import BRep_Builder
+    from OCP.gp import gp_Pnt
+    from OCP.STEPControl import STEPControl_AsIs, STEPControl_Writer
+    from OCP.TopoDS import TopoDS_Compound
+
+    compound = TopoDS_Compound()
+    builder = BRep_Builder()
+    builder.MakeCompound(compound)
+    builder.Add(compound, prim.BRepPrimAPI_MakeBox(10.0, 10.0, 10.0).Shape())
+    builder.Add(compound, prim.BRepPrimAPI_MakeBox(gp_Pnt(50, 0, 0), 20.0, 20.0, 20.0).Shape())
+
+    directory = tmp_path_factory.mktemp("solids")
+    step = str(directory / "two.step")
+    writer = STEPControl_Writer()
+    writer.Transfer(compound, STEPControl_AsIs)
+    assert writer.Write(step) == 1
+    brep = str(directory / "two.brep")
+    occ["BinTools_Write"](compound, brep)
+    with open(step, "rb") as f:
+        return f.read(), brep
+
+
+def test_every_solid_is_measured(client, two_boxes):
+    resp = client.post(
+        "/analyze",
+        params={"material": "steel"},
+        files={"file": ("two.step", two_boxes[0], "application/octet-stream")},
+    )
+    assert resp.status_code == 200, resp.text
+    result = resp.json()
+    assert result["solids"] == 2
+    assert result["volume_m3"] == pytest.approx(9e-6)
+    bodies = sorted(result["bodies"], key=lambda b: b["volume_m3"])
+    assert [b["length_mm"] for b in bodies] == pytest.approx([10, 20])
+    assert [b["volume_m3"] for b in bodies] == pytest.approx([1e-6, 8e-6])
+    assert sum(b["weight_kg"] for b in bodies) == pytest.approx(result["weight_kg"], abs=1e-3)
+
+
+def _fan_out(monkeypatch, path: str, owned: bool):
+    """_fan_out_solids over een echte pool van twee workers."""
+    async def go():
+        pool = app._WorkerPool(2)
+        pool.start()
+        monkeypatch.setattr(app, "_POOL", pool)
+        try:
+            geometry = {"precision": "standard", "_fanout": {"path": path, "count": 2, "owned": owned}}
+            return await app._fan_out_solids(geometry, MB)
+        finally:
+            pool.shutdown()
+
+    monkeypatch.setattr(app, "_WORKERS", 2)
+    monkeypatch.setattr(app, "_MEMORY", app._MemoryGovernor(64 * MB))
+    return asyncio.run(go())
+
+
+def test_fan_out_matches_serial_measurement(occ, two_boxes, monkeypatch):
+    _, brep = two_boxes
+    shape = occ["TopoDS_Shape"]()
+    occ["BinTools_Read"](shape, brep)
+    serial = app._measure_shape(occ, shape, app._geometry_opts())
+
+    fanned = _fan_out(monkeypatch, brep, owned=False)
+    assert fanned["solids"] == serial["solids"] == 2
+    assert fanned["volume_m3"] == pytest.approx(serial["volume_m3"])
+    for ours, theirs in zip(fanned["bodies"], serial["bodies"]):
+        assert ours["dims_mm"] == pytest.approx(theirs["dims_mm"])
+        assert ours["volume_m3"] == pytest.approx(theirs["volume_m3"])
+    assert os.path.exists(brep)  # niet van de fan-out, dus niet opgeruimd
+
+
+def test_owned_fan_out_copy_is_removed(occ, two_boxes, monkeypatch, tmp_path):
+    _, brep = two_boxes
+    copy = str(tmp_path / "copy.brep")
+    with open(brep, "rb") as src, open(copy, "wb") as dst:
+        dst.write(src.read())
+
+    assert _fan_out(monkeypatch, copy, owned=True)["solids"] == 2
+    assert not os.path.exists(copy)
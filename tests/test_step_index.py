@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+import app
+
+_STEP = b"""ISO-10303-21;
+HEADER;
+FILE_NAME('a;b.step','2024-01-01T00:00:00',(''),(''),'','','');
+ENDSEC;
+DATA;
+#1=PRODUCT('bracket; left','it''s #2=FAKE(1);','',(#2));
+#2=PRODUCT_CONTEXT('',#3,'mechanical');
+#3=APPLICATION_CONTEXT('x = y (z); #9=NOPE();');
+#4=(LENGTH_UNIT()NAMED_UNIT(*)SI_UNIT(.MILLI.,.METRE.));
+ENDSEC;
+END-ISO-10303-21;
+"""
+
+
+@pytest.mark.parametrize("window", [1 << 20, 40, 7])
+def test_quoted_semicolons_do_not_cut_entities(monkeypatch, window):
+    # Kleine vensters: de venstergrens valt dan ook midden in strings
+    monkeypatch.setattr(app, "_INDEX_WINDOW_BYTES", window)
+    index = app._StepIndex.build(_STEP)
+
+    assert index.ids.tolist() == [1, 2, 3, 4]
+    assert index.type_of(1) == "PRODUCT"
+    assert index.type_of(3) == "APPLICATION_CONTEXT"
+    assert index.type_of(4) == ""
+    assert index.entity(1) == b"#1=PRODUCT('bracket; left','it''s #2=FAKE(1);','',(#2));"
+    assert index.args(1) == {"strings": ["bracket; left", "it's #2=FAKE(1);", ""], "refs": [2]}
+    assert index.type_of(9) is None
+
+
+def test_index_roundtrip():
+    index = app._StepIndex.build(_STEP)
+    again = app._StepIndex.loads(_STEP, index.dumps())
+    assert np.array_equal(again.ids, index.ids)
+    assert again.types == index.types
+    assert again.entity(3) == index.entity(3)
@@ -0,0 +1,123 @@
+"""
+Revalidatie van /analyze-url-bronnen tegen een lokale http.server-stub die
+ETag en If-None-Match doet, zoals OneDrive en GitHub raw.
+"""
+import hashlib
+import http.server
+import itertools
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+import app
+
+_PATHS = itertools.count()
+
+
+def _have_backend() -> bool:
+    try:
+        app._need_occ()
+    except HTTPException:
+        return False
+    return True
+
+
+pytestmark = pytest.mark.skipif(not _have_backend(), reason="geen OCC/OCP CAD-backend")
+
+
+class _Remote:
+    """Eén bestand achter een ETag; houdt bij welke requests binnenkwamen."""
+
+    def __init__(self):
+        self.body = b""
+        self.requests = []  # (If-None-Match, status)
+        remote = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                etag = '"%s"' % hashlib.sha256(remote.body).hexdigest()
+                sent = self.headers.get("If-None-Match")
+                if sent == etag:
+                    remote.requests.append((sent, 304))
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                remote.requests.append((sent, 200))
+                self.send_response(200)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(remote.body)))
+                self.end_headers()
+                self.wfile.write(remote.body)
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def url(self) -> str:
+        # Elk test een eigen pad, dus een eigen entry in de URL-cache
+        return f"http://127.0.0.1:{self.server.server_port}/part-{next(_PATHS)}.step"
+
+
+def _cube(stamp: str) -> bytes:
+    """De warm-up-kubus, met een andere FILE_NAME-tijd voor andere bytes (zelfde geometrie)."""
+    return app._WARMUP_STEP.replace(b"2024-01-01T00:00:00", stamp.encode("ascii"))
+
+
+@pytest.fixture
+def remote():
+    r = _Remote()
+    r.body = _cube("2024-01-01T00:00:00")
+    yield r
+    r.server.shutdown()
+    r.server.server_close()
+
+
+def _analyze(client, url: str):
+    resp = client.post("/analyze-url", json={"file_url": url})
+    assert resp.status_code == 200, resp.text
+    return resp.json()
+
+
+def test_first_fetch_downloads_and_analyzes(client, remote):
+    url = remote.url()
+    result = _analyze(client, url)
+
+    assert remote.requests == [(None, 200)]
+    assert result["cache"] == "miss"
+    assert "download" not in result
+    assert result["sha256"] == hashlib.sha256(remote.body).hexdigest()
+    assert result["volume_m3"] == pytest.approx(1e-6)
+
+
+def test_second_fetch_revalidates_with_304(client, remote):
+    url = remote.url()
+    first = _analyze(client, url)
+    second = _analyze(client, url)
+
+    etag = '"%s"' % hashlib.sha256(remote.body).hexdigest()
+    assert remote.requests == [(None, 200), (etag, 304)]
+    assert second["download"] == "not_modified"
+    assert second["cache"] in ("memory", "disk")
+    assert second["sha256"] == first["sha256"]
+    assert second["weight_kg"] == first["weight_kg"]
+
+
+def test_changed_validator_downloads_again(client, remote):
+    url = remote.url()
+    first = _analyze(client, url)
+    old_etag = '"%s"' % hashlib.sha256(remote.body).hexdigest()
+
+    remote.body = _cube("2024-06-01T12:00:00")
+    changed = _analyze(client, url)
+
+    assert remote.requests == [(None, 200), (old_etag, 200)]
+    assert "download" not in changed
+    assert changed["sha256"] == hashlib.sha256(remote.body).hexdigest() != first["sha256"]
+
+    # De nieuwe ETag is onthouden: de volgende keer weer een 304
+    assert _analyze(client, url)["download"] == "not_modified"
+    assert remote.requests[-1][1] == 304
@@ -0,0 +1,126 @@
+"""De geforkte worker-pool: jobs draaien in eigen processen, fouten komen als HTTPException terug."""
+import asyncio
+import os
+import time
+
+import pytest
+from fastapi import HTTPException
+
+import app
+
+
+# Jobs: op moduleniveau, zodat ze naar de worker gepickled kunnen worden
+def _pid():
+    return os.getpid()
+
+
+def _interval(seconds):
+    start = time.monotonic()
+    time.sleep(seconds)
+    return os.getpid(), start, time.monotonic()
+
+
+def _rejected():
+    raise HTTPException(status_code=422, detail="afgekeurd")
+
+
+def _broken():
+    raise ValueError("kapot")
+
+
+def _crash():
+    os._exit(3)  # zoals een segfault in de CAD-kernel: geen antwoord meer
+
+
+def _staged():
+    with app._stage("parse"):
+        return "ok"
+
+
+def _with_pool(size, body):
+    async def go():
+        pool = app._WorkerPool(size)
+        pool.start()
+        try:
+            return await body(pool)
+        finally:
+            pool.shutdown()
+
+    return asyncio.run(go())
+
+
+def test_job_runs_in_a_worker_process():
+    async def body(pool):
+        return await pool.run(_pid)
+
+    pid, stats = _with_pool(1, body)
+    assert pid != os.getpid()
+    assert "peak_rss_bytes" in stats
+
+
+def test_stage_timings_come_back_with_the_result():
+    async def body(pool):
+        return await pool.run(_staged)
+
+    result, stats = _with_pool(1, body)
+    assert result == "ok"
+    assert "parse" in stats["stages"]
+
+
+def test_errors_keep_their_status():
+    async def body(pool):
+        with pytest.raises(HTTPException) as rejected:
+            await pool.run(_rejected)
+        with pytest.raises(HTTPException) as broken:
+            await pool.run(_broken)
+        # De worker blijft bruikbaar na een fout in de job
+        pid, _ = await pool.run(_pid)
+        return rejected.value, broken.value, pid
+
+    rejected, broken, pid = _with_pool(1, body)
+    assert (rejected.status_code, rejected.detail) == (422, "afgekeurd")
+    assert broken.status_code == 500 and "ValueError" in broken.detail
+    assert pid > 0
+
+
+def test_jobs_run_in_parallel_on_separate_workers():
+    async def body(pool):
+        return await asyncio.gather(pool.run(_interval, 0.3), pool.run(_interval, 0.3))
+
+    (a, _), (b, _) = _with_pool(2, body)
+    assert a[0] != b[0]
+    # CLOCK_MONOTONIC is systeembreed: de twee jobs liepen tegelijk
+    assert a[1] < b[2] and b[1] < a[2]
+
+
+def test_crashed_worker_is_replaced():
+    async def body(pool):
+        before, _ = await pool.run(_pid)
+        with pytest.raises(HTTPException) as e:
+            await pool.run(_crash)
+        after, _ = await pool.run(_pid)
+        return before, e.value.status_code, after, len(pool._workers)
+
+    before, status, after, workers = _with_pool(1, body)
+    assert status == 500
+    assert after != before
+    assert workers == 1
+
+
+def test_workers_are_recycled_after_max_jobs(monkeypatch):
+    monkeypatch.setattr(app, "_WORKER_MAX_JOBS", 2)
+
+    async def body(pool):
+        return [(await pool.run(_pid))[0] for _ in range(5)]
+
+    pids = _with_pool(1, body)
+    assert pids[0] == pids[1] != pids[2] == pids[3] != pids[4]
+
+
+def test_workers_are_recycled_above_max_rss(monkeypatch):
+    monkeypatch.setattr(app, "_WORKER_MAX_RSS_BYTES", 1)
+
+    async def body(pool):
+        return [(await pool.run(_pid))[0] for _ in range(3)]
+
+    assert len(set(_with_pool(1, body))) == 3